@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Simulate many riders at once with numpy arrays, see simulator.simulate for one
+#
+# This is separate from simulator so simulate and bike.py simulate don't
+# import numpy.
+from __future__ import annotations
+from typing import Optional, List, Union, Callable
+from dataclasses import dataclass, field
+
+import math
+import time
+import numpy as np
+import path as p
+import simulator as sim
+import instrument
+
+@dataclass
+class BatchResult:
+    """The state of each rider at the end of a batch simulation"""
+    t: np.ndarray # Time in seconds each rider finished
+    v: np.ndarray # Velocity in meters/sec at the finish
+    steps: int    # Number of steps until the last rider finished
+    splits: np.ndarray = field(default_factory=lambda: np.zeros((0, 0))) # [rider, k] time reaching path.kmDistances()[k]
+
+# Called after each step of a batch with the time at the beginning of the step,
+# dt and the distances and velocities of the riders at the end of the step.
+BatchStep = Callable[[float, float, np.ndarray, np.ndarray], None]
+
+# Called before each step of a batch with the distances and velocities of the
+# riders still riding, returns the factor to scale each of their drag by.
+DragFactor = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+def simulateBatch(path: p.Path, prms: List[sim.Params], drag_factor: Optional[DragFactor]=None,
+                  step: Optional[BatchStep]=None, energy: Optional[sim.Energy]=None) -> BatchResult:
+    """
+    Simulate riders, each with their own Params, riding path together from a
+    standing start at distance 0 until the last finishes.
+
+    The riders are arrays so each step is a few numpy operations whatever
+    the number of riders, riders are dropped from the arrays as they finish.
+    A rider's time is the same as simulator.simulate gives for their Params unless
+    drag_factor changes their drag. All the riders share the same time
+    step, prms[0].dt. The energy of all the riders is added to energy.
+    """
+    dt: float = prms[0].dt
+    if any(prm.dt != dt for prm in prms):
+        raise ValueError('All riders must have the same dt')
+    start: float = time.perf_counter() if instrument.enabled else 0.0
+
+    # Forces of each segment at unit mass and rolling coefficient computed as
+    # fRolling and fGravity do so the results are identical, the extra last
+    # entry is the flat road after the end of the path
+    tl = path.trackList()
+    hi: np.ndarray = np.array([pt.tot + pt.dis for pt in tl])
+    rolling: np.ndarray = np.array([sim.g * math.cos(math.atan(pt.slp)) for pt in tl] + [sim.g])
+    gravity: np.ndarray = np.array([sim.g * math.sin(math.atan(pt.slp)) for pt in tl] + [0.0])
+
+    # The riders still riding, ids are their indices in prms
+    ids: np.ndarray = np.arange(len(prms))
+    mass: np.ndarray = np.array([prm.mass for prm in prms])
+    power: np.ndarray = np.array([prm.power for prm in prms])
+    eta: np.ndarray = np.array([prm.eta for prm in prms])
+    rollingCoeff: np.ndarray = np.array([prm.rollingCoeff for prm in prms])
+    kDrag: np.ndarray = np.array([0.5*prm.dragCoeff*prm.frontalArea*prm.rho for prm in prms])
+    v: np.ndarray = np.zeros(len(prms))
+    pv: np.ndarray = np.zeros(len(prms))
+    d: np.ndarray = np.zeros(len(prms))
+
+    # Times reaching each km, k is each riding rider's next boundary
+    boundaries: np.ndarray = np.array(path.kmDistances() + [math.inf])
+    splits: np.ndarray = np.zeros((len(prms), len(boundaries) - 1))
+    k: np.ndarray = np.ones(len(prms), dtype=np.int64)
+    next_split: np.ndarray = boundaries[k]
+
+    # All the riders, for the results and step
+    all_t: np.ndarray = np.zeros(len(prms))
+    all_v: np.ndarray = np.zeros(len(prms))
+    all_d: np.ndarray = np.zeros(len(prms))
+
+    segments: int = len(tl)
+    energy_offsets: np.ndarray = np.arange(len(sim.energy_terms)) * segments
+
+    total_distance: float = path.tot()
+    if total_distance <= 0.0:
+        ids = ids[:0]
+    t: float = 0.0
+    steps: int = 0
+    while len(ids) != 0:
+        j: np.ndarray = np.searchsorted(hi, d) # First segment whose end is >= d
+        drag: np.ndarray = kDrag*v*v
+        if drag_factor is not None:
+            drag = drag * drag_factor(d, v)
+        fRoll: np.ndarray = np.where(v > 0.01, rolling[j] * mass * rollingCoeff, 0.0)
+        fGrav: np.ndarray = gravity[j] * mass
+        totalForce = drag + fRoll + fGrav
+        powerNeeded = totalForce * v / eta
+        netPower = power - powerNeeded
+
+        av = (v + pv) / 2.0
+        sd = av * dt
+        nd: np.ndarray = d + sd
+        last: np.ndarray = nd > total_distance
+        dts: Union[np.ndarray, float] = dt
+        if last.any():
+            # Don't go past the last point
+            dts = np.full(len(ids), dt)
+            dts[last] = (total_distance - d[last]) / av[last]
+            nd[last] = total_distance
+        d = nd
+        pv = v
+        v = np.sqrt(v*v + 2 * netPower * dts * eta / mass)
+        if energy is not None:
+            # One bincount of all the terms, term i of segment j is at i * segments + j
+            work: np.ndarray = power * dts
+            terms: np.ndarray = np.concatenate([work, drag * pv * dts, fRoll * pv * dts, fGrav * pv * dts,
+                                                0.5 * mass * (v*v - pv*pv), (1.0 - eta) * work])
+            where: np.ndarray = (energy_offsets[:, None] + np.minimum(j, segments - 1)[None, :]).ravel()
+            energy.table += np.bincount(where, weights=terms, minlength=energy.table.size).reshape(energy.table.shape)
+        if step is not None:
+            all_d[ids] = d
+            all_v[ids] = v
+            step(t, dt, all_d, all_v)
+        crossed: np.ndarray = d >= next_split
+        while crossed.any():
+            splits[ids[crossed], k[crossed]] = t + (dts[crossed] if isinstance(dts, np.ndarray) else dts) * \
+                (next_split[crossed] - (d[crossed] - sd[crossed])) / sd[crossed]
+            k[crossed] += 1
+            next_split = boundaries[k]
+            crossed = d >= next_split
+
+        done: np.ndarray = d >= total_distance
+        if done.any():
+            all_t[ids[done]] = t + (dts[done] if isinstance(dts, np.ndarray) else dts)
+            all_v[ids[done]] = v[done]
+            keep: np.ndarray = ~done
+            ids, mass, power, eta, rollingCoeff, kDrag, v, pv, d, k, next_split = \
+                (a[keep] for a in (ids, mass, power, eta, rollingCoeff, kDrag, v, pv, d, k, next_split))
+        t += dt
+        steps += 1
+
+    if instrument.enabled:
+        instrument.add('simulate batch', time.perf_counter() - start)
+        instrument.count('batch steps', steps)
+
+    return BatchResult(t=all_t, v=all_v, steps=steps, splits=splits)
+
+if __name__ == '__main__':
+    import gpx_track_list as gpx_tl
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+    path: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_test_file))
+
+    import unittest
+
+    class TestBatch(unittest.TestCase):
+
+        def test_batch_matches_simulate(self: TestBatch):
+            prms: List[sim.Params] = [sim.Params(power=100.0), sim.Params(), sim.Params(power=300.0, mass=70.0, frontalArea=0.35)]
+            batch: BatchResult = simulateBatch(path, prms)
+            i: int
+            for i, prm in enumerate(prms):
+                result: sim.SimResult = sim.simulate(path, prm)
+                self.assertAlmostEqual(batch.t[i], result.t, delta=1e-9)
+                self.assertAlmostEqual(batch.v[i], result.v, delta=1e-9)
+            self.assertEqual(batch.steps, sim.simulate(path, prms[0]).steps)
+            self.assertEqual(batch.splits.shape, (len(prms), len(path.kmDistances())))
+            for i, prm in enumerate(prms):
+                self.assertTrue(np.allclose(batch.splits[i], sim.simulate(path, prm).splits, rtol=0.0, atol=1e-9))
+            self.assertRaises(ValueError, simulateBatch, path, [sim.Params(dt=0.1), sim.Params(dt=0.2)])
+
+        def test_batch_energy(self: TestBatch):
+            prms: List[sim.Params] = [sim.Params(power=150.0), sim.Params(power=250.0, mass=75.0)]
+            together: sim.Energy = sim.Energy(path)
+            simulateBatch(path, prms, energy=together)
+            single: sim.Energy = sim.Energy(path)
+            prm: sim.Params
+            for prm in prms:
+                sim.simulate(path, prm, energy=single)
+            self.assertTrue(np.allclose(together.table, single.table, rtol=1e-9, atol=1e-6))
+            single += together
+            self.assertTrue(np.allclose(single.table, 2.0 * together.table, rtol=1e-9, atol=1e-6))
+
+        def test_empty_path_time_is_0(self: TestBatch):
+            one: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_test_file)[:1])
+            self.assertEqual(simulateBatch(one, [sim.Params()]).t[0], 0.0)
+
+    unittest.main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+# Benchmark every stage of the pipeline
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple, Callable, Any
+from dataclasses import dataclass, asdict
+
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import track_point as tp
+import path as p
+import gpx_track_list as gpx_tl
+import tcx_track_list as tcx_tl
+import csv_track_list as csv_tl
+import simulator as sim
+import track_file as tf
+import track_columns as tc
+import track_diff as td
+
+data_dirs: List[str] = ['./data', './test/data']
+
+@dataclass
+class Result:
+    name: str   # stage/input
+    secs: float # Best wall time of all repeats
+    n: int      # Number of items processed, points, lookups or steps
+
+    def rate(self: Result) -> float:
+        """Items per second"""
+        return self.n / self.secs if self.secs > 0.0 else math.inf
+
+def best(fn: Callable[[], Any], repeat: int) -> float:
+    """Return the best wall time in seconds of repeat calls to fn"""
+    secs: float = math.inf
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        fn()
+        secs = min(secs, time.perf_counter() - start)
+    return secs
+
+def mkSyntheticTrackList(n: int, seed: int=1, step: float=10.0) -> List[tp.TrackPoint]:
+    """
+    Return a list of n TrackPoints about step meters apart which wander
+    like a road with rolling hills, times are for a 10 m/s ride.
+    """
+    rnd: random.Random = random.Random(seed)
+    lat: float = math.radians(37.0)
+    lon: float = math.radians(-107.0)
+    brg: float = rnd.uniform(0.0, 2.0 * math.pi)
+    tl: List[tp.TrackPoint] = []
+    i: int
+    for i in range(n):
+        tot: float = i * step
+        ele: float = 2000.0 + (100.0 * math.sin(tot / 3000.0)) + (10.0 * math.sin(tot / 170.0))
+        tl.append(tp.TrackPoint(lat=math.degrees(lat), lon=math.degrees(lon), ele=ele, tim=1577000000.0 + (tot / 10.0)))
+        brg += rnd.gauss(0.0, 0.05)
+        lat += math.cos(brg) * step / tp.earthR1
+        lon += math.sin(brg) * step / (tp.earthR1 * math.cos(lat))
+    return tl
+
+def writeGpx(tl: List[tp.TrackPoint], filename: str) -> None:
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">\n <trk>\n  <trkseg>\n')
+        pt: tp.TrackPoint
+        for pt in tl:
+            lat, lon, _, _ = pt.decDegrees()
+            f.write(f'   <trkpt lat="{lat}" lon="{lon}">\n    <ele>{pt.ele}</ele>\n   </trkpt>\n')
+        f.write('  </trkseg>\n </trk>\n</gpx>\n')
+
+def writeTcx(tl: List[tp.TrackPoint], filename: str) -> None:
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">\n' + \
+                ' <Activities>\n  <Activity Sport="Biking">\n   <Lap>\n    <Track>\n')
+        pt: tp.TrackPoint
+        for pt in tl:
+            lat, lon, _, _ = pt.decDegrees()
+            f.write('     <Trackpoint>\n' + \
+                    f'      <Time>{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(pt.tim))}</Time>\n' + \
+                    f'      <Position>\n       <LatitudeDegrees>{lat}</LatitudeDegrees>\n       <LongitudeDegrees>{lon}</LongitudeDegrees>\n      </Position>\n' + \
+                    f'      <AltitudeMeters>{pt.ele}</AltitudeMeters>\n' + \
+                    '      <HeartRateBpm>\n       <Value>120</Value>\n      </HeartRateBpm>\n' + \
+                    '      <Extensions>\n       <TPX xmlns="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n' + \
+                    '        <Speed>10.0</Speed>\n        <Watts>150</Watts>\n       </TPX>\n      </Extensions>\n' + \
+                    '     </Trackpoint>\n')
+        f.write('    </Track>\n   </Lap>\n  </Activity>\n </Activities>\n</TrainingCenterDatabase>\n')
+
+class Bench:
+    """Run the stages and collect the Results"""
+
+    def __init__(self: Bench, repeat: int=3, lookups: int=10_000, verbose: bool=True) -> None:
+        self.repeat: int = repeat
+        self.lookups: int = lookups
+        self.verbose: bool = verbose
+        self.results: List[Result] = []
+
+    def add(self: Bench, name: str, fn: Callable[[], Any], n: int, repeat: Optional[int]=None) -> Result:
+        r: Result = Result(name=name, secs=best(fn, self.repeat if repeat is None else repeat), n=n)
+        self.results.append(r)
+        if self.verbose:
+            print(f'{r.name:<56} {r.secs * 1e3:>11.3f}ms {r.n:>10} {r.rate():>14.0f}/s', file=sys.stderr)
+        return r
+
+    def parse(self: Bench, label: str, filename: str) -> List[tp.TrackPoint]:
+        """Benchmark parsing filename and return its TrackPoints"""
+        _, extension = os.path.splitext(filename)
+        reader: Callable[..., List[tp.TrackPoint]] = gpx_tl.GpxTrackList if extension == '.gpx' else tcx_tl.TcxTrackList
+        tl: List[tp.TrackPoint] = reader(filename)
+        self.add(f'{extension[1:]}_parse/{label}', lambda: reader(filename), len(tl))
+        self.add(f'{extension[1:]}_parse_geometry/{label}', lambda: reader(filename, tp.geometry_fields), len(tl))
+        return tl
+
+    def compressed(self: Bench, label: str, filename: str) -> None:
+        """
+        Benchmark reading filename plain and compressed by each of
+        tf.compressions, streaming the bytes and parsing the TrackPoints.
+        """
+        extension: str = tf.trackExtension(filename)[1:]
+        with open(filename, 'rb') as f:
+            data: bytes = f.read()
+        points: int = len(tf.readTrackList(filename))
+
+        def stream(name: str) -> None:
+            with tf.openTrack(name) as f:
+                while f.read(1 << 20):
+                    pass
+
+        with tempfile.TemporaryDirectory() as tmp:
+            suffix: str
+            for suffix in [''] + list(tf.compressions):
+                name: str = os.path.join(tmp, os.path.basename(filename) + suffix)
+                opener: Callable[..., Any] = importlib.import_module(tf.compressions[suffix]).open if suffix else open
+                with opener(name, 'wb') as f:
+                    f.write(data)
+                kind: str = suffix[1:] if suffix else 'plain'
+                self.add(f'{extension}_read_{kind}/{label}', lambda: stream(name), len(data))
+                self.add(f'{extension}_parse_{kind}/{label}', lambda: tf.readTrackList(name), points)
+
+    def route(self: Bench, label: str, tl: List[tp.TrackPoint], simulate: bool=True) -> None:
+        """Benchmark the stages which operate on a list of TrackPoints"""
+        self.add(f'path_build/{label}', lambda: p.Path(tl), len(tl))
+        path: p.Path = p.Path(tl)
+
+        rnd: random.Random = random.Random(1)
+        distances: List[float] = [rnd.uniform(0.0, path.tot()) for _ in range(self.lookups)]
+        self.add(f'getTrackPoint/{label}', lambda: [path.getTrackPoint(d) for d in distances], len(distances))
+        self.add(f'slpRadians/{label}', lambda: [path.slpRadians(d) for d in distances], len(distances))
+
+        header: List[str] = tp.mkCsvHeader()
+        strg: str = csv_tl.writeTrackListAsCsvToStr(tl, header=header)
+        self.add(f'csv_write/{label}', lambda: csv_tl.writeTrackListAsCsvToStr(tl, header=header), len(tl))
+        self.add(f'csv_read/{label}', lambda: csv_tl.CsvStrTrackList(strg), len(tl))
+        self.add(f'csv_read_geometry/{label}', lambda: csv_tl.CsvStrTrackList(strg, tp.geometry_fields), len(tl))
+
+        cols: tc.TrackColumns = tc.mkTrackColumns(path.trackList())
+        other: tc.TrackColumns = {name: col.copy() for name, col in cols.items()}
+        self.add(f'track_diff/{label}', lambda: td.diffColumns(cols, other, default=td.Tolerance(1e-9, 1e-9)), len(tl))
+
+        if simulate:
+            steps: int = sim.simulate(path).steps
+            self.add(f'simulate/{label}', lambda: sim.simulate(path), steps, repeat=1)
+
+    def files(self: Bench) -> None:
+        """Benchmark the tracks in data_dirs"""
+        d: str
+        for d in data_dirs:
+            if not os.path.isdir(d):
+                continue
+            name: str
+            for name in sorted(os.listdir(d)):
+                _, extension = os.path.splitext(name)
+                if extension in ('.gpx', '.tcx'):
+                    self.route(name, self.parse(name, os.path.join(d, name)))
+                    self.compressed(name, os.path.join(d, name))
+
+    def synthetic(self: Bench, sizes: List[int], sim_points: int) -> None:
+        """Benchmark synthetic tracks of each size"""
+        n: int
+        for n in sizes:
+            tl: List[tp.TrackPoint] = mkSyntheticTrackList(n)
+            with tempfile.TemporaryDirectory() as tmp:
+                gpx: str = os.path.join(tmp, 'synthetic.gpx')
+                tcx: str = os.path.join(tmp, 'synthetic.tcx')
+                writeGpx(tl, gpx)
+                writeTcx(tl, tcx)
+                self.parse(f'synthetic_{n}', gpx)
+                self.parse(f'synthetic_{n}', tcx)
+            self.route(f'synthetic_{n}', tl, simulate=(n <= sim_points))
+
+    def startup(self: Bench, repeat: int=10) -> List[str]:
+        """
+        Benchmark the cold start of bike.py subcommands in a new interpreter
+        and return the heavy modules any subcommand imported when it should
+        not have.
+        """
+        route: str = './test/data/RAAM_TS00_route_snippet.gpx'
+        commands: Dict[str, List[str]] = {
+            'python': ['-c', 'pass'],
+            'bike_help': ['bike.py', '--help'],
+            'bike_info_gpx': ['bike.py', 'info', route],
+            'bike_simulate_gpx': ['bike.py', 'simulate', route],
+        }
+        label: str
+        argv: List[str]
+        for label, argv in commands.items():
+            cmd: List[str] = [sys.executable] + argv
+            self.add(f'startup/{label}', lambda: subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True), 1, repeat=repeat)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_file: str = os.path.join(tmp, 'route.csv')
+            csv_tl.writeTrackListAsCsvToFile(p.Path(gpx_tl.GpxTrackList(route)).trackList(), csv_file, header=tp.mkCsvHeader())
+            files: Dict[str, str] = {'csv': csv_file, 'gpx': route, 'tcx': './test/data/RAAM_TS21_ride_snippet.tcx',
+                                     'out': os.path.join(tmp, 'out.csv')}
+            return heavyImports(files)
+
+# Modules which are slow to import
+heavy_modules: List[str] = ['numpy', 'xml.etree.ElementTree', 'tap', 'urllib.request']
+
+# Each bike.py command, with {csv}, {gpx}, {tcx} and {out} replaced by files, and the heavy modules it must not import.
+# Only convert may need tap and only the xml formats ElementTree, nothing needs numpy or urllib.
+startup_imports: List[Tuple[str, List[str]]] = [
+    ('simulate {gpx}', ['numpy', 'tap', 'urllib.request']),
+    ('simulate {csv}', heavy_modules),
+    ('info {gpx}', ['numpy', 'tap', 'urllib.request']),
+    ('info {tcx}', ['numpy', 'tap', 'urllib.request']),
+    ('info {csv}', heavy_modules),
+    ('convert {tcx} {out}', ['numpy', 'urllib.request']),
+    ('convert {csv} {out}', ['numpy', 'xml.etree.ElementTree', 'urllib.request']),
+]
+
+def heavyImports(files: Dict[str, str]) -> List[str]:
+    """Run each of startup_imports in a new interpreter and return a description of each module it shouldn't have imported"""
+    found: List[str] = []
+    command: str
+    modules: List[str]
+    for command, modules in startup_imports:
+        argv: List[str] = [arg.format(**files) for arg in command.split()]
+        code: str = 'import sys, io, contextlib, bike\n' + \
+                    'with contextlib.redirect_stdout(io.StringIO()):\n' + \
+                    f'    bike.main({argv!r})\n' + \
+                    f'print(" ".join(m for m in {modules!r} if m in sys.modules))'
+        out: str = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True, text=True).stdout
+        found += [f'bike.py {command} imported {m}' for m in out.split()]
+    return found
+
+def toJson(results: List[Result]) -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': {r.name: asdict(r) for r in results},
+    }
+
+def compare(results: List[Result], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return a description of each result slower than the baseline by more than threshold"""
+    regressions: List[str] = []
+    r: Result
+    for r in results:
+        base: Optional[Dict[str, Any]] = baseline.get('results', {}).get(r.name)
+        if base is None or base['n'] != r.n:
+            continue
+        ratio: float = r.secs / base['secs'] if base['secs'] > 0.0 else 1.0
+        if ratio > 1.0 + threshold:
+            regressions.append(f'{r.name}: {r.secs * 1e3:.3f}ms is {ratio:.2f}x baseline {base["secs"] * 1e3:.3f}ms')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages.")
+    parser.add_argument('--sizes', type=str, default='10000,100000,1000000', help='comma separated synthetic route sizes, empty for none')
+    parser.add_argument('--sim-points', type=int, default=10_000, help='largest synthetic route to simulate')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats per stage, the best is reported')
+    parser.add_argument('--lookups', type=int, default=10_000, help='lookups per route')
+    parser.add_argument('--startup-repeat', type=int, default=10, help='repeats of each bike.py cold start')
+    parser.add_argument('--json', type=str, help='write the results as json to this file, - for stdout')
+    parser.add_argument('--baseline', type=str, help='compare with the results in this json file')
+    parser.add_argument('--save-baseline', type=str, help='save the results as the baseline in this json file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown relative to the baseline, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    bench: Bench = Bench(repeat=args.repeat, lookups=args.lookups)
+    heavy: List[str] = bench.startup(args.startup_repeat)
+    bench.files()
+    bench.synthetic([int(s) for s in args.sizes.split(',') if s], args.sim_points)
+
+    output: Dict[str, Any] = toJson(bench.results)
+    if args.json == '-':
+        json.dump(output, sys.stdout, indent=2)
+        print('')
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    regressions: List[str] = heavy.copy()
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions += compare(bench.results, json.load(f), args.threshold)
+    s: str
+    for s in regressions:
+        print(f'REGRESSION {s}', file=sys.stderr)
+    if regressions:
+        sys.exit(1)
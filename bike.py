@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Single entry point for the bike tools.
+#
+# This is invoked many thousands of times by batch jobs so only the
+# modules needed by the chosen subcommand are imported and they are
+# imported inside the subcommand. Keep the top level imports to the
+# standard library modules needed to parse the command line.
+import argparse
+import os
+import sys
+
+def simulate(args: argparse.Namespace) -> int:
+    import instrument
+    if args.profile:
+        instrument.enable()
+    import time
+    start: float = time.perf_counter()
+
+    import path as p
+    import track_file as tf
+    import simulator as sim
+    from simulator import mph
+
+    power: float = args.power if args.power is not None else sim.power
+    prm = sim.Params(power=power, dt=args.dt if args.dt is not None else sim.dt)
+    path = p.Path(tf.readTrackList(args.filename))
+    print(f'filename={args.filename}')
+    print(f'power={power}')
+    print(f'total distance={path.tot()}')
+
+    step = None
+    if args.steps:
+        def printStep(t: float, dt: float, d: float, v: float, grade: float, sd: float) -> None:
+            print(f't={t:.2f} d={d:.2f}m v={mph(v):.2f}mph grade={grade:.02f} sd={sd:.2f}m')
+        step = instrument.timed('print', printStep)
+
+    energy = sim.Energy(path) if args.energy else None
+    if args.cache:
+        if (step is not None) or (energy is not None) or args.trace:
+            raise ValueError('--cache can not be used with --steps, --energy or --trace')
+        import result_cache
+        with result_cache.ResultCache(args.cache) as cache:
+            r = cache.simulate(path, prm).result
+    elif args.trace:
+        import trace_file
+        with trace_file.TraceWriter(args.trace) as trace:
+            r = sim.simulate(path, prm, step=step, energy=energy, trace=trace)
+    else:
+        r = sim.simulate(path, prm, step=step, energy=energy)
+    print(f't={r.t:.2f} {sim.hms(r.t)} v={mph(r.v):.2f}mph drag={sim.fDrag(prm, r.v):.2f}N grade={r.grade:.02f} ' + \
+          f'F roll={sim.fRolling(prm, r.grade, r.v):.2f}N F gravity={sim.fGravity(prm, r.grade):.2f}N d={r.d:.2f}m sd={r.sd:.2f}m')
+    if energy is not None:
+        sim.printEnergy(energy)
+
+    if args.profile:
+        instrument.add('total', time.perf_counter() - start)
+        if args.profile == 'json':
+            import json
+            json.dump(instrument.toJson(), sys.stderr, indent=2)
+            print('', file=sys.stderr)
+        else:
+            print(instrument.table(), file=sys.stderr)
+    return 0
+
+def convert(args: argparse.Namespace) -> int:
+    import path as p
+    import track_point as tp
+    import track_file as tf
+    import csv_track_list as csv_tl
+
+    _, extension = os.path.splitext(args.out_filename)
+    if extension != '.csv':
+        raise ValueError(f"Unknown file extension:'{extension}' in {args.out_filename}, expecting '.csv'")
+    path = p.Path(tf.readTrackList(args.in_filename))
+    csv_tl.writeTrackListAsCsvToFile(path.trackList(), args.out_filename, header=tp.mkCsvHeader())
+    return 0
+
+def info(args: argparse.Namespace) -> int:
+    import path as p
+    import track_file as tf
+
+    filename: str
+    for filename in args.filenames:
+        path = p.Path(tf.readTrackList(filename))
+        tl = path.trackList()
+        climb: float = sum(max(0.0, b.ele - a.ele) for a, b in zip(tl, tl[1:]))
+        tims = [pt.tim for pt in tl if pt.tim != 0.0]
+        print(f'{filename}:')
+        print(f'  points={len(tl)}')
+        print(f'  total distance={path.tot():.2f}m')
+        print(f'  kms={len(path.km_idx_dis()) - 1}')
+        if tl:
+            print(f'  ele min={min(pt.ele for pt in tl):.2f}m max={max(pt.ele for pt in tl):.2f}m climb={climb:.2f}m')
+        if tims:
+            print(f'  duration={max(tims) - min(tims):.0f}s')
+    return 0
+
+def serve(args: argparse.Namespace) -> int:
+    import sim_server
+    sim_server.serve(root=args.root, host=args.host, port=args.port, unix=args.unix,
+                     workers=args.workers, cache_bytes=args.cache_mb * 1024 * 1024, timeout=args.timeout)
+    return 0
+
+def mkParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Bike simulation tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sp = subparsers.add_parser('simulate', help='simulate riding a route at constant power')
+    sp.add_argument('filename', type=str, help='.gpx, .tcx or .csv file to simulate')
+    sp.add_argument('power', type=float, nargs='?', help='power in watts, default simulator.power')
+    sp.add_argument('--dt', type=float, help='time step in seconds, default simulator.dt')
+    sp.add_argument('--steps', action='store_true', help='print every step')
+    sp.add_argument('--energy', action='store_true', help='print where the energy goes in each km in kJ')
+    sp.add_argument('--cache', type=str, help='reuse results stored in this database and store new ones')
+    sp.add_argument('--trace', type=str, help='write every step with its forces to this trace file')
+    sp.add_argument('--profile', nargs='?', const='table', choices=['table', 'json'],
+                    help='report per stage times and counts to stderr as a table or json')
+    sp.set_defaults(func=simulate)
+
+    sp = subparsers.add_parser('convert', help='convert a track to csv')
+    sp.add_argument('in_filename', type=str, help='input .gpx, .tcx or .csv file')
+    sp.add_argument('out_filename', type=str, help='output .csv file')
+    sp.set_defaults(func=convert)
+
+    sp = subparsers.add_parser('info', help='summarize tracks')
+    sp.add_argument('filenames', type=str, nargs='+', help='.gpx, .tcx or .csv files')
+    sp.set_defaults(func=info)
+
+    sp = subparsers.add_parser('serve', help='answer simulation requests over http')
+    sp.add_argument('--root', type=str, default='.', help='directory containing the routes')
+    sp.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    sp.add_argument('--port', type=int, default=8642, help='port to listen on')
+    sp.add_argument('--unix', type=str, help='listen on this unix socket instead of host:port')
+    sp.add_argument('--workers', type=int, default=2, help='simulation worker processes')
+    sp.add_argument('--cache-mb', type=int, default=256, help='memory for cached routes in MB')
+    sp.add_argument('--timeout', type=float, default=60.0, help='seconds a simulation may take')
+    sp.set_defaults(func=serve)
+
+    return parser
+
+def main(argv: list) -> int:
+    args = mkParser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (ValueError, OSError) as err:
+        print(err, file=sys.stderr)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+# Load many route and ride files concurrently
+from __future__ import annotations
+from typing import Optional, List, Iterator, AsyncIterator, Iterable, Callable, Set, FrozenSet, Tuple, Any
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+
+import asyncio
+import time
+import track_point as tp
+import track_file as tf
+import path as p
+
+# What a LoadResult holds
+PATH = 'path'         # A Path
+COLUMNS = 'columns'   # The TrackColumns of the Path, cheaper to return from a worker
+TRACKLIST = 'tracklist' # The List[TrackPoint] as read
+
+@dataclass
+class LoadResult:
+    filename: str
+    track: Any                 # Path, TrackColumns or List[TrackPoint] depending on kind, None on error
+    points: int = 0            # Number of TrackPoints
+    bytes: int = 0             # Size of the file
+    read_secs: float = 0.0     # Wall time to read the file
+    parse_secs: float = 0.0    # Wall time in the worker to parse and build the track
+    error: Optional[str] = None
+
+# Called with the number of files completed, the total and the latest result
+Progress = Callable[[int, int, LoadResult], None]
+
+def _read(filename: str) -> Tuple[str, Optional[bytes], float, Optional[str]]:
+    """Return filename, its contents, the time to read them and an error"""
+    start: float = time.perf_counter()
+    try:
+        with open(filename, 'rb') as f:
+            data: bytes = f.read()
+    except OSError as err:
+        return filename, None, time.perf_counter() - start, str(err)
+    return filename, data, time.perf_counter() - start, None
+
+def _parse(filename: str, data: Optional[bytes], read_secs: float, error: Optional[str], kind: str,
+           fields: Optional[FrozenSet[str]]=None) -> LoadResult:
+    """Run in a worker process, parse data into a track of kind"""
+    if data is None:
+        return LoadResult(filename=filename, track=None, read_secs=read_secs, error=error)
+    start: float = time.perf_counter()
+    try:
+        tl: List[tp.TrackPoint] = tf.readBytesTrackList(filename, data, fields)
+        track: Any = tl
+        if kind != TRACKLIST:
+            track = p.Path(tl)
+            if kind == COLUMNS:
+                import track_columns as tc
+                track = tc.mkTrackColumns(tl)
+    except Exception as err:
+        return LoadResult(filename=filename, track=None, bytes=len(data), read_secs=read_secs,
+                          parse_secs=time.perf_counter() - start, error=f'{type(err).__name__}: {err}')
+    return LoadResult(filename=filename, track=track, points=len(tl), bytes=len(data),
+                      read_secs=read_secs, parse_secs=time.perf_counter() - start)
+
+def loadTracks(filenames: List[str], kind: str=PATH, workers: Optional[int]=None, io_workers: int=4,
+               max_in_flight: int=8, progress: Optional[Progress]=None,
+               fields: Optional[Iterable[str]]=None) -> Iterator[LoadResult]:
+    """
+    Yield a LoadResult for each of filenames in the order they complete.
+    Only fields, default all, are read, tp.geometry_fields is enough for a Path.
+
+    Files are read by io_workers threads and parsed by workers processes.
+    At most max_in_flight files are being read, parsed or waiting to be
+    yielded at once which bounds the memory used for their contents.
+    Errors are reported in LoadResult.error rather than raised.
+    """
+    total: int = len(filenames)
+    completed: int = 0
+    names: Iterator[str] = iter(filenames)
+    wanted: Optional[FrozenSet[str]] = tp.checkFields(fields)
+    with ThreadPoolExecutor(max_workers=io_workers) as io_ex, ProcessPoolExecutor(max_workers=workers) as pool:
+        reading: Set[Future] = set()
+        parsing: Set[Future] = set()
+
+        def readNext() -> None:
+            filename: Optional[str] = next(names, None)
+            if filename is not None:
+                reading.add(io_ex.submit(_read, filename))
+
+        for _ in range(max(1, max_in_flight)):
+            readNext()
+        while reading or parsing:
+            done, _ = wait(reading | parsing, return_when=FIRST_COMPLETED)
+            f: Future
+            for f in done:
+                if f in reading:
+                    reading.remove(f)
+                    parsing.add(pool.submit(_parse, *f.result(), kind, wanted))
+                else:
+                    parsing.remove(f)
+                    result: LoadResult = f.result()
+                    completed += 1
+                    if progress is not None:
+                        progress(completed, total, result)
+                    yield result
+                    readNext()
+
+async def aloadTracks(filenames: List[str], kind: str=PATH, workers: Optional[int]=None, io_workers: int=4,
+                      max_in_flight: int=8, progress: Optional[Progress]=None,
+                      fields: Optional[Iterable[str]]=None) -> AsyncIterator[LoadResult]:
+    """
+    The async iterator form of loadTracks. At most max_in_flight files are
+    loading or waiting to be yielded, those still loading are cancelled if
+    the caller stops early.
+    """
+    wanted: Optional[FrozenSet[str]] = tp.checkFields(fields)
+    loop = asyncio.get_running_loop()
+    total: int = len(filenames)
+    completed: int = 0
+    names: Iterator[str] = iter(filenames)
+    io_ex: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=io_workers)
+    pool: ProcessPoolExecutor = ProcessPoolExecutor(max_workers=workers)
+    loading: Set[asyncio.Task] = set()
+
+    async def load(filename: str) -> LoadResult:
+        read: Tuple[str, Optional[bytes], float, Optional[str]] = await loop.run_in_executor(io_ex, _read, filename)
+        return await loop.run_in_executor(pool, _parse, *read, kind, wanted)
+
+    def loadNext() -> None:
+        filename: Optional[str] = next(names, None)
+        if filename is not None:
+            loading.add(loop.create_task(load(filename)))
+
+    try:
+        for _ in range(max(1, max_in_flight)):
+            loadNext()
+        while loading:
+            done, _ = await asyncio.wait(loading, return_when=asyncio.FIRST_COMPLETED)
+            task: asyncio.Task
+            for task in done:
+                loading.remove(task)
+                result: LoadResult = task.result()
+                completed += 1
+                if progress is not None:
+                    progress(completed, total, result)
+                yield result
+                loadNext()
+    finally:
+        for task in loading:
+            task.cancel()
+        await asyncio.gather(*loading, return_exceptions=True)
+        # Waiting for the executors here would block the event loop
+        io_ex.shutdown(wait=False, cancel_futures=True)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def printProgress(completed: int, total: int, result: LoadResult) -> None:
+    status: str = result.error if result.error is not None else f'{result.points} points'
+    print(f'[{completed:>4}/{total}] {result.filename}: {status} read={result.read_secs * 1e3:.1f}ms parse={result.parse_secs * 1e3:.1f}ms')
+
+if __name__ == '__main__':
+    import os
+    import track_columns as tc
+
+    test_files: List[str] = [os.path.join(d, name) for d in ('./data', './test/data') for name in sorted(os.listdir(d))
+                             if tf.trackExtension(name) in tf.extensions]
+
+    start: float = time.perf_counter()
+    for result in loadTracks(test_files, progress=printProgress):
+        pass
+    print(f'loaded {len(test_files)} files in {(time.perf_counter() - start) * 1e3:.1f}ms')
+
+    import unittest
+
+    class TestBulkLoad(unittest.TestCase):
+
+        def test_loadTracks_paths(self: TestBulkLoad):
+            results: List[LoadResult] = list(loadTracks(test_files, workers=2, max_in_flight=2))
+            self.assertEqual(sorted(r.filename for r in results), sorted(test_files))
+            r: LoadResult
+            for r in results:
+                self.assertTrue(r.error is None)
+                serial: p.Path = p.Path(tf.readTrackList(r.filename))
+                self.assertTrue(r.track.compare(serial))
+                self.assertEqual(r.points, len(serial.trackList()))
+                self.assertEqual(r.bytes, os.path.getsize(r.filename))
+
+        def test_loadTracks_columns_and_progress(self: TestBulkLoad):
+            calls: List[Tuple[int, int]] = []
+            results: List[LoadResult] = list(loadTracks(test_files, kind=COLUMNS, progress=lambda c, t, r: calls.append((c, t))))
+            self.assertEqual(calls, [(i + 1, len(test_files)) for i in range(len(test_files))])
+            r: LoadResult
+            for r in results:
+                self.assertEqual(tc.columnsLen(r.track), r.points)
+
+        def test_loadTracks_geometry(self: TestBulkLoad):
+            r: LoadResult
+            for r in loadTracks(test_files, fields=tp.geometry_fields):
+                self.assertTrue(r.track.compare(p.Path(tf.readTrackList(r.filename, tp.geometry_fields))))
+            self.assertRaises(ValueError, list, loadTracks(test_files, fields=['elevation']))
+
+        def test_loadTracks_errors(self: TestBulkLoad):
+            results: List[LoadResult] = list(loadTracks(['./test/data/missing.gpx', './README.md']))
+            self.assertEqual(len(results), 2)
+            self.assertTrue(all(r.error is not None and r.track is None for r in results))
+
+        def test_aloadTracks(self: TestBulkLoad):
+            async def run() -> List[LoadResult]:
+                return [r async for r in aloadTracks(test_files, kind=TRACKLIST, max_in_flight=1)]
+            results: List[LoadResult] = asyncio.run(run())
+            self.assertEqual(sorted(r.filename for r in results), sorted(test_files))
+            r: LoadResult
+            for r in results:
+                self.assertTrue(tp.compareList(r.track, tf.readTrackList(r.filename)))
+
+        def test_aloadTracks_window(self: TestBulkLoad):
+            taken: List[str] = []
+
+            class Names(list):
+                """Record the filenames aloadTracks has started loading"""
+                def __iter__(self: Names) -> Iterator[str]:
+                    name: str
+                    for name in list.__iter__(self):
+                        taken.append(name)
+                        yield name
+
+            async def run() -> List[LoadResult]:
+                results: List[LoadResult] = []
+                loads = aloadTracks(Names(test_files * 4), kind=TRACKLIST, max_in_flight=2)
+                async for r in loads:
+                    results.append(r)
+                    # Only the next files replacing those yielded are started
+                    self.assertTrue(len(taken) <= len(results) + 2)
+                    if len(results) == 3:
+                        break
+                await loads.aclose()
+                return results
+
+            results: List[LoadResult] = asyncio.run(run())
+            self.assertEqual(len(results), 3)
+            self.assertTrue(all(r.error is None for r in results))
+            self.assertTrue(len(taken) <= 5)
+
+    unittest.main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# Detect and categorize the climbs of a route
+from __future__ import annotations
+from typing import List, Tuple, Iterator
+from dataclasses import dataclass
+from weakref import WeakKeyDictionary
+
+import bisect
+import numpy as np
+import path as p
+
+@dataclass(frozen=True)
+class ClimbParams:
+    window: float = 200.0      # Meters over which the grade is averaged
+    start_grade: float = 3.0   # Percent, a climb starts when the grade reaches this
+    end_grade: float = 1.0     # Percent, and ends when the grade falls below this
+    min_length: float = 500.0  # Meters, shorter climbs are ignored
+    min_gain: float = 20.0     # Meters, climbs gaining less are ignored
+
+@dataclass
+class Climb:
+    start: float     # Distance in meters of the start
+    end: float       # Distance in meters of the end
+    start_idx: int   # Index of the TrackPoint at the start
+    end_idx: int     # Index of the TrackPoint at the end
+    gain: float      # Elevation gain in meters
+    avg_grade: float # Percent
+    max_grade: float # Percent, the steepest grade averaged over ClimbParams.window
+    category: str    # '4', '3', '2', '1' or 'HC' or '' if uncategorized
+
+    def length(self: Climb) -> float:
+        return self.end - self.start
+
+# Minimum length in meters times average grade in percent for each category
+categories: List[Tuple[float, str]] = [(80000.0, 'HC'), (64000.0, '1'), (32000.0, '2'), (16000.0, '3'), (8000.0, '4')]
+
+def category(length: float, avg_grade: float) -> str:
+    score: float = length * avg_grade
+    limit: float
+    name: str
+    for limit, name in categories:
+        if score >= limit:
+            return name
+    return ''
+
+def smoothGrade(tot: np.ndarray, ele: np.ndarray, window: float) -> np.ndarray:
+    """Return the grade in percent at each point averaged over window meters centered on it"""
+    lo: np.ndarray = np.maximum(tot - window / 2.0, tot[0])
+    hi: np.ndarray = np.minimum(tot + window / 2.0, tot[-1])
+    span: np.ndarray = hi - lo
+    rise: np.ndarray = np.interp(hi, tot, ele) - np.interp(lo, tot, ele)
+    return np.divide(rise * 100.0, span, out=np.zeros(len(tot)), where=span > 0.0)
+
+def hysteresis(x: np.ndarray, on: float, off: float) -> np.ndarray:
+    """Return True where x has reached on and not since fallen below off"""
+    # -1 where x is between the thresholds and keeps the last decided state
+    decided: np.ndarray = np.where(x >= on, 1, np.where(x < off, 0, -1))
+    last: np.ndarray = np.maximum.accumulate(np.where(decided >= 0, np.arange(len(x)), 0))
+    return decided[last] == 1
+
+def detectClimbs(path: p.Path, prm: ClimbParams=ClimbParams()) -> List[Climb]:
+    """Return the climbs of path in order of distance"""
+    tl = path.trackList()
+    if len(tl) < 2:
+        return []
+    tot: np.ndarray = np.fromiter((pt.tot for pt in tl), dtype=np.float64, count=len(tl))
+    ele: np.ndarray = np.fromiter((pt.ele for pt in tl), dtype=np.float64, count=len(tl))
+    grade: np.ndarray = smoothGrade(tot, ele, prm.window)
+    climbing: np.ndarray = hysteresis(grade, prm.start_grade, prm.end_grade)
+
+    # Runs of climbing points, [starts[i], ends[i]]
+    edges: np.ndarray = np.diff(climbing.astype(np.int8), prepend=0, append=0)
+    starts: np.ndarray = np.flatnonzero(edges == 1)
+    ends: np.ndarray = np.flatnonzero(edges == -1) - 1
+    if len(starts) == 0:
+        return []
+
+    # Trim each run to its lowest point before its highest point
+    climbs: List[Climb] = []
+    s: int
+    e: int
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        e = s + int(np.argmax(ele[s:e + 1]))
+        s = s + int(np.argmin(ele[s:e + 1]))
+        max_grade: float = float(grade[s:e + 1].max())
+        length: float = float(tot[e] - tot[s])
+        gain: float = float(ele[e] - ele[s])
+        if (length < prm.min_length) or (gain < prm.min_gain):
+            continue
+        avg_grade: float = gain * 100.0 / length
+        climbs.append(Climb(start=float(tot[s]), end=float(tot[e]), start_idx=s, end_idx=e, gain=gain,
+                            avg_grade=avg_grade, max_grade=max_grade, category=category(length, avg_grade)))
+    return climbs
+
+class ClimbIndex:
+    """
+    Range queries over the climbs of a route.
+
+    Climbs don't overlap so sorted by start their ends are sorted too, the
+    climbs overlapping a range are a run of them found by bisection. A sparse
+    table of the steepest climb of every power of two run gives the steepest
+    of any run in O(1), if it is steep enough it is reported and the runs
+    either side of it are searched the same way, so each step of the search
+    reports a climb and a query is O(log n + k).
+    """
+
+    def __init__(self: ClimbIndex, climbs: List[Climb]) -> None:
+        self.climbs: List[Climb] = climbs
+        self.__ends: List[float] = [c.end for c in climbs]
+        self.__starts: List[float] = [c.start for c in climbs]
+        # __steepest[j][i] is the index of the steepest of climbs i to i + 2**j - 1
+        self.__steepest: List[List[int]] = [list(range(len(climbs)))]
+        width: int = 1
+        while 2 * width <= len(climbs):
+            prev: List[int] = self.__steepest[-1]
+            self.__steepest.append([self.__steeper(prev[i], prev[i + width]) for i in range(len(climbs) - 2 * width + 1)])
+            width *= 2
+
+    def __len__(self: ClimbIndex) -> int:
+        return len(self.climbs)
+
+    def __iter__(self: ClimbIndex) -> Iterator[Climb]:
+        return iter(self.climbs)
+
+    def __steeper(self: ClimbIndex, i: int, j: int) -> int:
+        return i if self.climbs[i].avg_grade >= self.climbs[j].avg_grade else j
+
+    def __steepestOf(self: ClimbIndex, lo: int, hi: int) -> int:
+        """Return the index of the steepest of climbs lo to hi inclusive"""
+        j: int = (hi - lo + 1).bit_length() - 1
+        return self.__steeper(self.__steepest[j][lo], self.__steepest[j][hi - (1 << j) + 1])
+
+    def query(self: ClimbIndex, start: float=0.0, end: float=np.inf, min_grade: float=0.0) -> List[Climb]:
+        """Return the climbs overlapping start to end meters with an average grade of at least min_grade percent"""
+        found: List[Climb] = []
+        # Runs lo to hi inclusive to search, or with report True a climb to report, popped in order of distance
+        todo: List[Tuple[int, int, bool]] = [(bisect.bisect_right(self.__ends, start), bisect.bisect_left(self.__starts, end) - 1, False)]
+        while todo:
+            lo, hi, report = todo.pop()
+            if report:
+                found.append(self.climbs[lo])
+            elif lo <= hi:
+                i: int = self.__steepestOf(lo, hi)
+                if self.climbs[i].avg_grade >= min_grade:
+                    todo.extend([(i + 1, hi, False), (i, i, True), (lo, i - 1, False)])
+        return found
+
+# Path to the number of its points, the params and its index, entries go when the Path does
+_cache: WeakKeyDictionary = WeakKeyDictionary()
+
+def climbIndex(path: p.Path, prm: ClimbParams=ClimbParams()) -> ClimbIndex:
+    """Return the ClimbIndex of path, cached until points are appended to it"""
+    entry = _cache.get(path)
+    points: int = len(path.trackList())
+    if (entry is None) or (entry[0] != points) or (entry[1] != prm):
+        entry = (points, prm, ClimbIndex(detectClimbs(path, prm)))
+        _cache[path] = entry
+    return entry[2]
+
+def printClimbs(climbs: List[Climb]) -> None:
+    print(f"{'start':>8} {'end':>8} {'length':>7} {'gain':>6} {'avg':>6} {'max':>6} {'cat':>3}")
+    c: Climb
+    for c in climbs:
+        print(f'{c.start / 1000:>6.2f}km {c.end / 1000:>6.2f}km {c.length():>6.0f}m {c.gain:>5.0f}m'
+              f' {c.avg_grade:>5.1f}% {c.max_grade:>5.1f}% {c.category:>3}')
+
+if __name__ == '__main__':
+    import sys
+    import math
+    import track_point as tp
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+
+        parser = argparse.ArgumentParser(description='List the climbs of routes.')
+        parser.add_argument('filenames', type=str, nargs='+', help='.gpx, .tcx or .csv routes')
+        parser.add_argument('--from-km', type=float, default=0.0, help='only climbs after this km')
+        parser.add_argument('--to-km', type=float, default=math.inf, help='only climbs before this km')
+        parser.add_argument('--min-grade', type=float, default=0.0, help='only climbs at least this steep in percent')
+        args = parser.parse_args()
+        filename: str
+        for filename in args.filenames:
+            print(f'{filename}:')
+            index: ClimbIndex = climbIndex(p.Path(tf.readTrackList(filename)))
+            printClimbs(index.query(args.from_km * 1000.0, args.to_km * 1000.0, args.min_grade))
+        sys.exit(0)
+
+    import unittest
+
+    def mkRoute(profile: List[Tuple[float, float]], step: float=10.0) -> p.Path:
+        """Return a path heading north with sections of (length in meters, grade in percent)"""
+        tl: List[tp.TrackPoint] = [tp.TrackPoint(lat=0.0, lon=0.0)]
+        length: float
+        grade: float
+        for length, grade in profile:
+            i: int
+            for i in range(int(length / step)):
+                prev: tp.TrackPoint = tl[-1]
+                tl.append(tp.TrackPoint(lat=math.degrees(prev.lat + step / tp.earthR1), lon=0.0, ele=prev.ele + step * grade / 100.0))
+        return p.Path(tl)
+
+    class TestClimbs(unittest.TestCase):
+
+        def test_hysteresis(self: TestClimbs):
+            x: np.ndarray = np.array([0.0, 2.0, 3.0, 2.0, 1.0, 0.5, 2.0, 4.0, 0.0])
+            self.assertEqual(hysteresis(x, 3.0, 1.0).tolist(), [False, False, True, True, True, False, False, True, False])
+            self.assertEqual(hysteresis(np.array([2.0, 3.0]), 3.0, 1.0).tolist(), [False, True])
+
+        def test_detect(self: TestClimbs):
+            route: p.Path = mkRoute([(2000, 0.0), (3000, 6.0), (2000, 0.0), (1500, 4.0), (1000, -5.0), (300, 8.0), (1000, 0.0)])
+            climbs: List[Climb] = detectClimbs(route)
+            # The 300m climb is too short
+            self.assertEqual(len(climbs), 2)
+            first: Climb = climbs[0]
+            self.assertAlmostEqual(first.start, 2000.0, delta=15.0)
+            self.assertAlmostEqual(first.end, 5000.0, delta=15.0)
+            self.assertAlmostEqual(first.gain, 180.0, delta=1.0)
+            self.assertAlmostEqual(first.avg_grade, 6.0, delta=0.1)
+            self.assertAlmostEqual(first.max_grade, 6.0, delta=0.1)
+            self.assertEqual(first.category, '3')
+            self.assertAlmostEqual(climbs[1].avg_grade, 4.0, delta=0.1)
+            self.assertEqual(climbs[1].category, '')
+
+        def test_max_grade_within_climb(self: TestClimbs):
+            # The steep ramp and the dip after it are trimmed off the start of the climb
+            routes: List[p.Path] = [mkRoute([(1000, 0.0), (100, 20.0), (50, -50.0), (1500, 4.0), (500, 0.0)]),
+                                    p.Path(tf.readTrackList('./test/data/RAAM_TS00_route_snippet.gpx'))]
+            route: p.Path
+            for route in routes:
+                tot: np.ndarray = np.array([pt.tot for pt in route.trackList()])
+                ele: np.ndarray = np.array([pt.ele for pt in route.trackList()])
+                grade: np.ndarray = smoothGrade(tot, ele, ClimbParams().window)
+                c: Climb
+                for c in detectClimbs(route):
+                    self.assertEqual(c.max_grade, grade[c.start_idx:c.end_idx + 1].max())
+            self.assertAlmostEqual(detectClimbs(routes[0])[0].max_grade, 4.0, delta=0.1)
+
+        def test_query_and_cache(self: TestClimbs):
+            route: p.Path = mkRoute([(1000, 0.0), (1000, 5.0), (1000, 0.0), (1000, 3.5), (1000, 0.0), (1000, 7.0), (1000, 0.0)])
+            index: ClimbIndex = climbIndex(route)
+            self.assertTrue(climbIndex(route) is index)
+            self.assertEqual(len(index), 3)
+            self.assertEqual(len(index.query()), 3)
+            self.assertEqual([round(c.avg_grade) for c in index.query(1500.0, 4500.0)], [5, 4])
+            self.assertEqual([round(c.avg_grade) for c in index.query(0.0, 7000.0, min_grade=4.5)], [5, 7])
+            self.assertEqual(index.query(6100.0, 7000.0), [])
+            self.assertEqual(index.query(0.0, 1000.0), [])
+            # Appending points rebuilds the index
+            route.append(tp.TrackPoint(lat=math.degrees(route.trackList()[-1].lat + 0.001 / tp.earthR1), lon=0.0))
+            self.assertFalse(climbIndex(route) is index)
+
+        def test_query_matches_filter(self: TestClimbs):
+            grades: List[float] = [3.0, 8.0, 4.0, 4.0, 9.5, 3.5, 6.0, 5.0, 12.0, 3.0, 7.0]
+            climbs: List[Climb] = [Climb(start=1000.0 * i, end=1000.0 * i + 600.0, start_idx=0, end_idx=0, gain=0.0,
+                                         avg_grade=grade, max_grade=grade, category='') for i, grade in enumerate(grades)]
+            index: ClimbIndex = ClimbIndex(climbs)
+            self.assertEqual(ClimbIndex([]).query(), [])
+            start: float
+            end: float
+            min_grade: float
+            for start in [0.0, 700.0, 2500.0, 9600.0, 20000.0]:
+                for end in [start, start + 400.0, start + 3100.0, np.inf]:
+                    for min_grade in [0.0, 4.0, 6.5, 12.0, 13.0]:
+                        self.assertEqual(index.query(start, end, min_grade),
+                                         [c for c in climbs if c.end > start and c.start < end and c.avg_grade >= min_grade])
+
+    unittest.main()
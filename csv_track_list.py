@@ -2,7 +2,7 @@
 
 # bike power calculation
 from __future__ import annotations
-from typing import Optional, List, TextIO
+from typing import Optional, List, Tuple, Callable, Iterable, FrozenSet, Any, TextIO
 from dataclasses import dataclass
 from time import struct_time, strptime
 
@@ -10,24 +10,37 @@ import csv
 import math
 import io
 import os
-import numpy as np
-import xml.etree.ElementTree as et
 import track_point as tp
-import tcx_track_list as ttl
-
-def CsvReaderTrackList(reader: TextIO) -> List[tp.TrackPoint]:
-    """Create a List[tp.TrackPoint] from a csv TextIO stream, result maybe empty if no data"""
+import track_file as tf
+import instrument
+
+def CsvReaderTrackList(reader: TextIO, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """
+    Create a List[tp.TrackPoint] from a csv TextIO stream, result maybe empty if no data.
+    Only the columns of the fields, default all, are converted, the others are 0.
+    """
+    names: Optional[FrozenSet[str]] = tp.checkFields(fields)
+    # Name, column and conversion of each field converted when not all of them are
+    columns: List[Tuple[str, int, Callable[[str], Any]]] = \
+        [(name, i, int if name == 'idx' else float) for i, name in enumerate(tp.mkCsvHeader()) if name in names] \
+        if names is not None else []
 
     # Create a list of TrackPoints
     track: List[tp.TrackPoint] = []
     csvReader = csv.reader(reader, dialect='excel')
-    pt: tp.TrackPoint = tp.mkTrackPoint()
+    pt: tp.TrackPoint
     row_0: bool = True
     for row in csvReader:
         #print(f'row={row}')
         if row_0:
             row_0 = False
             if row[0] == 'idx': continue;
+        pt = tp.mkTrackPoint()
+        if names is not None:
+            for name, i, convert in columns:
+                setattr(pt, name, convert(row[i]))
+            track.append(pt)
+            continue
         pt.idx = int(row[0])
         pt.ele = float(row[1])
         pt.lat = float(row[2])
@@ -45,13 +58,15 @@ def CsvReaderTrackList(reader: TextIO) -> List[tp.TrackPoint]:
 
     return track
 
-def CsvTrackList(filename: str) -> List[tp.TrackPoint]:
-    with open(filename, 'r', newline='') as csvfile:
-        return CsvReaderTrackList(csvfile)
+def CsvTrackList(filename: str, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    with io.TextIOWrapper(tf.openTrack(filename), newline='') as csvfile, instrument.stage('csv read'):
+        track: List[tp.TrackPoint] = CsvReaderTrackList(csvfile, fields)
+    instrument.count('csv points', len(track))
+    return track
 
-def CsvStrTrackList(strg: str) -> List[tp.TrackPoint]:
+def CsvStrTrackList(strg: str, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
     with io.StringIO(strg) as sio:
-        return CsvReaderTrackList(sio)
+        return CsvReaderTrackList(sio, fields)
 
 def writeTrackListAsCsvToWriter(tl: List[tp.TrackPoint], writer: TextIO, header: Optional[List[str]]=None, dialect: str='excel') -> None:
         csvWriter = csv.writer(writer, dialect=dialect)
@@ -70,6 +85,7 @@ def writeTrackListAsCsvToStr(tl: List[tp.TrackPoint], header: Optional[List[str]
 
 if __name__ == '__main__':
     import copy
+    import tcx_track_list as ttl
     import tempfile
     import uuid
 
@@ -127,4 +143,14 @@ if __name__ == '__main__':
                 os.remove(tempFileName)
                 #print('done')
 
+        def test_fields(self: TestCsv):
+            tl1: List[tp.TrackPoint] = ttl.TcxTrackList(test_data)
+            s1: str = writeTrackListAsCsvToStr(tl1, header=tp.mkCsvHeader())
+            tl2: List[tp.TrackPoint] = CsvStrTrackList(s1, tp.geometry_fields + ['idx'])
+            self.assertEqual([(pt.idx, pt.lat, pt.lon, pt.ele) for pt in tl2], [(pt.idx, pt.lat, pt.lon, pt.ele) for pt in tl1])
+            self.assertTrue(all(pt.tim == pt.hrt == pt.rds == 0.0 for pt in tl2))
+            self.assertEqual(type(tl2[0].idx), int)
+            self.assertTrue(tp.compareList(CsvStrTrackList(s1, tp.mkCsvHeader()), CsvStrTrackList(s1)))
+            self.assertRaises(ValueError, CsvStrTrackList, s1, ['lat', 'latitude'])
+
     unittest.main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+# A smooth model of a route's elevation with its slope at any distance
+#
+# The slope of a Path is constant along each segment and jumps at every
+# point, so the forces jump too. Here the elevation is a monotone cubic
+# (PCHIP) through the points' elevations by distance. The elevation and
+# the slope are continuous, and the curve doesn't overshoot between
+# points, so no hills or dips are made up.
+from __future__ import annotations
+from typing import Optional, Callable, Dict, List, Tuple
+
+import bisect
+import math
+import numpy as np
+import path as p
+import simulator as sim
+
+def pchipSlopes(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Return the derivative at each knot of the monotone cubic through x, y (Fritsch and Carlson)"""
+    n: int = len(x)
+    if n < 2:
+        return np.zeros(n)
+    h: np.ndarray = np.diff(x)
+    delta: np.ndarray = np.diff(y) / h
+    if n == 2:
+        return np.array([delta[0], delta[0]])
+
+    m: np.ndarray = np.zeros(n)
+    # Interior knots: weighted harmonic mean of the secants, 0 at a local extremum
+    w1: np.ndarray = 2.0 * h[1:] + h[:-1]
+    w2: np.ndarray = h[1:] + 2.0 * h[:-1]
+    same: np.ndarray = (np.sign(delta[:-1]) * np.sign(delta[1:])) > 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m[1:-1] = np.where(same, (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:]), 0.0)
+
+    def end(h0: float, h1: float, d0: float, d1: float) -> float:
+        """The three point end slope, kept the same sign as d0 and limited to 3 * d0"""
+        s: float = ((2.0 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        if np.sign(s) != np.sign(d0):
+            return 0.0
+        if (np.sign(d0) != np.sign(d1)) and (abs(s) > abs(3.0 * d0)):
+            return 3.0 * d0
+        return s
+
+    m[0] = end(h[0], h[1], delta[0], delta[1])
+    m[-1] = end(h[-1], h[-2], delta[-1], delta[-2])
+    return m
+
+def smoothElevations(x: np.ndarray, y: np.ndarray, window: float) -> np.ndarray:
+    """Return the mean elevation over window meters centered on each point of the piecewise linear x, y"""
+    if (window <= 0.0) or (len(x) < 2):
+        return y
+    # Integral of the elevation from x[0] to each point, the mean is the difference of two of them
+    area: np.ndarray = np.concatenate(([0.0], np.cumsum(np.diff(x) * (y[1:] + y[:-1]) / 2.0)))
+    lo: np.ndarray = np.maximum(x - window / 2.0, x[0])
+    hi: np.ndarray = np.minimum(x + window / 2.0, x[-1])
+
+    def integral(at: np.ndarray) -> np.ndarray:
+        i: np.ndarray = np.clip(np.searchsorted(x, at, 'right') - 1, 0, len(x) - 2)
+        s: np.ndarray = at - x[i]
+        slope: np.ndarray = (y[i + 1] - y[i]) / (x[i + 1] - x[i])
+        return area[i] + s * (y[i] + slope * s / 2.0)
+
+    return (integral(hi) - integral(lo)) / (hi - lo)
+
+class ElevationModel:
+    """
+    The elevation of path as a monotone cubic of the distance, optionally
+    through elevations first averaged over window meters.
+
+    The slope at a distance is the derivative of the cubic of its segment.
+    Scalar queries keep a cursor on the last segment used so the slowly
+    increasing distances of a simulation are O(1), arrays of distances are
+    evaluated together.
+    """
+
+    def __init__(self: ElevationModel, path: p.Path, window: float=0.0) -> None:
+        tl = path.trackList()
+        x: np.ndarray = np.fromiter((pt.tot for pt in tl), dtype=np.float64, count=len(tl))
+        y: np.ndarray = np.fromiter((pt.ele for pt in tl), dtype=np.float64, count=len(tl))
+        # Zero length segments are dropped keeping the first point
+        keep: np.ndarray = np.concatenate(([True], np.diff(x) > 0.0)) if len(x) > 0 else np.zeros(0, dtype=bool)
+        x = x[keep]
+        y = smoothElevations(x, y[keep], window)
+        m: np.ndarray = pchipSlopes(x, y)
+
+        # Each segment's cubic in s, the distance from its start, c0 + c1 s + c2 s^2 + c3 s^3
+        self.x: np.ndarray = x
+        self.c: np.ndarray = np.zeros((4, max(len(x) - 1, 0)))
+        if len(x) >= 2:
+            h: np.ndarray = np.diff(x)
+            delta: np.ndarray = np.diff(y) / h
+            self.c[0] = y[:-1]
+            self.c[1] = m[:-1]
+            self.c[2] = (3.0 * delta - 2.0 * m[:-1] - m[1:]) / h
+            self.c[3] = (m[:-1] + m[1:] - 2.0 * delta) / (h * h)
+
+        # Lists for the scalar queries, indexing them is faster than numpy arrays
+        self.__x: List[float] = x.tolist()
+        self.__c1: List[float] = self.c[1].tolist()
+        self.__c2: List[float] = (2.0 * self.c[2]).tolist()
+        self.__c3: List[float] = (3.0 * self.c[3]).tolist()
+        self.__i: int = 0
+
+    def __segment(self: ElevationModel, distance: float) -> int:
+        """Return the segment containing distance moving the cursor to it, -1 if it's off the path"""
+        x: List[float] = self.__x
+        i: int = self.__i
+        if (len(x) < 2) or not (x[0] <= distance < x[-1]):
+            return -1
+        if not (x[i] <= distance < x[i + 1]):
+            if x[i + 1] <= distance < x[i + 2]:
+                i += 1
+            else:
+                i = bisect.bisect_right(x, distance) - 1
+            self.__i = i
+        return i
+
+    def grade(self: ElevationModel, distance: float) -> float:
+        """Return the rise over run at distance, 0 off the path"""
+        i: int = self.__segment(distance)
+        if i < 0:
+            return 0.0
+        s: float = distance - self.__x[i]
+        return self.__c1[i] + s * (self.__c2[i] + self.__c3[i] * s)
+
+    def slpRadians(self: ElevationModel, distance: float) -> float:
+        """Return the slope in radians at distance, a simulator.Slope"""
+        return math.atan(self.grade(distance))
+
+    def __segments(self: ElevationModel, distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the segment of each distance clipped to the path, its offset in it and True if it's on the path"""
+        d: np.ndarray = np.asarray(distances, dtype=np.float64)
+        if len(self.x) < 2:
+            return np.zeros(d.shape, dtype=np.int64), np.zeros(d.shape), np.zeros(d.shape, dtype=bool)
+        i: np.ndarray = np.clip(np.searchsorted(self.x, d, 'right') - 1, 0, len(self.x) - 2)
+        return i, d - self.x[i], (d >= self.x[0]) & (d < self.x[-1])
+
+    def grades(self: ElevationModel, distances: np.ndarray) -> np.ndarray:
+        """Return the rise over run at each of distances, 0 off the path"""
+        i, s, on = self.__segments(distances)
+        if len(self.x) < 2:
+            return np.zeros(s.shape)
+        c: np.ndarray = self.c
+        return np.where(on, c[1, i] + s * (2.0 * c[2, i] + 3.0 * c[3, i] * s), 0.0)
+
+    def slopes(self: ElevationModel, distances: np.ndarray) -> np.ndarray:
+        """Return the slope in radians at each of distances"""
+        return np.arctan(self.grades(distances))
+
+    def elevations(self: ElevationModel, distances: np.ndarray) -> np.ndarray:
+        """Return the elevation at each of distances, clipped to the ends of the path"""
+        i, s, _ = self.__segments(distances)
+        if len(self.x) < 2:
+            return np.zeros(s.shape)
+        s = np.clip(s, 0.0, np.diff(self.x)[i])
+        c: np.ndarray = self.c
+        return c[0, i] + s * (c[1, i] + s * (c[2, i] + s * c[3, i]))
+
+def simulate(path: p.Path, prm: sim.Params=sim.Params(), model: Optional[ElevationModel]=None) -> sim.SimResult:
+    """
+    Simulate riding path with the slopes of model, default ElevationModel(path),
+    integrating with Heun's second order method.
+
+    The state is the distance and the kinetic energy, which the rider's power
+    raises and the forces lower, d' = v and E' = eta * power - force * v. The
+    error of simulator.simulate falls with dt, Heun's falls with dt squared
+    but only when the slope is smooth, with the segments' slopes it jumps
+    within steps and the error is like simulator.simulate's. The last step
+    is cut short at the end of the path by interpolating within it.
+    """
+    if model is None:
+        model = ElevationModel(path)
+    slope: sim.Slope = model.slpRadians
+    dt: float = prm.dt
+    total_distance: float = path.tot()
+    boundaries: List[float] = path.kmDistances() + [math.inf]
+    splits: List[float] = [0.0]
+    next_split: float = boundaries[1]
+
+    def rates(d: float, e: float) -> Tuple[float, float, float]:
+        """Return v, E' and the slope at distance d with kinetic energy e"""
+        v: float = math.sqrt(2.0 * max(e, 0.0) / prm.mass)
+        grade: float = slope(d)
+        force: float = sim.fDrag(prm, v) + sim.fRolling(prm, grade, v) + sim.fGravity(prm, grade)
+        return v, prm.eta * prm.power - force * v, grade
+
+    t: float = 0.0
+    d: float = 0.0
+    e: float = 0.0
+    v: float = 0.0
+    grade: float = 0.0
+    sd: float = 0.0
+    steps: int = 0
+    while d < total_distance:
+        v0, e0, grade = rates(d, e)
+        v1, e1, _ = rates(d + dt * v0, e + dt * e0)
+        sd = dt * (v0 + v1) / 2.0
+        step_dt: float = dt
+        pe: float = e
+        e = max(e + dt * (e0 + e1) / 2.0, 0.0)
+        if d + sd >= total_distance:
+            # Interpolate the end of the path within the step
+            fraction: float = (total_distance - d) / sd
+            step_dt = dt * fraction
+            e = pe + (e - pe) * fraction
+            sd = total_distance - d
+        while d + sd >= next_split:
+            splits.append(t + step_dt * (next_split - d) / sd)
+            next_split = boundaries[len(splits)]
+        d = d + sd if d + sd < total_distance else total_distance
+        t += step_dt
+        steps += 1
+    v = math.sqrt(2.0 * e / prm.mass)
+    return sim.SimResult(t=t, d=d, v=v, grade=grade, sd=sd, steps=steps, splits=splits)
+
+if __name__ == '__main__':
+    import sys
+    import track_point as tp
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+        import time
+
+        parser = argparse.ArgumentParser(description='Compare simulating with the segment slopes and with the smooth elevation model.')
+        parser.add_argument('filename', type=str, help='.gpx, .tcx or .csv route')
+        parser.add_argument('--window', type=float, default=0.0, help='meters to average elevations over before fitting')
+        parser.add_argument('--dts', type=str, default='0.1,0.25,0.5,1,2,4', help='comma separated time steps')
+        parser.add_argument('--reference-dt', type=float, default=0.01, help='time step of the reference simulations')
+        args = parser.parse_args()
+
+        route: p.Path = p.Path(tf.readTrackList(args.filename))
+        model: ElevationModel = ElevationModel(route, args.window)
+        # Each is compared with itself at the reference dt, the error is that of the integration
+        def run(f: Callable[[float], sim.SimResult], dt: float) -> Tuple[Optional[float], int, float]:
+            """Return f(dt)'s time, None if it failed, steps and seconds taken"""
+            start: float = time.perf_counter()
+            try:
+                result: sim.SimResult = f(dt)
+            except ValueError:
+                return None, 0, time.perf_counter() - start
+            return result.t, result.steps, time.perf_counter() - start
+        runs: Dict[str, Callable[[float], sim.SimResult]] = {
+            'segments': lambda dt: sim.simulate(route, sim.Params(dt=dt)),
+            'smooth': lambda dt: sim.simulate(route, sim.Params(dt=dt), slope=model.slpRadians),
+            'smooth heun': lambda dt: simulate(route, sim.Params(dt=dt), model)}
+        refs: Dict[str, Optional[float]] = {name: run(f, args.reference_dt)[0] for name, f in runs.items()}
+        print(f'{args.filename}: reference dt={args.reference_dt} ' +
+              ' '.join(f'{name} {sim.hms(t) if t is not None else "failed"}' for name, t in refs.items()))
+        print(f"{'dt':>5} " + ' '.join(f'{name + " steps":>17} {"err":>9} {"secs":>6}' for name in runs))
+        for dt in [float(s) for s in args.dts.split(',')]:
+            line: str = f'{dt:>5g}'
+            for name, f in runs.items():
+                t, steps, secs = run(f, dt)
+                ref: Optional[float] = refs[name]
+                err: str = f'{t - ref:>8.3f}s' if (t is not None) and (ref is not None) else f'{"failed":>9}'
+                line += f' {steps:>17} {err} {secs:>6.2f}'
+            print(line)
+        sys.exit(0)
+
+    import unittest
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    def mkRoute(eles: List[float], step: float=100.0) -> p.Path:
+        """Return a path heading north with a point every step meters at eles"""
+        return p.Path([tp.TrackPoint(lat=math.degrees(i * step / tp.earthR1), lon=0.0, ele=ele) for i, ele in enumerate(eles)])
+
+    class TestElevationModel(unittest.TestCase):
+
+        def test_interpolates_without_overshoot(self: TestElevationModel):
+            route: p.Path = mkRoute([0.0, 0.0, 10.0, 30.0, 30.0, 20.0, 25.0])
+            model: ElevationModel = ElevationModel(route)
+            tl = route.trackList()
+            self.assertTrue(np.allclose(model.elevations(np.array([pt.tot for pt in tl])), [pt.ele for pt in tl]))
+            d: np.ndarray = np.linspace(0.0, route.tot(), 2001)
+            ele: np.ndarray = model.elevations(d)
+            # Flat where the points are level and within the points' range between them
+            flat: np.ndarray = d <= tl[1].tot
+            self.assertTrue(np.allclose(ele[flat], 0.0))
+            self.assertTrue(np.all(ele[(d >= tl[3].tot) & (d <= tl[4].tot)] <= 30.0 + 1e-9))
+            self.assertTrue(np.all(np.diff(ele[(d >= tl[1].tot) & (d <= tl[3].tot)]) >= -1e-12))
+
+        def test_slope_is_derivative(self: TestElevationModel):
+            model: ElevationModel = ElevationModel(p.Path(tf.readTrackList(gpx_test_file)))
+            d: np.ndarray = np.linspace(1.0, model.x[-1] - 1.0, 500)
+            eps: float = 1e-4
+            numeric: np.ndarray = (model.elevations(d + eps) - model.elevations(d - eps)) / (2.0 * eps)
+            self.assertTrue(np.allclose(model.grades(d), numeric, atol=1e-6))
+            # The slope is continuous at the points
+            knots: np.ndarray = model.x[1:-1]
+            self.assertTrue(np.allclose(model.grades(knots - 1e-7), model.grades(knots), atol=1e-6))
+
+        def test_cursor_matches_vectorized(self: TestElevationModel):
+            model: ElevationModel = ElevationModel(p.Path(tf.readTrackList(gpx_test_file)), window=50.0)
+            d: np.ndarray = np.concatenate((np.linspace(-10.0, model.x[-1] + 10.0, 3000), np.random.default_rng(1).uniform(0.0, model.x[-1], 300)))
+            scalar: List[float] = [model.slpRadians(x) for x in d.tolist()]
+            self.assertTrue(np.allclose(scalar, model.slopes(d), rtol=0.0, atol=1e-15))
+            self.assertEqual(model.slpRadians(-1.0), 0.0)
+            self.assertEqual(model.slpRadians(model.x[-1]), 0.0)
+
+        def test_degenerate(self: TestElevationModel):
+            self.assertEqual(ElevationModel(mkRoute([5.0])).slpRadians(0.0), 0.0)
+            line: ElevationModel = ElevationModel(mkRoute([0.0, 10.0]))
+            self.assertAlmostEqual(line.grade(50.0), 0.1)
+            # A repeated point is dropped
+            tl = mkRoute([0.0, 10.0, 20.0]).trackList()
+            twice: ElevationModel = ElevationModel(p.Path([tl[0], tl[1], tp.TrackPoint(lat=math.degrees(tl[1].lat), lon=0.0, ele=10.0), tl[2]]))
+            self.assertEqual(len(twice.x), 3)
+            self.assertAlmostEqual(twice.grade(150.0), 0.1)
+
+        def test_simulate(self: TestElevationModel):
+            route: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+            model: ElevationModel = ElevationModel(route)
+            smooth: sim.SimResult = sim.simulate(route, slope=model.slpRadians)
+            self.assertAlmostEqual(smooth.t, sim.simulate(route).t, delta=5.0)
+            self.assertEqual(smooth.d, route.tot())
+            # Each step uses the slope at its starting distance
+            ds: List[float] = [0.0]
+            grades: List[float] = []
+            def step(t: float, dt: float, d: float, v: float, grade: float, sd: float) -> None:
+                ds.append(d)
+                grades.append(grade)
+            sim.simulate(route, slope=model.slpRadians, step=step)
+            self.assertTrue(np.allclose(grades, model.slopes(np.array(ds[:-1])), rtol=0.0, atol=1e-15))
+
+        def test_heun(self: TestElevationModel):
+            route: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+            model: ElevationModel = ElevationModel(route)
+            reference: sim.SimResult = simulate(route, sim.Params(dt=0.01), model)
+            self.assertAlmostEqual(reference.t, sim.simulate(route, sim.Params(dt=0.01), slope=model.slpRadians).t, delta=0.5)
+            # Second order, five times the step is more accurate than simulator.simulate
+            result: sim.SimResult = simulate(route, sim.Params(dt=0.5), model)
+            self.assertAlmostEqual(result.t, reference.t, delta=0.1)
+            self.assertTrue(abs(result.t - reference.t) < abs(sim.simulate(route, sim.Params(dt=0.1)).t - sim.simulate(route, sim.Params(dt=0.01)).t))
+            self.assertEqual(result.d, route.tot())
+            self.assertEqual(len(result.splits), len(route.kmDistances()))
+            self.assertEqual(result.splits[-1], result.t)
+            self.assertTrue(np.allclose(result.splits, reference.splits, rtol=0.0, atol=0.5))
+
+    unittest.main()
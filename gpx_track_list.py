@@ -2,17 +2,21 @@
 
 # bike power calculation
 from __future__ import annotations
-from typing import Optional, List
-from dataclasses import dataclass
+from typing import Optional, List, Dict, Tuple, Union, Iterable, FrozenSet, BinaryIO
+from dataclasses import dataclass, field
 
+import io
 import math
-import numpy as np
+import os
 import xml.etree.ElementTree as et
+import xml.parsers.expat
 import track_point as tp
+import track_file as tf
+import instrument
 
 
-def parse_trkpt(elem_trkpt: et.Element) -> Optional[tp.TrackPoint]:
-    "Return TrackPointo or None"
+def parse_trkpt(elem_trkpt: et.Element, fields: Optional[FrozenSet[str]]=None) -> Optional[tp.TrackPoint]:
+    "Return TrackPointo or None, ele is only parsed if it is in fields, default all"
     lat_str: str = ''
     lon_str: str = ''
 
@@ -27,6 +31,9 @@ def parse_trkpt(elem_trkpt: et.Element) -> Optional[tp.TrackPoint]:
     else:
         return None
 
+    if (fields is not None) and ('ele' not in fields):
+        return tp.TrackPoint(lat=float(lat_str), lon=float(lon_str))
+
     elem_ele = elem_trkpt.find('.//{*}ele')
     ele_str: str
     if elem_ele is not None and elem_ele.text:
@@ -38,22 +45,175 @@ def parse_trkpt(elem_trkpt: et.Element) -> Optional[tp.TrackPoint]:
 
     return tp.TrackPoint(lat=float(lat_str), lon=float(lon_str), ele=float(ele_str))
 
-def GpxTrackList(filename: str) -> List[tp.TrackPoint]:
-    """Create a List[tp.TrackPoint] which maybe empty if no trkpt's found"""
+def GpxReaderTrackList(reader: BinaryIO, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """
+    Create a List[tp.TrackPoint] from a gpx BinaryIO stream, result maybe empty if no trkpt's found.
+    Only the fields, default all, are parsed, the others are left at their defaults.
+    """
+    names: Optional[FrozenSet[str]] = tp.checkFields(fields)
 
-    # Create a list of TrackPoints
+    # Create a list of TrackPoints, parsing as the stream is read and
+    # discarding the elements parsed so memory doesn't grow with the file
     track: List[tp.TrackPoint] = []
     elem: et.Element
-    tree = et.parse(filename)
-    root: et.Element = tree.getroot()
-    for elem in root.findall('.//{*}trkpt'):
-        p: Optional[tp.TrackPoint]
-        p = parse_trkpt(elem)
-        if p is not None:
-            track.append(p)
+    with instrument.stage('gpx parse'):
+        for _, elem in et.iterparse(reader):
+            local: str = elem.tag.rpartition('}')[2]
+            if local == 'trkpt':
+                p: Optional[tp.TrackPoint]
+                p = parse_trkpt(elem, names)
+                if p is not None:
+                    track.append(p)
+                elem.clear()
+            elif local == 'trkseg':
+                elem.clear()
+    instrument.count('gpx points', len(track))
 
     return track
 
+def GpxTrackList(filename: str, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """Create a List[tp.TrackPoint] which maybe empty if no trkpt's found, filename may be compressed"""
+    with tf.openTrack(filename) as f:
+        return GpxReaderTrackList(f, fields)
+
+def GpxBytesTrackList(data: bytes, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    with io.BytesIO(data) as bio:
+        return GpxReaderTrackList(bio, fields)
+
+@dataclass
+class GpxSegmentIndex:
+    points: int # Number of trkpt's
+    start: int  # Byte offset of <trkseg
+    end: int    # Byte offset just past </trkseg>
+
+@dataclass
+class GpxTrackIndex:
+    name: str   # Name of the trk, '' if it has none
+    start: int  # Byte offset of <trk
+    end: int    # Byte offset just past </trk>
+    segments: List[GpxSegmentIndex] = field(default_factory=list)
+
+    def points(self: GpxTrackIndex) -> int:
+        return sum(s.points for s in self.segments)
+
+@dataclass
+class GpxFileIndex:
+    encoding: str        # From the xml declaration
+    root: bytes          # The start tag of the gpx element with its namespace declarations
+    root_end: bytes      # The end tag of the gpx element
+    tracks: List[GpxTrackIndex] = field(default_factory=list)
+
+def _quoteAttr(value: str) -> str:
+    """Return value quoted as an xml attribute, xml.sax.saxutils.quoteattr imports urllib"""
+    return '"' + value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;') \
+        .replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;') + '"'
+
+def _localName(tag: str) -> str:
+    return tag.rsplit(':', 1)[-1]
+
+def GpxScanIndex(reader: BinaryIO, chunk_size: int=1 << 20) -> GpxFileIndex:
+    """Return the index of the trk's and trkseg's in a gpx stream found with one pass of expat"""
+    index: GpxFileIndex = GpxFileIndex(encoding='UTF-8', root=b'', root_end=b'')
+    parser = xml.parsers.expat.ParserCreate()
+    stack: List[str] = []
+    name: List[str] = []
+    # Byte offsets of end tags, resolved to just past their '>' once the text is available
+    ends: List[Tuple[Union[GpxTrackIndex, GpxSegmentIndex], str, int]] = []
+
+    def xmlDecl(version: str, encoding: Optional[str], standalone: int) -> None:
+        if encoding:
+            index.encoding = encoding
+
+    def start(tag: str, attrs: Dict[str, str]) -> None:
+        local: str = _localName(tag)
+        if not stack:
+            decls: str = ''.join(f' {k}={_quoteAttr(v)}' for k, v in attrs.items() if k == 'xmlns' or k.startswith('xmlns:'))
+            index.root = f'<{tag}{decls}>'.encode(index.encoding)
+            index.root_end = f'</{tag}>'.encode(index.encoding)
+        elif local == 'trk' and len(stack) == 1:
+            index.tracks.append(GpxTrackIndex(name='', start=parser.CurrentByteIndex, end=-1))
+        elif local == 'trkseg' and len(stack) == 2 and index.tracks:
+            index.tracks[-1].segments.append(GpxSegmentIndex(points=0, start=parser.CurrentByteIndex, end=-1))
+        elif local == 'trkpt' and len(stack) == 3 and index.tracks and index.tracks[-1].segments:
+            index.tracks[-1].segments[-1].points += 1
+        elif local == 'name' and len(stack) == 2 and stack[1] == 'trk':
+            name.clear()
+        stack.append(local)
+
+    def end(tag: str) -> None:
+        local: str = stack.pop()
+        if local == 'trk' and len(stack) == 1:
+            ends.append((index.tracks[-1], tag, parser.CurrentByteIndex))
+        elif local == 'trkseg' and len(stack) == 2 and index.tracks:
+            ends.append((index.tracks[-1].segments[-1], tag, parser.CurrentByteIndex))
+        elif local == 'name' and len(stack) == 2 and stack[1] == 'trk':
+            index.tracks[-1].name = ''.join(name).strip()
+
+    def text(data: str) -> None:
+        if stack and stack[-1] == 'name' and len(stack) == 3 and stack[1] == 'trk':
+            name.append(data)
+
+    parser.XmlDeclHandler = xmlDecl
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    with instrument.stage('gpx index'):
+        while True:
+            chunk: bytes = reader.read(chunk_size)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+
+    # An end tag is '</' tag optional whitespace '>'
+    entry: Union[GpxTrackIndex, GpxSegmentIndex]
+    for entry, tag, offset in ends:
+        entry.end = offset + len(f'</{tag}'.encode(index.encoding))
+        reader.seek(entry.end)
+        entry.end += reader.read(64).index(b'>') + 1
+    return index
+
+# (realpath, mtime_ns, size) to the index of the file
+_indexes: Dict[Tuple[str, int, int], GpxFileIndex] = {}
+
+def GpxIndex(filename: str) -> GpxFileIndex:
+    """Return the index of filename, scanned the first time and then cached while the file is unchanged"""
+    st: os.stat_result = os.stat(filename)
+    key: Tuple[str, int, int] = (os.path.realpath(filename), st.st_mtime_ns, st.st_size)
+    index: Optional[GpxFileIndex] = _indexes.get(key)
+    if index is None:
+        with tf.openTrack(filename) as f:
+            index = GpxScanIndex(f)
+        _indexes[key] = index
+    return index
+
+def GpxSelectTrackList(filename: str, track: Union[int, str], segment: Optional[int]=None,
+                       fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """
+    Return the TrackPoints of one trk, by index or name, or one of its trkseg's.
+    Only the bytes of the trk or trkseg are read and parsed.
+    """
+    index: GpxFileIndex = GpxIndex(filename)
+    trk: GpxTrackIndex
+    if isinstance(track, str):
+        named: List[GpxTrackIndex] = [t for t in index.tracks if t.name == track]
+        if not named:
+            raise ValueError(f'No trk named {track!r} in {filename}')
+        trk = named[0]
+    else:
+        if not (0 <= track < len(index.tracks)):
+            raise ValueError(f'No trk[{track}] in {filename}, it has {len(index.tracks)}')
+        trk = index.tracks[track]
+    region: Union[GpxTrackIndex, GpxSegmentIndex] = trk
+    if segment is not None:
+        if not (0 <= segment < len(trk.segments)):
+            raise ValueError(f'No trkseg[{segment}] in trk {trk.name!r} of {filename}, it has {len(trk.segments)}')
+        region = trk.segments[segment]
+    with tf.openTrack(filename) as f:
+        f.seek(region.start)
+        data: bytes = f.read(region.end - region.start)
+    decl: bytes = f'<?xml version="1.0" encoding="{index.encoding}"?>'.encode(index.encoding)
+    return GpxBytesTrackList(decl + index.root + data + index.root_end, fields)
+
 if __name__ == '__main__':
     test_data = './test/data/RAAM_TS00_route_snippet.gpx'
 
@@ -73,4 +233,56 @@ if __name__ == '__main__':
             tl = GpxTrackList(test_data)
             self.assertTrue(len(tl) != 0)
 
+        def test_GpxBytesTrackList(self):
+            with open(test_data, 'rb') as f:
+                tl = GpxBytesTrackList(f.read())
+            self.assertTrue(tp.compareList(tl, GpxTrackList(test_data)))
+
+        def test_fields(self):
+            tl = GpxTrackList(test_data)
+            geometry = GpxTrackList(test_data, tp.geometry_fields)
+            self.assertTrue(tp.compareList(geometry, tl))
+            flat = GpxTrackList(test_data, ['lat', 'lon'])
+            self.assertEqual([(pt.lat, pt.lon) for pt in flat], [(pt.lat, pt.lon) for pt in tl])
+            self.assertTrue(all(pt.ele == 0.0 for pt in flat))
+            self.assertRaises(ValueError, GpxTrackList, test_data, ['elevation'])
+
+        def test_GpxIndex(self):
+            index: GpxFileIndex = GpxIndex(test_data)
+            self.assertTrue(GpxIndex(test_data) is index)
+            self.assertEqual([(t.name, len(t.segments), t.points()) for t in index.tracks], [('RAAM TS00', 1, 26)])
+            with open(test_data, 'rb') as f:
+                data: bytes = f.read()
+            self.assertTrue(data[index.tracks[0].start:].startswith(b'<trk>'))
+            self.assertTrue(data[:index.tracks[0].end].endswith(b'</trk>'))
+            self.assertTrue(data[:index.tracks[0].segments[0].end].endswith(b'</trkseg>'))
+
+        def test_GpxSelectTrackList(self):
+            import tempfile
+            with open(test_data, 'rb') as f:
+                data: bytes = f.read()
+            index: GpxFileIndex = GpxIndex(test_data)
+            trk: bytes = data[index.tracks[0].start:index.tracks[0].end]
+            seg: bytes = data[index.tracks[0].segments[0].start:index.tracks[0].segments[0].end]
+            # Two tracks, the first with its segment twice and the second named B
+            multi: bytes = data[:index.tracks[0].start] + trk.replace(seg, seg + b'\n  ' + seg) + b'\n ' + \
+                trk.replace(b'<name>RAAM TS00</name>', b'<name>B</name>') + data[index.tracks[0].end:]
+            # A namespace which must be escaped again in the synthesized document
+            multi = multi.replace(b'<gpx ', b'<gpx xmlns:q="urn:a?b=1&amp;c=&quot;2&quot;&lt;" ', 1)
+            with tempfile.TemporaryDirectory() as tmp:
+                filename: str = os.path.join(tmp, 'multi.gpx')
+                with open(filename, 'wb') as f:
+                    f.write(multi)
+                tracks: List[GpxTrackIndex] = GpxIndex(filename).tracks
+                self.assertEqual([(t.name, [s.points for s in t.segments]) for t in tracks],
+                                 [('RAAM TS00', [26, 26]), ('B', [26])])
+                tl: List[tp.TrackPoint] = GpxTrackList(test_data)
+                self.assertTrue(tp.compareList(GpxSelectTrackList(filename, 'B'), tl))
+                self.assertTrue(tp.compareList(GpxSelectTrackList(filename, 0), tl + tl))
+                self.assertTrue(tp.compareList(GpxSelectTrackList(filename, 0, 1), tl))
+                self.assertTrue(tp.compareList(GpxTrackList(filename), tl * 3))
+                self.assertRaises(ValueError, GpxSelectTrackList, filename, 'C')
+                self.assertRaises(ValueError, GpxSelectTrackList, filename, 2)
+                self.assertRaises(ValueError, GpxSelectTrackList, filename, 1, 1)
+
     unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Simulate a group of riders where riders draft the rider ahead of them
+from __future__ import annotations
+from typing import Optional, List
+from dataclasses import dataclass
+
+import time
+import numpy as np
+import path as p
+import simulator as sim
+import batch as bsim
+
+@dataclass
+class Draft:
+    """
+    How much drafting reduces a rider's drag, the reduction falls off
+    exponentially with the gap between the rider's front wheel and the
+    back wheel of the rider ahead.
+    """
+    reduction: float = 0.35   # Fraction of drag saved at min_gap or closer
+    min_gap: float = 0.5      # Meters
+    decay: float = 3.0        # Meters for the reduction to fall by 1/e
+    bike_length: float = 1.75 # Meters, distances are to the front wheel
+
+    def factor(self: Draft, gap: np.ndarray) -> np.ndarray:
+        """Return the factor to scale drag by at each gap in meters"""
+        return 1.0 - self.reduction * np.exp((self.min_gap - np.maximum(gap, self.min_gap)) / self.decay)
+
+class Drafting:
+    """
+    The batch.DragFactor of riders drafting the rider directly ahead.
+
+    The riders are kept sorted by distance, the order from the previous
+    step is nearly sorted so re-sorting it with a stable sort is close to
+    linear. Riders at the same distance are ridden in file.
+    """
+
+    def __init__(self: Drafting, draft: Draft=Draft()) -> None:
+        self.draft: Draft = draft
+        self.__order: Optional[np.ndarray] = None
+
+    def __call__(self: Drafting, d: np.ndarray, v: np.ndarray) -> np.ndarray:
+        order: Optional[np.ndarray] = self.__order
+        if (order is None) or (len(order) != len(d)):
+            # First step or riders have finished
+            order = np.argsort(d, kind='stable')
+        else:
+            order = order[np.argsort(d[order], kind='stable')]
+        self.__order = order
+
+        ds: np.ndarray = d[order]
+        gap: np.ndarray = np.empty(len(d))
+        gap[:-1] = ds[1:] - ds[:-1] - self.draft.bike_length
+        gap[-1:] = np.inf # The leader
+        factor: np.ndarray = np.empty(len(d))
+        factor[order] = self.draft.factor(gap)
+        return factor
+
+def simulateGroup(path: p.Path, prms: List[sim.Params], draft: Draft=Draft(),
+                  step: Optional[bsim.BatchStep]=None) -> bsim.BatchResult:
+    """Simulate riders with prms riding path together from a mass start"""
+    return bsim.simulateBatch(path, prms, Drafting(draft), step)
+
+if __name__ == '__main__':
+    import sys
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+
+        parser = argparse.ArgumentParser(description='Compare riders riding a route together and alone.')
+        parser.add_argument('filename', type=str, help='.gpx, .tcx or .csv route')
+        parser.add_argument('--riders', type=int, default=100, help='number of riders')
+        parser.add_argument('--power', type=float, default=sim.power, help='mean power in watts')
+        parser.add_argument('--spread', type=float, default=20.0, help='standard deviation of power in watts')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the powers')
+        args = parser.parse_args()
+
+        route: p.Path = p.Path(tf.readTrackList(args.filename))
+        powers: np.ndarray = np.random.default_rng(args.seed).normal(args.power, args.spread, args.riders)
+        prms: List[sim.Params] = [sim.Params(power=max(float(w), 50.0)) for w in powers]
+        start: float = time.perf_counter()
+        group: bsim.BatchResult = simulateGroup(route, prms)
+        group_secs: float = time.perf_counter() - start
+        start = time.perf_counter()
+        solo: bsim.BatchResult = bsim.simulateBatch(route, prms)
+        solo_secs: float = time.perf_counter() - start
+        print(f'{args.filename}: {args.riders} riders group {group_secs:.2f}s solo {solo_secs:.2f}s')
+        print(f"{'rider':>5} {'power':>7} {'solo':>10} {'group':>10} {'saved':>8}")
+        i: int
+        for i in np.argsort(group.t):
+            print(f'{i:>5} {prms[i].power:>6.1f}W {sim.hms(solo.t[i]):>10} {sim.hms(group.t[i]):>10} {solo.t[i] - group.t[i]:>7.0f}s')
+        sys.exit(0)
+
+    import unittest
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestGroupRide(unittest.TestCase):
+
+        def setUp(self: TestGroupRide):
+            self.path: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+
+        def test_draft_factor(self: TestGroupRide):
+            draft: Draft = Draft()
+            factor: np.ndarray = draft.factor(np.array([-1.0, 0.5, 3.5, np.inf]))
+            self.assertAlmostEqual(factor[0], 1.0 - draft.reduction)
+            self.assertAlmostEqual(factor[1], 1.0 - draft.reduction)
+            self.assertAlmostEqual(factor[2], 1.0 - draft.reduction / np.e)
+            self.assertEqual(factor[3], 1.0)
+
+        def test_neighbors(self: TestGroupRide):
+            drafting: Drafting = Drafting(Draft(bike_length=0.0))
+            d: np.ndarray = np.array([10.0, 30.0, 11.0, 20.0])
+            factor: np.ndarray = drafting(d, np.zeros(4))
+            self.assertTrue(np.allclose(factor, Draft(bike_length=0.0).factor(np.array([1.0, np.inf, 9.0, 10.0]))))
+            # Riders 0 and 2 swap places
+            factor = drafting(np.array([12.0, 31.0, 11.5, 21.0]), np.zeros(4))
+            self.assertTrue(np.allclose(factor, Draft(bike_length=0.0).factor(np.array([9.0, np.inf, 0.5, 10.0]))))
+
+        def test_no_draft_is_solo(self: TestGroupRide):
+            prms: List[sim.Params] = [sim.Params(power=w) for w in (120.0, 142.0, 160.0)]
+            group: bsim.BatchResult = simulateGroup(self.path, prms, Draft(reduction=0.0))
+            solo: bsim.BatchResult = bsim.simulateBatch(self.path, prms)
+            self.assertTrue(np.array_equal(group.t, solo.t))
+
+        def test_drafting_is_faster(self: TestGroupRide):
+            prms: List[sim.Params] = [sim.Params(power=w) for w in (140.0, 142.0, 144.0)]
+            group: bsim.BatchResult = simulateGroup(self.path, prms)
+            solo: bsim.BatchResult = bsim.simulateBatch(self.path, prms)
+            self.assertTrue(np.all(group.t <= solo.t))
+            self.assertTrue(group.t.sum() < solo.t.sum())
+
+    unittest.main()
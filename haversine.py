@@ -10,13 +10,45 @@ Flgorithm from:
   - Return distance in meters
   - Removed output
   - Added test for "main" to output a copule values
+
+Array kernels:
+  The *Array functions operate on numpy arrays of coordinates in radians,
+  the same units TrackPoint stores, and return one value per element.
+  Three accuracy modes are available via DisMode, errors are relative to
+  the WGS84 ellipsoid unless noted:
+
+  - HAVERSINE: Great circle on a sphere of radius earthR1. Error is the
+    sphere vs ellipsoid difference, up to about 0.5% and typically 0.1%
+    to 0.3% at mid latitudes. This is what TrackPoint.disMeters computes.
+  - EQUIRECTANGULAR: Flat earth approximation at the mean latitude of each
+    segment, about 2x faster than HAVERSINE. Its error relative to
+    HAVERSINE grows with the cube of the segment length, at latitudes
+    below 70 deg it is under 0.01mm for 1km segments and under 1cm for
+    10km segments, so it is only suitable for short segments such as
+    the distance between track points.
+  - VINCENTY: Iterative inverse solution on the WGS84 ellipsoid, accurate
+    to about 0.5mm. It is the slowest and may fail to converge for nearly
+    antipodal points, those fall back to HAVERSINE.
 '''
 
 import math
+from enum import Enum
 from typing import Tuple
 
+import numpy as np
+
 earthR1 = 6_371_008.7714
 
+# WGS84 ellipsoid
+wgs84A = 6_378_137.0
+wgs84F = 1.0 / 298.257223563
+wgs84B = wgs84A * (1.0 - wgs84F)
+
+class DisMode(Enum):
+    HAVERSINE = 'haversine'
+    EQUIRECTANGULAR = 'equirectangular'
+    VINCENTY = 'vincenty'
+
 def haversine(coord1: Tuple[float, float], coord2: Tuple[float, float], radius: float=earthR1) -> float:
 
     # Coordinates in decimal degrees (e.g. 2.89078, 12.79797)
@@ -43,6 +75,169 @@ def haversine(coord1: Tuple[float, float], coord2: Tuple[float, float], radius:
     meters = radius * c  # output distance in meters
     return meters
 
+def haversineArray(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray, radius: float=earthR1) -> np.ndarray:
+    """Return the haversine distance in meters, same formula as TrackPoint.disMeters"""
+    dLat_haversine = np.sin((lat2 - lat1) / 2.0)
+    dLon_haversine = np.sin((lon2 - lon1) / 2.0)
+    a = (dLat_haversine ** 2) + (np.cos(lat1) * np.cos(lat2) * (dLon_haversine ** 2.0))
+    c = 2.0 * np.arctan2(np.sqrt(a), np.sqrt(1.0 - a))
+    return radius * c
+
+def equirectangularArray(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray, radius: float=earthR1) -> np.ndarray:
+    """Return the equirectangular approximation of the distance in meters, short segments only"""
+    x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2.0)
+    y = lat2 - lat1
+    return radius * np.sqrt((x * x) + (y * y))
+
+def vincentyArray(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray,
+                  a: float=wgs84A, f: float=wgs84F, iterations: int=200, tolerance: float=1e-12) -> np.ndarray:
+    """Return the distance in meters on the ellipsoid a, f using Vincenty's inverse formula"""
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2)))
+    b: float = a * (1.0 - f)
+    L = lon2 - lon1
+    U1 = np.arctan((1.0 - f) * np.tan(lat1))
+    U2 = np.arctan((1.0 - f) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(iterations):
+            sinLam, cosLam = np.sin(lam), np.cos(lam)
+            sinSigma = np.sqrt(((cosU2 * sinLam) ** 2) + (((cosU1 * sinU2) - (sinU1 * cosU2 * cosLam)) ** 2))
+            cosSigma = (sinU1 * sinU2) + (cosU1 * cosU2 * cosLam)
+            sigma = np.arctan2(sinSigma, cosSigma)
+            # Coincident points have sinSigma == 0
+            sinAlpha = np.where(sinSigma == 0.0, 0.0, cosU1 * cosU2 * sinLam / sinSigma)
+            cos2Alpha = 1.0 - (sinAlpha * sinAlpha)
+            # Equatorial lines have cos2Alpha == 0
+            cos2SigmaM = np.where(cos2Alpha == 0.0, 0.0, cosSigma - (2.0 * sinU1 * sinU2 / cos2Alpha))
+            C = f / 16.0 * cos2Alpha * (4.0 + (f * (4.0 - (3.0 * cos2Alpha))))
+            prev = lam
+            lam = L + ((1.0 - C) * f * sinAlpha * \
+                      (sigma + (C * sinSigma * (cos2SigmaM + (C * cosSigma * (-1.0 + (2.0 * cos2SigmaM * cos2SigmaM)))))))
+            converged = np.abs(lam - prev) <= tolerance
+            if converged.all():
+                break
+
+        u2 = cos2Alpha * ((a * a) - (b * b)) / (b * b)
+        A = 1.0 + (u2 / 16384.0 * (4096.0 + (u2 * (-768.0 + (u2 * (320.0 - (175.0 * u2)))))))
+        B = u2 / 1024.0 * (256.0 + (u2 * (-128.0 + (u2 * (74.0 - (47.0 * u2))))))
+        deltaSigma = B * sinSigma * (cos2SigmaM + (B / 4.0 * ((cosSigma * (-1.0 + (2.0 * cos2SigmaM * cos2SigmaM))) - \
+                     (B / 6.0 * cos2SigmaM * (-3.0 + (4.0 * sinSigma * sinSigma)) * (-3.0 + (4.0 * cos2SigmaM * cos2SigmaM))))))
+        s = b * A * (sigma - deltaSigma)
+
+    # Nearly antipodal points may not converge, fall back to haversine for those
+    failed = ~converged | ~np.isfinite(s)
+    if failed.any():
+        s = np.where(failed, haversineArray(lat1, lon1, lat2, lon2), s)
+    return s
+
+def disArray(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray, mode: DisMode=DisMode.HAVERSINE) -> np.ndarray:
+    """Return the distance in meters between the points using mode"""
+    if mode is DisMode.HAVERSINE:
+        return haversineArray(lat1, lon1, lat2, lon2)
+    elif mode is DisMode.EQUIRECTANGULAR:
+        return equirectangularArray(lat1, lon1, lat2, lon2)
+    elif mode is DisMode.VINCENTY:
+        return vincentyArray(lat1, lon1, lat2, lon2)
+    else:
+        raise ValueError(f'Unknown mode:{mode}')
+
+def brgArray(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Return the initial bearing in radians North = 0.0, East = pi/2, South = pi, West = -pi/2"""
+    dLon = lon2 - lon1
+    y = np.sin(dLon) * np.cos(lat2)
+    x = (np.cos(lat1) * np.sin(lat2)) - (np.sin(lat1) * np.cos(lat2) * np.cos(dLon))
+    return np.arctan2(y, x)
+
+def segmentDisArray(lat: np.ndarray, lon: np.ndarray, mode: DisMode=DisMode.HAVERSINE) -> np.ndarray:
+    """Return the n-1 distances in meters between consecutive points of a track"""
+    return disArray(lat[:-1], lon[:-1], lat[1:], lon[1:], mode)
+
+def segmentBrgArray(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Return the n-1 bearings in radians between consecutive points of a track"""
+    return brgArray(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
 if __name__ == '__main__':
     print(f'distance: {haversine((-0.116773, 51.510357), (-77.009003, 38.889931))}m')
     print(f'disnance: {haversine((1.0, 2.0), (1.0, 3.0))}m')
+
+    # Benchmark the modes on real track data, errors are relative to VINCENTY
+    import os
+    import timeit
+    import gpx_track_list as gpx_tl
+
+    track_file = './data/RAAM_TS21_first_half_35_9mi_virtual_ride.gpx'
+    if os.path.exists(track_file):
+        tl = gpx_tl.GpxTrackList(track_file)
+        lat: np.ndarray = np.array([pt.lat for pt in tl])
+        lon: np.ndarray = np.array([pt.lon for pt in tl])
+        loops: int = 20
+        print(f'{track_file}: {len(tl)} points, {loops} loops')
+
+        scalar: float = timeit.timeit(lambda: [tl[i].disMeters(tl[i + 1]) for i in range(len(tl) - 1)], number=loops)
+        print(f'  {"TrackPoint.disMeters":<20} {scalar / loops * 1e3:>9.3f}ms')
+        ref: np.ndarray = segmentDisArray(lat, lon, DisMode.VINCENTY)
+        sphere: np.ndarray = segmentDisArray(lat, lon, DisMode.HAVERSINE)
+        mode: DisMode
+        for mode in DisMode:
+            secs: float = timeit.timeit(lambda: segmentDisArray(lat, lon, mode), number=loops)
+            dis: np.ndarray = segmentDisArray(lat, lon, mode)
+            print(f'  {mode.value:<20} {secs / loops * 1e3:>9.3f}ms {scalar / secs:>7.1f}x' + \
+                  f' max err={np.abs(dis - ref).max():.6f}m total err={abs(dis.sum() - ref.sum()):.3f}m' + \
+                  f' max err vs haversine={np.abs(dis - sphere).max():.9f}m')
+        secs = timeit.timeit(lambda: segmentBrgArray(lat, lon), number=loops)
+        print(f'  {"bearing":<20} {secs / loops * 1e3:>9.3f}ms')
+
+    import unittest
+
+    class TestHaversine(unittest.TestCase):
+
+        def test_haversineArray_matches_haversine(self):
+            d: np.ndarray = haversineArray(np.radians([1.0]), np.radians([2.0]), np.radians([1.0]), np.radians([3.0]))
+            self.assertEqual(round(d[0], 3), round(haversine((1.0, 2.0), (1.0, 3.0)), 3))
+            self.assertEqual(round(d[0], 3), 111178.144)
+
+        def test_equirectangular_short_segment(self):
+            lat1 = np.radians(np.array([0.0, 33.0, 45.0, 60.0]))
+            lon1 = np.radians(np.array([0.0, -117.0, 10.0, -150.0]))
+            lat2 = lat1 + (500.0 / earthR1)
+            lon2 = lon1 + (500.0 / earthR1)
+            h: np.ndarray = haversineArray(lat1, lon1, lat2, lon2)
+            e: np.ndarray = equirectangularArray(lat1, lon1, lat2, lon2)
+            self.assertTrue(np.all(np.abs(h - e) < 0.001))
+
+        def test_vincenty_flinders_peak_to_buninyong(self):
+            # Classic test case from Vincenty's paper, 54972.271m
+            lat1 = math.radians(-(37 + (57 / 60) + (3.72030 / 3600)))
+            lon1 = math.radians(144 + (25 / 60) + (29.52440 / 3600))
+            lat2 = math.radians(-(37 + (39 / 60) + (10.15610 / 3600)))
+            lon2 = math.radians(143 + (55 / 60) + (35.38390 / 3600))
+            d: np.ndarray = vincentyArray(np.array([lat1]), np.array([lon1]), np.array([lat2]), np.array([lon2]))
+            self.assertEqual(round(d[0], 3), 54972.271)
+
+        def test_vincenty_coincident_and_antipodal(self):
+            d: np.ndarray = vincentyArray(np.array([0.5, 0.0]), np.array([0.5, 0.0]), np.array([0.5, 0.0]), np.array([0.5, math.pi]))
+            self.assertEqual(d[0], 0.0)
+            self.assertTrue(np.isfinite(d[1]))
+
+        def test_brgArray(self):
+            lat1 = np.radians(np.array([0.0, 0.0, 1.0, 0.0]))
+            lon1 = np.radians(np.array([90.0, 90.0, 90.0, 90.0]))
+            lat2 = np.radians(np.array([1.0, 0.0, 0.0, 0.0]))
+            lon2 = np.radians(np.array([90.0, 91.0, 90.0, 89.0]))
+            b: np.ndarray = np.round(np.degrees(brgArray(lat1, lon1, lat2, lon2)), 3)
+            self.assertEqual(list(b), [0.0, 90.0, 180.0, -90.0])
+
+        def test_segmentDisArray(self):
+            lat = np.radians(np.array([1.0, 1.0, 1.0]))
+            lon = np.radians(np.array([2.0, 3.0, 4.0]))
+            mode: DisMode
+            for mode in DisMode:
+                d: np.ndarray = segmentDisArray(lat, lon, mode)
+                self.assertEqual(len(d), 2)
+                self.assertTrue(abs(d[0] - 111178.144) / 111178.144 < 0.005)
+
+    unittest.main()
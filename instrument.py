@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Opt-in instrumentation of the pipeline stages
+from __future__ import annotations
+from typing import Dict, Any, Callable, TypeVar
+from dataclasses import dataclass, asdict
+
+import contextlib
+import time
+
+# Instrumented code checks enabled before recording anything so the
+# cost when disabled is a global lookup and a branch. Hot loops should
+# test enabled themselves rather than calling count unconditionally.
+enabled: bool = False
+
+@dataclass
+class StageTime:
+    secs: float = 0.0 # Total wall time in seconds
+    calls: int = 0    # Number of times the stage was entered
+
+stages: Dict[str, StageTime] = {}
+counters: Dict[str, int] = {}
+
+_null = contextlib.nullcontext()
+
+def enable(on: bool=True) -> None:
+    global enabled
+    enabled = on
+
+def reset() -> None:
+    stages.clear()
+    counters.clear()
+
+def add(name: str, secs: float) -> None:
+    """Add secs to the wall time of stage name"""
+    st: StageTime = stages.setdefault(name, StageTime())
+    st.secs += secs
+    st.calls += 1
+
+def count(name: str, n: int=1) -> None:
+    """Add n to counter name if enabled"""
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+class _Stage:
+    def __init__(self: _Stage, name: str) -> None:
+        self.name = name
+
+    def __enter__(self: _Stage) -> _Stage:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self: _Stage, *exc: Any) -> None:
+        add(self.name, time.perf_counter() - self.start)
+
+def stage(name: str) -> Any:
+    """Return a context manager which records the wall time of stage name if enabled"""
+    if enabled:
+        return _Stage(name)
+    return _null
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+def timed(name: str, fn: F) -> F:
+    """Return fn wrapped so each call is recorded as stage name if enabled, otherwise fn"""
+    if not enabled:
+        return fn
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start: float = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add(name, time.perf_counter() - start)
+    return wrapper # type: ignore
+
+def derived() -> Dict[str, float]:
+    """Return the ratios of interest computed from the counters"""
+    result: Dict[str, float] = {}
+    lookups: int = counters.get('lookups', 0)
+    if lookups:
+        result['scanned points per lookup'] = counters.get('lookup scanned points', 0) / lookups
+    steps: int = counters.get('steps', 0)
+    if steps and 'simulate' in stages:
+        result['us per step'] = stages['simulate'].secs / steps * 1e6
+    return result
+
+def toJson() -> Dict[str, Any]:
+    return {
+        'stages': {name: asdict(st) for name, st in stages.items()},
+        'counters': dict(counters),
+        'derived': derived(),
+    }
+
+def table() -> str:
+    """Return the stages, counters and derived values as a human readable table"""
+    lines = [f'{"stage":<24} {"calls":>10} {"secs":>12}']
+    name: str
+    for name, st in stages.items():
+        lines.append(f'{name:<24} {st.calls:>10} {st.secs:>12.6f}')
+    lines.append('')
+    lines.append(f'{"counter":<24} {"value":>10}')
+    for name, n in counters.items():
+        lines.append(f'{name:<24} {n:>10}')
+    for name, v in derived().items():
+        lines.append(f'{name:<24} {v:>10.3f}')
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import unittest
+
+    class TestInstrument(unittest.TestCase):
+
+        def setUp(self: TestInstrument):
+            reset()
+
+        def tearDown(self: TestInstrument):
+            enable(False)
+            reset()
+
+        def test_disabled_records_nothing(self: TestInstrument):
+            enable(False)
+            with stage('parse'):
+                count('points', 10)
+            self.assertTrue(timed('print', print) is print)
+            self.assertEqual(stages, {})
+            self.assertEqual(counters, {})
+
+        def test_enabled_records(self: TestInstrument):
+            enable()
+            for _ in range(2):
+                with stage('parse'):
+                    count('points', 10)
+            timed('noop', lambda: None)()
+            self.assertEqual(stages['parse'].calls, 2)
+            self.assertTrue(stages['parse'].secs >= 0.0)
+            self.assertEqual(stages['noop'].calls, 1)
+            self.assertEqual(counters['points'], 20)
+
+        def test_derived_and_report(self: TestInstrument):
+            enable()
+            count('lookups', 4)
+            count('lookup scanned points', 10)
+            self.assertEqual(derived()['scanned points per lookup'], 2.5)
+            self.assertTrue('lookups' in table())
+            self.assertEqual(toJson()['counters']['lookups'], 4)
+
+    unittest.main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+# Monte Carlo finish time distributions for uncertain parameters
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple, Iterator
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+
+import bisect
+import math
+import time
+import numpy as np
+import path as p
+import simulator as sim
+import batch as bsim
+
+# Samples below this fraction of the mean are drawn again, with power or mass 0 a simulation never finishes
+min_fraction: float = 0.25
+
+@dataclass(frozen=True)
+class Normal:
+    """
+    A normal distribution truncated to lo..hi, samples outside are drawn
+    again. lo defaults to min_fraction of the mean so samples are positive.
+    """
+    mean: float
+    sd: float
+    lo: Optional[float] = None
+    hi: float = math.inf
+
+    def __post_init__(self: Normal) -> None:
+        if self.lo is None:
+            object.__setattr__(self, 'lo', self.mean * min_fraction)
+        assert self.lo is not None
+        if not (math.isfinite(self.mean) and math.isfinite(self.sd) and (self.sd >= 0.0)):
+            raise ValueError(f'mean={self.mean} and sd={self.sd} must be finite and sd >= 0')
+        if not (0.0 < self.lo <= self.mean <= self.hi):
+            raise ValueError(f'0 < lo={self.lo} <= mean={self.mean} <= hi={self.hi} is required')
+
+    def sample(self: Normal, rng: np.random.Generator, n: int) -> np.ndarray:
+        assert self.lo is not None
+        x: np.ndarray = rng.normal(self.mean, self.sd, n)
+        tries: int = 0
+        while True:
+            out: np.ndarray = np.flatnonzero((x < self.lo) | (x > self.hi))
+            if len(out) == 0:
+                return x
+            tries += 1
+            if tries > 100:
+                raise ValueError(f'too few samples of N({self.mean}, {self.sd}) are within {self.lo}..{self.hi}')
+            x[out] = rng.normal(self.mean, self.sd, len(out))
+
+@dataclass
+class Inputs:
+    """The distribution of each uncertain simulator.Params field"""
+    power: Normal = Normal(sim.power, 10.0)
+    mass: Normal = Normal(sim.mass, 1.0)
+    frontalArea: Normal = Normal(sim.frontalArea, 0.03)
+    rollingCoeff: Normal = Normal(sim.rollingCoeff, 1.0e-3)
+    eta: Normal = Normal(sim.eta, 0.01, hi=1.0)
+
+    def sample(self: Inputs, rng: np.random.Generator, n: int, base: sim.Params=sim.Params()) -> List[sim.Params]:
+        """Return n Params, base with the uncertain fields sampled"""
+        power: np.ndarray = self.power.sample(rng, n)
+        mass: np.ndarray = self.mass.sample(rng, n)
+        frontalArea: np.ndarray = self.frontalArea.sample(rng, n)
+        rollingCoeff: np.ndarray = self.rollingCoeff.sample(rng, n)
+        eta: np.ndarray = self.eta.sample(rng, n)
+        return [sim.Params(mass=float(mass[i]), power=float(power[i]), frontalArea=float(frontalArea[i]),
+                           dragCoeff=base.dragCoeff, rho=base.rho, eta=float(eta[i]),
+                           rollingCoeff=float(rollingCoeff[i]), dt=base.dt) for i in range(n)]
+
+class P2Quantile:
+    """
+    Streaming estimate of the p quantile using the P-squared algorithm of
+    Jain and Chlamtac, five markers are kept rather than the samples.
+    """
+
+    def __init__(self: P2Quantile, p: float) -> None:
+        self.p: float = p
+        self.count: int = 0
+        self.__q: List[float] = []                          # Marker heights
+        self.__n: List[float] = [1.0, 2.0, 3.0, 4.0, 5.0]   # Marker positions
+        self.__np: List[float] = [1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0] # Desired positions
+        self.__dn: List[float] = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+
+    def add(self: P2Quantile, x: float) -> None:
+        q: List[float] = self.__q
+        n: List[float] = self.__n
+        self.count += 1
+        if self.count <= 5:
+            bisect.insort(q, x)
+            return
+
+        k: int
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        i: int
+        for i in range(k + 1, 5):
+            n[i] += 1.0
+        for i in range(5):
+            self.__np[i] += self.__dn[i]
+
+        for i in range(1, 4):
+            d: float = self.__np[i] - n[i]
+            if ((d >= 1.0) and (n[i + 1] - n[i] > 1.0)) or ((d <= -1.0) and (n[i - 1] - n[i] < -1.0)):
+                s: float = math.copysign(1.0, d)
+                qp: float = q[i] + s / (n[i + 1] - n[i - 1]) * \
+                    ((n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                     (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not (q[i - 1] < qp < q[i + 1]):
+                    # Parabolic prediction is out of order, use linear
+                    j: int = i + int(s)
+                    qp = q[i] + s * (q[j] - q[i]) / (n[j] - n[i])
+                q[i] = qp
+                n[i] += s
+
+    def extend(self: P2Quantile, xs: np.ndarray) -> None:
+        x: float
+        for x in xs.tolist():
+            self.add(x)
+
+    def value(self: P2Quantile) -> float:
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            return float(np.quantile(self.__q, self.p))
+        return self.__q[2]
+
+@dataclass
+class MonteCarloResult:
+    n: int = 0                  # Number of simulations
+    mean: float = 0.0           # Mean finish time in seconds
+    sd: float = 0.0             # Standard deviation of the finish time
+    quantiles: Dict[float, float] = field(default_factory=dict) # Quantile to finish time
+    history: List[Tuple[int, List[float]]] = field(default_factory=list) # After each batch, n and the quantiles
+    change: float = math.nan    # Largest relative change of a quantile in the second half of the run
+    converged: bool = False     # True if change is within the tolerance
+
+    def stderr(self: MonteCarloResult) -> float:
+        """Return the standard error of the mean"""
+        return self.sd / math.sqrt(self.n) if self.n > 0 else math.nan
+
+# The path of a worker process, set once so it isn't sent with each batch
+_path: Optional[p.Path] = None
+
+def _initWorker(path: p.Path) -> None:
+    global _path
+    _path = path
+
+def _batch(seed: np.random.SeedSequence, n: int, inputs: Inputs, base: sim.Params) -> np.ndarray:
+    """Run in a worker process, return the finish times of n sampled riders"""
+    assert _path is not None
+    prms: List[sim.Params] = inputs.sample(np.random.default_rng(seed), n, base)
+    return bsim.simulateBatch(_path, prms).t
+
+def monteCarlo(path: p.Path, inputs: Inputs=Inputs(), n: int=1000, seed: int=0, batch: int=250,
+               workers: int=1, base: sim.Params=sim.Params(), quantiles: List[float]=[0.05, 0.25, 0.5, 0.75, 0.95],
+               tolerance: float=0.002) -> MonteCarloResult:
+    """
+    Simulate n riders with Params sampled from inputs in batches of batch
+    riders across workers processes and return the finish time distribution.
+
+    Each batch has its own seed spawned from seed so the result only
+    depends on seed, n and batch, not on workers. The finish times are
+    streamed into the quantile estimators and then discarded. The run has
+    converged when no quantile changed by more than tolerance, relative,
+    between the batch half way through and the last batch.
+    """
+    sizes: List[int] = [min(batch, n - i) for i in range(0, n, batch)]
+    seeds: List[np.random.SeedSequence] = np.random.SeedSequence(seed).spawn(len(sizes))
+    estimators: List[P2Quantile] = [P2Quantile(q) for q in quantiles]
+    result: MonteCarloResult = MonteCarloResult()
+    m2: float = 0.0
+
+    times: Iterator[np.ndarray]
+    pool: Optional[ProcessPoolExecutor] = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(path,))
+        times = pool.map(_batch, seeds, sizes, [inputs] * len(sizes), [base] * len(sizes))
+    else:
+        _initWorker(path)
+        times = map(_batch, seeds, sizes, [inputs] * len(sizes), [base] * len(sizes))
+    try:
+        # Batches arrive in order so the estimates are the same for any number of workers
+        t: np.ndarray
+        for t in times:
+            est: P2Quantile
+            for est in estimators:
+                est.extend(t)
+            # Combine the batch mean and variance with the running ones
+            count: int = result.n + len(t)
+            delta: float = float(t.mean()) - result.mean
+            m2 += float(((t - t.mean()) ** 2).sum()) + delta * delta * result.n * len(t) / count
+            result.mean += delta * len(t) / count
+            result.n = count
+            result.history.append((result.n, [est.value() for est in estimators]))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    result.sd = math.sqrt(m2 / (result.n - 1)) if result.n > 1 else 0.0
+    result.quantiles = {est.p: est.value() for est in estimators}
+    if result.history:
+        half: List[float] = result.history[(len(result.history) - 1) // 2][1]
+        last: List[float] = result.history[-1][1]
+        result.change = max(abs(b - a) / b for a, b in zip(half, last))
+        result.converged = result.change <= tolerance
+    return result
+
+def printResult(result: MonteCarloResult) -> None:
+    print(f'n={result.n} mean={sim.hms(result.mean)} sd={result.sd:.1f}s stderr={result.stderr():.1f}s')
+    for q, t in result.quantiles.items():
+        print(f'  p{q * 100:<4g} {sim.hms(t)}')
+    print(f"  {'converged' if result.converged else 'NOT converged'}: largest quantile change in the second half {result.change * 100:.3f}%")
+
+if __name__ == '__main__':
+    import sys
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+        import os
+
+        parser = argparse.ArgumentParser(description='Finish time distribution for uncertain rider parameters.')
+        parser.add_argument('filename', type=str, help='.gpx, .tcx or .csv route')
+        parser.add_argument('-n', type=int, default=1000, help='number of simulations')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+        parser.add_argument('--batch', type=int, default=250, help='riders simulated together')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+        parser.add_argument('--power', type=float, default=sim.power, help='mean power in watts')
+        parser.add_argument('--power-sd', type=float, default=10.0, help='standard deviation of power in watts')
+        args = parser.parse_args()
+        if not (args.power > 0.0) or not (0.0 <= args.power_sd < math.inf):
+            parser.error('--power must be > 0 and --power-sd >= 0')
+
+        route: p.Path = p.Path(tf.readTrackList(args.filename))
+        start: float = time.perf_counter()
+        result: MonteCarloResult = monteCarlo(route, Inputs(power=Normal(args.power, args.power_sd)),
+                                              n=args.n, seed=args.seed, batch=args.batch, workers=args.workers)
+        printResult(result)
+        print(f'  took {time.perf_counter() - start:.2f}s')
+        sys.exit(0)
+
+    import unittest
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestMonteCarlo(unittest.TestCase):
+
+        def setUp(self: TestMonteCarlo):
+            self.path: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+
+        def test_p2_quantile(self: TestMonteCarlo):
+            xs: np.ndarray = np.random.default_rng(1).lognormal(0.0, 0.5, 20000)
+            q: float
+            for q in [0.05, 0.5, 0.95]:
+                est: P2Quantile = P2Quantile(q)
+                est.extend(xs)
+                self.assertAlmostEqual(est.value(), float(np.quantile(xs, q)), delta=0.02)
+            small: P2Quantile = P2Quantile(0.5)
+            self.assertTrue(math.isnan(small.value()))
+            small.extend(np.array([3.0, 1.0, 2.0]))
+            self.assertEqual(small.value(), 2.0)
+
+        def test_reproducible(self: TestMonteCarlo):
+            a: MonteCarloResult = monteCarlo(self.path, n=60, batch=25, seed=7)
+            b: MonteCarloResult = monteCarlo(self.path, n=60, batch=25, seed=7, workers=2)
+            c: MonteCarloResult = monteCarlo(self.path, n=60, batch=25, seed=8)
+            self.assertEqual(a.quantiles, b.quantiles)
+            self.assertEqual(a.mean, b.mean)
+            self.assertNotEqual(a.quantiles, c.quantiles)
+            self.assertEqual([n for n, _ in a.history], [25, 50, 60])
+            self.assertTrue(a.quantiles[0.05] < a.quantiles[0.5] < a.quantiles[0.95])
+
+        def test_truncated(self: TestMonteCarlo):
+            wide: Normal = Normal(100.0, 40.0)
+            self.assertEqual(wide.lo, 100.0 * min_fraction)
+            x: np.ndarray = wide.sample(np.random.default_rng(3), 10000)
+            self.assertTrue(np.all(x >= wide.lo))
+            self.assertTrue(np.all(Normal(sim.eta, 0.05, hi=1.0).sample(np.random.default_rng(3), 1000) <= 1.0))
+            self.assertRaises(ValueError, Normal, 100.0, 10.0, 0.0)
+            self.assertRaises(ValueError, Normal, 100.0, -1.0)
+            self.assertRaises(ValueError, Normal, 0.0, 10.0)
+            # Wide enough that the slowest riders are far slower but they all finish
+            result: MonteCarloResult = monteCarlo(self.path, Inputs(power=Normal(100.0, 40.0)), n=200, batch=100)
+            self.assertEqual(result.n, 200)
+            self.assertTrue(math.isfinite(result.quantiles[0.95]))
+
+        def test_certain_inputs(self: TestMonteCarlo):
+            fixed: Inputs = Inputs(*(Normal(mean, 0.0) for mean in (sim.power, sim.mass, sim.frontalArea, sim.rollingCoeff, sim.eta)))
+            result: MonteCarloResult = monteCarlo(self.path, fixed, n=20, batch=10)
+            t: float = sim.simulate(self.path).t
+            self.assertTrue(all(abs(v - t) < 1e-9 for v in result.quantiles.values()))
+            self.assertAlmostEqual(result.sd, 0.0)
+            self.assertTrue(result.converged)
+
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# Build a Path for a long route with its segment geometry computed in parallel
+#
+# The distance, slope and bearing of each segment only depend on its two
+# points so chunks of the route are computed in worker processes on arrays,
+# the distance with the haversine.py kernel and the bearing with the
+# expression of TrackPoint.brgRadians, along with the distance from the
+# start of the chunk to each of its points. The total distance at each point
+# is then that plus the total at the start of the chunk, one array add per
+# chunk, and the km index is a search of the totals. numpy's atan2 and the
+# order of the sums differ from Path's in the last bits so the values match
+# to about 1e-9 rather than exactly. Setting the fields of the TrackPoints
+# remains serial.
+from __future__ import annotations
+from typing import Optional, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import os
+import time
+import numpy as np
+import track_point as tp
+import path as p
+import haversine as hv
+import instrument
+
+# The dis, slp, brg and total distance arrays of a chunk or a route
+SegmentArrays = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+def _chunkSegments(lat: np.ndarray, lon: np.ndarray, ele: np.ndarray) -> SegmentArrays:
+    """
+    Run in a worker process, return the dis, slp and brg of the segments
+    between consecutive points and the distance from the first point to
+    each of the others.
+    """
+    dis: np.ndarray = hv.segmentDisArray(lat, lon)
+    slp: np.ndarray = np.arctan2(np.diff(ele), dis)
+    # TrackPoint.brgRadians' expression, it has cos(dLat) where hv.brgArray has cos(dLon)
+    cos_lat: np.ndarray = np.cos(lat)
+    sin_lat: np.ndarray = np.sin(lat)
+    y: np.ndarray = np.sin(np.diff(lon)) * cos_lat[1:]
+    x: np.ndarray = (cos_lat[:-1] * sin_lat[1:]) - (sin_lat[:-1] * cos_lat[1:] * np.cos(np.diff(lat)))
+    return dis, slp, np.arctan2(y, x), np.cumsum(dis)
+
+def chunkBounds(n: int, chunks: int) -> List[Tuple[int, int]]:
+    """Return [start, end) of chunks ranges of points, each range overlaps the next by one point"""
+    size: int = max((n - 1 + chunks - 1) // chunks, 1)
+    return [(s, min(s + size + 1, n)) for s in range(0, n - 1, size)]
+
+def segmentArrays(lat: np.ndarray, lon: np.ndarray, ele: np.ndarray,
+                  workers: Optional[int]=None, chunks: Optional[int]=None) -> SegmentArrays:
+    """
+    Return the dis, slp and brg of the segments and the total distance at
+    each point, computed in chunks by workers processes, default os.cpu_count()
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunks is None:
+        chunks = workers * 4
+    n: int = len(lat)
+    bounds: List[Tuple[int, int]] = chunkBounds(n, chunks)
+    args: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = [(lat[s:e], lon[s:e], ele[s:e]) for s, e in bounds]
+    results: List[SegmentArrays]
+    if workers <= 1:
+        results = [_chunkSegments(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_chunkSegments, *zip(*args)))
+    dis: np.ndarray = np.zeros(max(n - 1, 0))
+    slp: np.ndarray = np.zeros(max(n - 1, 0))
+    brg: np.ndarray = np.zeros(max(n - 1, 0))
+    tot: np.ndarray = np.zeros(n)
+    s: int
+    e: int
+    chunk: SegmentArrays
+    for (s, e), chunk in zip(bounds, results):
+        dis[s:e - 1], slp[s:e - 1], brg[s:e - 1] = chunk[:3]
+        # The chunk's distances are from its first point whose total is already known
+        tot[s + 1:e] = tot[s] + chunk[3]
+    return dis, slp, brg, tot
+
+def kmIndex(tot: np.ndarray) -> List[p.KmIdxDis]:
+    """Return the km index Path builds for points at the total distances tot"""
+    if len(tot) == 0:
+        return []
+    # First point at or after each km, tot never decreases
+    kms: np.ndarray = tot / 1000.0
+    km: np.ndarray = np.arange(int(kms[-1]) + 1, dtype=np.float64)
+    idx: np.ndarray = np.searchsorted(kms, km, side='left')
+    # A point exactly on the km starts it, otherwise the segment before it does
+    idx = np.where(tot[idx] == km * 1000.0, idx, idx - 1)
+    km_idx_dis: List[p.KmIdxDis] = [p.KmIdxDis(i, d) for i, d in zip(idx.tolist(), tot[idx].tolist())]
+    km_idx_dis.append(p.KmIdxDis(len(tot) - 1, float(tot[-1])))
+    return km_idx_dis
+
+def ParallelPath(tl: List[tp.TrackPoint], workers: Optional[int]=None, chunks: Optional[int]=None) -> p.Path:
+    """Return the same Path as p.Path(tl), to about 1e-9, with the segments computed in parallel"""
+    start: float = time.perf_counter() if instrument.enabled else 0.0
+    lat: np.ndarray = np.fromiter((pt.lat for pt in tl), dtype=np.float64, count=len(tl))
+    lon: np.ndarray = np.fromiter((pt.lon for pt in tl), dtype=np.float64, count=len(tl))
+    ele: np.ndarray = np.fromiter((pt.ele for pt in tl), dtype=np.float64, count=len(tl))
+    dis, slp, brg, tot = segmentArrays(lat, lon, ele, workers, chunks)
+    km_idx_dis: List[p.KmIdxDis] = kmIndex(tot)
+    if instrument.enabled:
+        instrument.add('path segments', time.perf_counter() - start)
+    return p.Path(tl, list(zip(dis.tolist(), slp.tolist(), brg.tolist())), tot.tolist(), km_idx_dis)
+
+if __name__ == '__main__':
+    import sys
+    import copy
+    import bench
+
+    if len(sys.argv) > 1:
+        # Time the serial build, the phases of the parallel one and the whole
+        # build for each number of workers, the copies aren't timed
+        n: int = int(sys.argv[1])
+        cpus: int = os.cpu_count() or 1
+        print(f'{n} points, {cpus} cpus')
+        if cpus < 2:
+            print('one cpu, more workers only add process overhead so there is no speedup to show')
+        tl: List[tp.TrackPoint] = bench.mkSyntheticTrackList(n)
+        copied: List[tp.TrackPoint] = copy.deepcopy(tl)
+        start: float = time.perf_counter()
+        p.Path(copied)
+        serial: float = time.perf_counter() - start
+        copied = copy.deepcopy(tl)
+        start = time.perf_counter()
+        lat: np.ndarray = np.fromiter((pt.lat for pt in copied), dtype=np.float64, count=n)
+        lon: np.ndarray = np.fromiter((pt.lon for pt in copied), dtype=np.float64, count=n)
+        ele: np.ndarray = np.fromiter((pt.ele for pt in copied), dtype=np.float64, count=n)
+        gather: float = time.perf_counter() - start
+        start = time.perf_counter()
+        dis, slp, brg, tot = segmentArrays(lat, lon, ele, 1)
+        kernel: float = time.perf_counter() - start
+        start = time.perf_counter()
+        km_idx_dis: List[p.KmIdxDis] = kmIndex(tot)
+        index: float = time.perf_counter() - start
+        start = time.perf_counter()
+        p.Path(copied, list(zip(dis.tolist(), slp.tolist(), brg.tolist())), tot.tolist(), km_idx_dis)
+        fields: float = time.perf_counter() - start
+        print(f"{'phase':<22} {'secs':>8}")
+        print(f"{'serial Path':<22} {serial:8.3f}")
+        print(f"{'gather coordinates':<22} {gather:8.3f}")
+        print(f"{'segments and offsets':<22} {kernel:8.3f}")
+        print(f"{'km index':<22} {index:8.3f}")
+        print(f"{'set point fields':<22} {fields:8.3f}")
+        print(f"{'workers':>7} {'secs':>8} {'speedup':>8}")
+        workers: int = 1
+        while workers <= max(cpus, 4):
+            copied = copy.deepcopy(tl)
+            start = time.perf_counter()
+            ParallelPath(copied, workers)
+            secs: float = time.perf_counter() - start
+            print(f'{workers:>7} {secs:8.3f} {serial / secs:8.2f}')
+            workers *= 2
+        sys.exit(0)
+
+    import unittest
+    import gpx_track_list as gpx_tl
+    import track_diff as td
+
+    class TestParallelPath(unittest.TestCase):
+
+        def test_chunkBounds(self: TestParallelPath):
+            self.assertEqual(chunkBounds(10, 3), [(0, 4), (3, 7), (6, 10)])
+            self.assertEqual(chunkBounds(2, 4), [(0, 2)])
+            self.assertEqual(chunkBounds(1, 4), [])
+            self.assertEqual(chunkBounds(0, 4), [])
+
+        def assertSamePath(self: TestParallelPath, parallel: p.Path, serial: p.Path):
+            """The fields match to rounding, the km index exactly"""
+            diff: td.TrackDiff = td.diffTrackLists(parallel.trackList(), serial.trackList(), default=td.Tolerance(atol=1e-9, rtol=1e-12))
+            self.assertTrue(diff.equal(), {f.name: f.max_abs for f in diff.fields.values()})
+            self.assertEqual([kid.idx for kid in parallel.km_idx_dis()], [kid.idx for kid in serial.km_idx_dis()])
+            self.assertTrue(np.allclose([kid.dis for kid in parallel.km_idx_dis()], [kid.dis for kid in serial.km_idx_dis()],
+                                        rtol=1e-12, atol=1e-9))
+
+        def test_matches_serial(self: TestParallelPath):
+            tl: List[tp.TrackPoint] = bench.mkSyntheticTrackList(5003)
+            serial: p.Path = p.Path(copy.deepcopy(tl))
+            workers: int
+            for workers, chunks in [(1, 7), (2, None), (3, 64)]:
+                self.assertSamePath(ParallelPath(copy.deepcopy(tl), workers, chunks), serial)
+
+        def test_real_route(self: TestParallelPath):
+            route: str = './data/RAAM_TS17.gpx'
+            serial: p.Path = p.Path(gpx_tl.GpxTrackList(route))
+            self.assertSamePath(ParallelPath(gpx_tl.GpxTrackList(route), 2), serial)
+            one: p.Path = ParallelPath(gpx_tl.GpxTrackList(route)[:1])
+            self.assertEqual(one.tot(), 0.0)
+            self.assertEqual(one.km_idx_dis(), p.Path(gpx_tl.GpxTrackList(route)[:1]).km_idx_dis())
+            self.assertEqual(ParallelPath([]).tot(), 0.0)
+
+        def test_km_index(self: TestParallelPath):
+            # A point exactly on a km starts it, a segment spanning kms starts each of them
+            tot: np.ndarray = np.array([0.0, 400.0, 1000.0, 1500.0, 3200.0, 3300.0])
+            self.assertEqual([(kid.idx, kid.dis) for kid in kmIndex(tot)],
+                             [(0, 0.0), (2, 1000.0), (3, 1500.0), (3, 1500.0), (5, 3300.0)])
+            self.assertEqual(kmIndex(np.zeros(0)), [])
+
+        def test_append_after(self: TestParallelPath):
+            tl: List[tp.TrackPoint] = bench.mkSyntheticTrackList(1000)
+            serial: p.Path = p.Path(copy.deepcopy(tl[:900]))
+            parallel: p.Path = ParallelPath(copy.deepcopy(tl[:900]), 1, 5)
+            pt: tp.TrackPoint
+            for pt in tl[900:]:
+                serial.append(copy.deepcopy(pt))
+                parallel.append(copy.deepcopy(pt))
+            self.assertSamePath(parallel, serial)
+
+        def test_wrong_segments(self: TestParallelPath):
+            self.assertRaises(ValueError, p.Path, bench.mkSyntheticTrackList(3), [(1.0, 0.0, 0.0)])
+
+    unittest.main()
@@ -2,90 +2,166 @@
 
 # bike power calculation
 from __future__ import annotations
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from dataclasses import dataclass
 
+import time
 import track_point as tp
-import gpx_track_list as gpx_tl
+import instrument
 
 @dataclass
 class KmIdxDis:
     idx: int
     dis: float
 
+# The dis, slp and brg from a point to the next
+Segment = Tuple[float, float, float]
+
 class Path:
     """Provide access to a path, a list of TrackPoints"""
 
-    def __init__(self: Path, tl: List[tp.TrackPoint]) -> None:
+    def __init__(self: Path, tl: List[tp.TrackPoint], segments: Optional[List[Segment]]=None,
+                 tots: Optional[List[float]]=None, km_idx_dis: Optional[List[KmIdxDis]]=None) -> None:
+        """
+        segments: The dis, slp and brg of each point to the next if already
+        computed, see parallel_path.py, otherwise they're computed here
+        tots, km_idx_dis: The total distance at each point and the km index
+        if also computed, otherwise they're accumulated from segments
+        """
+        start: float = time.perf_counter() if instrument.enabled else 0.0
+
         # List of TrackPoints in this route
         self.__track_list: List[tp.TrackPoint] = tl
 
         # List of KmIdxDis with the last entrying being
         # the total distance
         self.__km_idx_dis: List[KmIdxDis] = []
-        pt: tp.TrackPoint
-        i: int
+
+        # The next km to be added to the index
+        self.__km: float = 0
 
         # Build and index for each km
-        km: float = 0
-        if len(self.__track_list) > 1:
-            prev: tp.TrackPoint
-            for i, pt in enumerate(self.__track_list):
-                pt.idx = i
-                if i == 0:
-                    pt.tot = 0.0
-                    pt.dis = 0.0
-                    pt.slp = 0.0
-                    pt.brg = 0.0
-                else:
-                    distance: float = prev.disMeters(pt)
-                    if distance< 0.0:
-                        print(f'WARNING distance < 0.0 at point[{i:>3}]: prev={prev} pt={pt} is {distance:<6.3f}')
-                    pt.tot = prev.tot + distance
-                    #print(f'{i} distance={distance} pt.tot={pt.tot}')
-                    prev.dis = distance
-                    prev.slp = prev.slpRadians(pt)
-                    prev.brg = prev.brgRadians(pt)
-
-                # First point whose begining is >= km
-                kmx: float = pt.tot / 1000.0
-                if kmx >= km:
-                    if (kmx == km):
-                        self.__km_idx_dis.append(KmIdxDis(i, pt.tot))
-                    else:
-                        assert((i > 0) \
-                                and (prev.tot < (km * 1000)) \
-                                and (pt.tot > (km * 1000)))
-                        self.__km_idx_dis.append(KmIdxDis(i - 1, prev.tot))
-                    km += 1.0
-                #print(f'{filename} point[{i:>3}]: {pt} is {distance:>6.3f} from prev, total is {tot:>11.3f}', end='')
-                #print('')
-                prev = pt
-
-        last_index: int = len(self.__track_list) - 1
-        tot: float = self.__track_list[last_index].tot
-        self.__km_idx_dis.append(KmIdxDis(last_index, tot))
-        #print(f'tot={tot}')
+        i: int
+        if segments is None:
+            for i in range(len(self.__track_list)):
+                self.__add(i)
+        else:
+            if len(segments) != max(len(tl) - 1, 0):
+                raise ValueError(f'Expected {max(len(tl) - 1, 0)} segments for {len(tl)} points, got {len(segments)}')
+            if (tots is None) or (km_idx_dis is None):
+                for i in range(len(self.__track_list)):
+                    self.__add(i, segments[i - 1] if i > 0 else None)
+            else:
+                self.__set(segments, tots, km_idx_dis)
+
+        if instrument.enabled:
+            instrument.add('path build', time.perf_counter() - start)
+            instrument.count('path points', len(self.__track_list))
 
         #kid: KmIdxDis
         #for i, kid in enumerate(self.__km_idx_dis):
         #    print(f'km[{i}]: idx={kid.idx:>3} distance={kid.dis:>11.3f} pt: {self__track_list[kid.idx]}')
 
+    def __add(self: Path, i: int, segment: Optional[Segment]=None) -> None:
+        """
+        Add track_list[i], the last point, to the path
+
+        Sets dis, slp and brg of the previous point, from segment if it's
+        supplied, and extends the km index.
+        """
+        pt: tp.TrackPoint = self.__track_list[i]
+        pt.idx = i
+        if i == 0:
+            pt.tot = 0.0
+        else:
+            prev: tp.TrackPoint = self.__track_list[i - 1]
+            distance: float
+            if segment is None:
+                distance = prev.disMeters(pt)
+                prev.slp = prev.slpRadians(pt)
+                prev.brg = prev.brgRadians(pt)
+            else:
+                distance, prev.slp, prev.brg = segment
+            if distance< 0.0:
+                print(f'WARNING distance < 0.0 at point[{i:>3}]: prev={prev} pt={pt} is {distance:<6.3f}')
+            pt.tot = prev.tot + distance
+            prev.dis = distance
+        # The last point has no next point
+        pt.dis = 0.0
+        pt.slp = 0.0
+        pt.brg = 0.0
+
+        # Remove the total distance entry, it's replaced below
+        if len(self.__km_idx_dis) > int(self.__km):
+            self.__km_idx_dis.pop()
+
+        # First point whose begining is >= km, a long segment may span several kms
+        while (pt.tot / 1000.0) >= self.__km:
+            if pt.tot == (self.__km * 1000):
+                self.__km_idx_dis.append(KmIdxDis(i, pt.tot))
+            else:
+                assert((i > 0) \
+                        and (prev.tot < (self.__km * 1000)) \
+                        and (pt.tot > (self.__km * 1000)))
+                self.__km_idx_dis.append(KmIdxDis(i - 1, prev.tot))
+            self.__km += 1.0
+
+        self.__km_idx_dis.append(KmIdxDis(i, pt.tot))
+
+    def __set(self: Path, segments: List[Segment], tots: List[float], km_idx_dis: List[KmIdxDis]) -> None:
+        """Set every point and the km index from their already computed values"""
+        tl: List[tp.TrackPoint] = self.__track_list
+        if len(tots) != len(tl):
+            raise ValueError(f'Expected {len(tl)} total distances, got {len(tots)}')
+        i: int
+        pt: tp.TrackPoint
+        for i, pt in enumerate(tl):
+            pt.idx = i
+            pt.tot = tots[i]
+        segment: Segment
+        for pt, segment in zip(tl, segments):
+            pt.dis, pt.slp, pt.brg = segment
+        # The last point has no next point
+        if tl:
+            tl[-1].dis = 0.0
+            tl[-1].slp = 0.0
+            tl[-1].brg = 0.0
+        # An entry for each km and the total distance entry
+        self.__km_idx_dis = km_idx_dis
+        self.__km = float(max(len(km_idx_dis) - 1, 0))
+
+    def append(self: Path, pt: tp.TrackPoint) -> None:
+        """
+        Append pt to the end of the path, for points arriving during a ride
+
+        Only the previous point and the end of the km index are updated so
+        this is amortized O(1) and lookups remain valid between appends.
+        """
+        self.__track_list.append(pt)
+        self.__add(len(self.__track_list) - 1)
+
     def tot(self: Path) -> float:
         """Return the total distance of the route"""
-        return self.__km_idx_dis[len(self.__km_idx_dis) - 1].dis
+        return self.__km_idx_dis[len(self.__km_idx_dis) - 1].dis if self.__km_idx_dis else 0.0
 
     def getTrackPoint(self: Path, distance: float) -> Optional[tp.TrackPoint]:
         """Return the index into track of the point that includes the distance"""
         i: int = int(distance / 1000)
         if i >= 0 and i < len(self.__km_idx_dis):
             kid: KmIdxDis = self.__km_idx_dis[i]
+            tl: List[tp.TrackPoint] = self.__track_list
             pt: tp.TrackPoint
             j: int
-            for j, pt in enumerate(self.__track_list[kid.idx:], kid.idx):
+            for j in range(kid.idx, len(tl)):
+                pt = tl[j]
                 # Two adjacent points could be the same point so we use <= for both cases
                 if (pt.tot <= distance) and (distance <= (pt.tot + pt.dis)):
+                    if instrument.enabled:
+                        instrument.count('lookups')
+                        instrument.count('lookup scanned points', j - kid.idx + 1)
                     return pt;
+        if instrument.enabled:
+            instrument.count('lookups')
         return None
 
     def slpRadians(self: Path, distance: float) -> float:
@@ -107,10 +183,19 @@ class Path:
     def km_idx_dis(self: Path) -> List[KmIdxDis]:
         return self.__km_idx_dis
 
+    def kmDistances(self: Path) -> List[float]:
+        """Return the distance of the start of every km and of the end of the path from the km index"""
+        distances: List[float] = [k * 1000.0 for k in range(len(self.__km_idx_dis) - 1)]
+        if not distances or (self.tot() > distances[-1]):
+            distances.append(self.tot())
+        return distances
+
     def compare(self: Path, other: Path) -> bool:
         return tp.compareList(self.trackList(), other.trackList())
 
 if __name__ == '__main__':
+    import gpx_track_list as gpx_tl
+
     gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
 
     path: Path = Path(gpx_tl.GpxTrackList(gpx_test_file))
@@ -175,4 +260,30 @@ if __name__ == '__main__':
             pt = path.getTrackPoint(distance)
             self.assertTrue(pt is None)
 
+        def test_kmDistances(self: TestGpx):
+            path: Path = Path(gpx_tl.GpxTrackList(gpx_test_file))
+            self.assertEqual(path.kmDistances(), [0.0, 1000.0, path.tot()])
+            self.assertEqual(Path(gpx_tl.GpxTrackList(gpx_test_file)[:1]).kmDistances(), [0.0])
+
+        def test_append(self: TestGpx):
+            path: Path = Path(gpx_tl.GpxTrackList(gpx_test_file))
+            live: Path = Path([])
+            self.assertEqual(live.tot(), 0.0)
+            pt: tp.TrackPoint
+            for pt in gpx_tl.GpxTrackList(gpx_test_file):
+                live.append(pt)
+                # Lookups stay valid as points arrive
+                self.assertEqual(live.tot(), pt.tot)
+                found: Optional[tp.TrackPoint] = live.getTrackPoint(live.tot() / 2)
+                self.assertTrue(found is not None)
+            self.assertTrue(live.compare(path))
+            self.assertEqual(live.km_idx_dis(), path.km_idx_dis())
+
+        def test_append_long_segment(self: TestGpx):
+            # The second segment, 787m to 4122m, has an index entry for each km it spans
+            live: Path = Path([tp.TrackPoint(lat=45.0, lon=-122.0), tp.TrackPoint(lat=45.0, lon=-121.99)])
+            live.append(tp.TrackPoint(lat=45.03, lon=-121.99))
+            self.assertEqual([kid.idx for kid in live.km_idx_dis()], [0, 1, 1, 1, 1, 2])
+            self.assertEqual(live.getTrackPoint(2500).idx, 1)
+
     unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# Predict the time to finish a route from the current position
+from __future__ import annotations
+from typing import Optional, List, Dict, Callable
+from dataclasses import dataclass
+
+import bisect
+import math
+import time
+import path as p
+import simulator as sim
+
+@dataclass
+class Prediction:
+    t: float       # Seconds from now to reach the target distance
+    v: float       # Velocity in meters/sec at the target distance
+    steps: int     # Number of steps simulated
+    cached: bool   # True if the end of the prediction came from a cached reference
+
+class _Reference:
+    """A simulation of the whole route at one power, distance, time and velocity after each step"""
+
+    def __init__(self: _Reference, ds: List[float], ts: List[float], vs: List[float]) -> None:
+        self.ds: List[float] = ds
+        self.ts: List[float] = ts
+        self.vs: List[float] = vs
+
+    def __at(self: _Reference, values: List[float], d: float) -> float:
+        """Return values interpolated at distance d"""
+        k: int = bisect.bisect_left(self.ds, d)
+        if k == 0:
+            return values[0]
+        if k == len(self.ds):
+            return values[-1]
+        d0: float = self.ds[k - 1]
+        d1: float = self.ds[k]
+        return values[k - 1] + (values[k] - values[k - 1]) * (d - d0) / (d1 - d0)
+
+    def t(self: _Reference, d: float) -> float:
+        return self.__at(self.ts, d)
+
+    def v(self: _Reference, d: float) -> float:
+        return self.__at(self.vs, d)
+
+class Predictor:
+    """
+    Predict the time to ride from a distance and velocity on a path to a
+    later distance, e.g. the next time station or the end.
+
+    The slope dependent forces are computed once for each segment of the path
+    and the current segment is tracked with a cursor rather than looked up at
+    each step. The integration is the same as simulator.simulate so
+    predicting from a standing start at 0 gives the same time.
+
+    For powers with a cached reference, a simulation of the whole route, the
+    prediction only simulates until its velocity converges to the reference's
+    velocity at the same distance and then uses the reference's time for the
+    rest of the course.
+    """
+
+    def __init__(self: Predictor, path: p.Path, prm: sim.Params=sim.Params(), powers: List[float]=[], tolerance: float=1e-3) -> None:
+        """
+        prm: The parameters of the rider, prm.power is the default power
+        powers: Powers whose references are computed now rather than on first use
+        tolerance: Velocity difference in meters/sec at which a prediction joins the reference
+        """
+        self.path: p.Path = path
+        self.prm: sim.Params = prm
+        self.tolerance: float = tolerance
+        self.__refs: Dict[float, _Reference] = {}
+
+        # End of each segment, the distance of the next point
+        self.__hi: List[float] = [pt.tot + pt.dis for pt in path.trackList()]
+        # Rolling resistance and gravity of each segment
+        self.__rolling: List[float] = [sim.fRolling(prm, pt.slp, 1.0) for pt in path.trackList()]
+        self.__gravity: List[float] = [sim.fGravity(prm, pt.slp) for pt in path.trackList()]
+        # The forces past the end of the path where the slope is 0
+        self.__flat_rolling: float = sim.fRolling(prm, 0.0, 1.0)
+        self.__flat_gravity: float = sim.fGravity(prm, 0.0)
+        # Drag is kDrag * v * v
+        self.__k_drag: float = 0.5*prm.dragCoeff*prm.frontalArea*prm.rho
+
+        power: float
+        for power in powers:
+            self.reference(power)
+
+    def reference(self: Predictor, power: float) -> _Reference:
+        """Return the cached reference for power, computing it if needed"""
+        ref: Optional[_Reference] = self.__refs.get(power)
+        if ref is None:
+            ds: List[float] = []
+            ts: List[float] = []
+            vs: List[float] = []
+            def record(t: float, dt: float, d: float, v: float) -> None:
+                # Skip steps which don't move so distances are increasing
+                if not ds or d > ds[-1]:
+                    ds.append(d)
+                    ts.append(t + dt)
+                    vs.append(v)
+            self.__run(0.0, 0.0, power, self.path.tot(), None, record)
+            ref = _Reference(ds, ts, vs)
+            self.__refs[power] = ref
+        return ref
+
+    def powers(self: Predictor) -> List[float]:
+        """Return the powers with a cached reference"""
+        return list(self.__refs.keys())
+
+    def __run(self: Predictor, d: float, v: float, power: float, to: float,
+              ref: Optional[_Reference], record: Optional[Callable[[float, float, float, float], None]]=None) -> Prediction:
+        """Simulate from d at velocity v until to or until joining ref"""
+        prm: sim.Params = self.prm
+        hi: List[float] = self.__hi
+        rolling: List[float] = self.__rolling
+        gravity: List[float] = self.__gravity
+        k_drag: float = self.__k_drag
+        n: int = len(hi)
+        j: int = bisect.bisect_left(hi, d)
+        dt: float = prm.dt
+        pv: float = v
+        t: float = 0.0
+        steps: int = 0
+        while d < to:
+            while j < n and hi[j] < d:
+                j += 1
+            roll: float
+            grav: float
+            if j < n:
+                roll, grav = rolling[j], gravity[j]
+            else:
+                roll, grav = self.__flat_rolling, self.__flat_gravity
+            totalForce = k_drag*v*v + (roll if v > 0.01 else 0.0) + grav
+            powerNeeded = totalForce * v / prm.eta
+            netPower = power - powerNeeded
+
+            av = (v + pv) / 2.0
+            sd = av * dt
+            last: bool = (d + sd) > to
+            if last:
+                sd = to - d
+                dt = sd / av
+                d = to
+            else:
+                d += sd
+
+            pv = v
+            v = math.sqrt(v*v + 2 * netPower * dt * prm.eta / prm.mass)
+            steps += 1
+            if record is not None:
+                record(t, dt, d, v)
+            t += dt
+
+            if (ref is not None) and not last and (abs(v - ref.v(d)) <= self.tolerance):
+                return Prediction(t=t + ref.t(to) - ref.t(d), v=ref.v(to), steps=steps, cached=True)
+        return Prediction(t=t, v=v, steps=steps, cached=False)
+
+    def predict(self: Predictor, d: float, v: float, power: Optional[float]=None, to: Optional[float]=None) -> Prediction:
+        """
+        Return the prediction riding from distance d at velocity v to distance to, default the end
+
+        power: The power to ride at, default prm.power, its reference is used if it is cached
+        """
+        if power is None:
+            power = self.prm.power
+        if to is None:
+            to = self.path.tot()
+        return self.__run(max(d, 0.0), v, power, to, self.__refs.get(power))
+
+if __name__ == '__main__':
+    import gpx_track_list as gpx_tl
+
+    gpx_file = './data/RAAM_TS17.gpx'
+    route: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_file))
+    start: float = time.perf_counter()
+    predictor: Predictor = Predictor(route, powers=[sim.power])
+    print(f'{gpx_file}: tot={route.tot():.2f}m reference at {sim.power}W took {(time.perf_counter() - start) * 1e3:.1f}ms')
+    d: float
+    for d in [0.0, 10000.0, 40000.0, 70000.0]:
+        start = time.perf_counter()
+        full: Prediction = predictor.predict(d, 6.0, power=sim.power + 1e-9)
+        full_secs: float = time.perf_counter() - start
+        start = time.perf_counter()
+        fast: Prediction = predictor.predict(d, 6.0)
+        fast_secs: float = time.perf_counter() - start
+        print(f'from {d / 1000:5.1f}km at 6.0m/s: {sim.hms(fast.t)} in {fast_secs * 1e3:.2f}ms ({fast.steps} steps),'
+              f' without reference {sim.hms(full.t)} in {full_secs * 1e3:.1f}ms ({full.steps} steps)')
+
+    import unittest
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestPredictor(unittest.TestCase):
+
+        def test_standing_start_matches_simulate(self: TestPredictor):
+            path: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_test_file))
+            prm: sim.Params = sim.Params(power=200.0)
+            result: sim.SimResult = sim.simulate(path, prm)
+            prediction: Prediction = Predictor(path, prm).predict(0.0, 0.0)
+            self.assertEqual(prediction.t, result.t)
+            self.assertEqual(prediction.steps, result.steps)
+            self.assertFalse(prediction.cached)
+
+        def test_reference_matches_full(self: TestPredictor):
+            predictor: Predictor = Predictor(route, powers=[150.0])
+            self.assertEqual(predictor.powers(), [150.0])
+            d: float
+            v: float
+            for d, v in [(5000.0, 3.0), (33333.0, 9.0), (60000.0, 0.0)]:
+                fast: Prediction = predictor.predict(d, v, power=150.0)
+                full: Prediction = predictor.predict(d, v, power=150.0 + 1e-9)
+                self.assertTrue(fast.cached)
+                self.assertFalse(full.cached)
+                self.assertTrue(fast.steps < full.steps / 10)
+                self.assertAlmostEqual(fast.t, full.t, delta=0.5)
+
+        def test_time_station(self: TestPredictor):
+            predictor: Predictor = Predictor(route, powers=[sim.power])
+            to_station: Prediction = predictor.predict(20000.0, 6.0, to=50000.0)
+            to_end: Prediction = predictor.predict(20000.0, 6.0)
+            self.assertTrue(0.0 < to_station.t < to_end.t)
+            self.assertEqual(predictor.predict(route.tot(), 6.0).t, 0.0)
+
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Disk backed cache of simulation results
+from __future__ import annotations
+from typing import Optional, List, Tuple
+from dataclasses import dataclass, fields
+from weakref import WeakKeyDictionary
+
+import hashlib
+import os
+import sqlite3
+import struct
+import time
+import numpy as np
+import path as p
+import simulator as sim
+
+# Modules whose code determines a simulation's result
+physics_modules: List[str] = ['simulator.py', 'path.py', 'track_point.py']
+
+def physicsVersion() -> str:
+    """Return a hash of the source of the physics_modules, results of other versions are stale"""
+    h = hashlib.sha256()
+    name: str
+    for name in physics_modules:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+# Path to its number of points and digest
+_digests: WeakKeyDictionary = WeakKeyDictionary()
+
+def routeDigest(path: p.Path) -> str:
+    """Return a hash of the lat, lon and ele of path's points, cached until points are appended"""
+    tl = path.trackList()
+    entry: Optional[Tuple[int, str]] = _digests.get(path)
+    if (entry is None) or (entry[0] != len(tl)):
+        arrays: np.ndarray = np.array([(pt.lat, pt.lon, pt.ele) for pt in tl], dtype='<f8')
+        entry = (len(tl), hashlib.sha256(arrays.tobytes()).hexdigest())
+        _digests[path] = entry
+    return entry[1]
+
+def paramsBytes(prm: sim.Params) -> bytes:
+    """Return every field of prm in a canonical form"""
+    return struct.pack(f'<{len(fields(prm))}d', *(float(getattr(prm, f.name)) for f in fields(prm)))
+
+@dataclass
+class CachedRun:
+    result: sim.SimResult
+    trace: Optional[np.ndarray] # [i] = t, d, v after every trace_every steps and the last, None if not requested
+
+class ResultCache:
+    """
+    Simulation results in an sqlite database keyed by the route, the Params
+    and the trace decimation.
+
+    The database is in WAL mode so processes can read while one writes and
+    writers wait for each other. The physics version is part of the key so
+    processes of different versions can share a cache, each only sees its
+    own entries. When the entries are larger than max_bytes those of other
+    versions are evicted first, then the least recently used.
+    """
+
+    def __init__(self: ResultCache, filename: str, max_bytes: int=256 * 1024 * 1024, version: Optional[str]=None) -> None:
+        self.filename: str = filename
+        self.max_bytes: int = max_bytes
+        self.version: str = version if version is not None else physicsVersion()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.__db: sqlite3.Connection = sqlite3.connect(filename, timeout=60.0, isolation_level=None)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        with self.__transaction():
+            self.__db.execute('''CREATE TABLE IF NOT EXISTS runs (
+                key BLOB PRIMARY KEY, version TEXT, used REAL, size INTEGER,
+                t REAL, d REAL, v REAL, grade REAL, sd REAL, steps INTEGER, splits BLOB, trace BLOB)''')
+            self.__db.execute('CREATE INDEX IF NOT EXISTS runs_used ON runs (used)')
+
+    def close(self: ResultCache) -> None:
+        self.__db.close()
+
+    def __enter__(self: ResultCache) -> ResultCache:
+        return self
+
+    def __exit__(self: ResultCache, *args) -> None:
+        self.close()
+
+    def __transaction(self: ResultCache) -> _Transaction:
+        return _Transaction(self.__db)
+
+    def __len__(self: ResultCache) -> int:
+        return self.__db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def bytes(self: ResultCache) -> int:
+        return self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM runs').fetchone()[0]
+
+    def key(self: ResultCache, path: p.Path, prm: sim.Params, trace_every: int=0) -> bytes:
+        h = hashlib.sha256()
+        h.update(self.version.encode())
+        h.update(routeDigest(path).encode())
+        h.update(paramsBytes(prm))
+        h.update(struct.pack('<q', trace_every))
+        return h.digest()
+
+    def get(self: ResultCache, path: p.Path, prm: sim.Params, trace_every: int=0) -> Optional[CachedRun]:
+        key: bytes = self.key(path, prm, trace_every)
+        row = self.__db.execute('SELECT t, d, v, grade, sd, steps, splits, trace FROM runs WHERE key = ? AND version = ?',
+                                (key, self.version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__db.execute('UPDATE runs SET used = ? WHERE key = ?', (time.time(), key))
+        t, d, v, grade, sd, steps, splits, trace = row
+        result: sim.SimResult = sim.SimResult(t=t, d=d, v=v, grade=grade, sd=sd, steps=steps,
+                                              splits=np.frombuffer(splits, dtype='<f8').tolist())
+        return CachedRun(result=result, trace=np.frombuffer(trace, dtype='<f8').reshape(-1, 3) if trace is not None else None)
+
+    def put(self: ResultCache, path: p.Path, prm: sim.Params, run: CachedRun, trace_every: int=0) -> None:
+        key: bytes = self.key(path, prm, trace_every)
+        r: sim.SimResult = run.result
+        splits: bytes = np.asarray(r.splits, dtype='<f8').tobytes()
+        trace: Optional[bytes] = np.asarray(run.trace, dtype='<f8').tobytes() if run.trace is not None else None
+        size: int = len(key) + len(splits) + (len(trace) if trace is not None else 0) + 100
+        with self.__transaction():
+            self.__db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (key, self.version, time.time(), size, r.t, r.d, r.v, r.grade, r.sd, r.steps, splits, trace))
+            self.__evict()
+
+    def __evict(self: ResultCache) -> None:
+        """
+        Remove entries of other versions and then the least recently used
+        until the total size is within max_bytes
+        """
+        total: int = self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM runs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.__db.execute('SELECT key, size FROM runs ORDER BY version = ?, used', (self.version,)).fetchall()
+        # Always keep the newest entry even if it alone is over the limit
+        for key, size in rows[:-1]:
+            self.__db.execute('DELETE FROM runs WHERE key = ?', (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def simulate(self: ResultCache, path: p.Path, prm: sim.Params=sim.Params(), trace_every: int=0) -> CachedRun:
+        """Return the cached run of path with prm, simulating and caching it if it isn't cached"""
+        run: Optional[CachedRun] = self.get(path, prm, trace_every)
+        if run is None:
+            run = simulateRun(path, prm, trace_every)
+            self.put(path, prm, run, trace_every)
+        return run
+
+class _Transaction:
+    """Take the write lock up front so concurrent writers queue rather than deadlock upgrading"""
+
+    def __init__(self: _Transaction, db: sqlite3.Connection) -> None:
+        self.db: sqlite3.Connection = db
+
+    def __enter__(self: _Transaction) -> None:
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self: _Transaction, kind, value, traceback) -> None:
+        self.db.execute('COMMIT' if kind is None else 'ROLLBACK')
+
+def simulateRun(path: p.Path, prm: sim.Params, trace_every: int=0) -> CachedRun:
+    """Simulate path keeping t, d, v every trace_every steps and at the end, no trace if 0"""
+    if trace_every <= 0:
+        return CachedRun(result=sim.simulate(path, prm), trace=None)
+    trace: List[Tuple[float, float, float]] = [(0.0, 0.0, 0.0)]
+    steps: List[int] = [0]
+    def step(t: float, dt: float, d: float, v: float, grade: float, sd: float) -> None:
+        steps[0] += 1
+        if steps[0] % trace_every == 0:
+            trace.append((t + dt, d, v))
+    result: sim.SimResult = sim.simulate(path, prm, step=step)
+    if result.steps % trace_every != 0:
+        trace.append((result.t, result.d, result.v))
+    return CachedRun(result=result, trace=np.array(trace))
+
+if __name__ == '__main__':
+    import tempfile
+    import track_file as tf
+    from concurrent.futures import ProcessPoolExecutor
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    def _put(filename: str, power: float) -> float:
+        with ResultCache(filename) as cache:
+            return cache.simulate(p.Path(tf.readTrackList(gpx_test_file)), sim.Params(power=power)).result.t
+
+    import unittest
+
+    class TestResultCache(unittest.TestCase):
+
+        def setUp(self: TestResultCache):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.filename: str = os.path.join(self.tmp.name, 'results.db')
+            self.path: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+
+        def tearDown(self: TestResultCache):
+            self.tmp.cleanup()
+
+        def test_hit_and_miss(self: TestResultCache):
+            with ResultCache(self.filename) as cache:
+                prm: sim.Params = sim.Params(power=180.0)
+                first: CachedRun = cache.simulate(self.path, prm)
+                second: CachedRun = cache.simulate(self.path, prm)
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+                self.assertEqual(first.result, second.result)
+                self.assertEqual(second.result, sim.simulate(self.path, prm))
+                # Any parameter, the route or the trace makes a new entry
+                cache.simulate(self.path, sim.Params(power=180.0, rho=1.1))
+                cache.simulate(p.Path(tf.readTrackList(gpx_test_file)[:10]), prm)
+                traced: CachedRun = cache.simulate(self.path, prm, trace_every=100)
+                self.assertEqual(cache.misses, 4)
+                self.assertEqual(len(cache), 4)
+            with ResultCache(self.filename) as cache:
+                again: CachedRun = cache.simulate(self.path, prm, trace_every=100)
+                self.assertEqual(cache.hits, 1)
+                self.assertTrue(np.array_equal(again.trace, traced.trace))
+                self.assertEqual(len(again.trace), again.result.steps // 100 + 2)
+                self.assertEqual(tuple(again.trace[-1]), (again.result.t, again.result.d, again.result.v))
+
+        def test_versions_share(self: TestResultCache):
+            with ResultCache(self.filename, version='a') as cache:
+                a: CachedRun = cache.simulate(self.path)
+            with ResultCache(self.filename, version='b') as cache:
+                # Another version's entry is a miss but isn't removed
+                self.assertTrue(cache.get(self.path, sim.Params()) is None)
+                self.assertEqual(len(cache), 1)
+                cache.simulate(self.path)
+                self.assertEqual(len(cache), 2)
+            with ResultCache(self.filename, version='a') as cache:
+                again: Optional[CachedRun] = cache.get(self.path, sim.Params())
+                self.assertTrue(again is not None and again.result == a.result)
+                # Over the limit the other version's entry goes first even though it's the most recently used
+                cache.max_bytes = cache.bytes() + 10
+                cache.simulate(self.path, sim.Params(power=100.0))
+                self.assertEqual(cache.evictions, 1)
+                self.assertTrue(cache.get(self.path, sim.Params()) is not None)
+            with ResultCache(self.filename, version='b') as cache:
+                self.assertTrue(cache.get(self.path, sim.Params()) is None)
+
+        def test_lru_eviction(self: TestResultCache):
+            with ResultCache(self.filename, max_bytes=1000) as cache:
+                cache.simulate(self.path, sim.Params(power=100.0))
+                cache.simulate(self.path, sim.Params(power=110.0))
+                size: int = cache.bytes()
+                cache.max_bytes = size + 10
+                # Use the first so the second is the least recently used
+                cache.get(self.path, sim.Params(power=100.0))
+                cache.simulate(self.path, sim.Params(power=120.0))
+                self.assertEqual(cache.evictions, 1)
+                self.assertTrue(cache.bytes() <= cache.max_bytes)
+                self.assertTrue(cache.get(self.path, sim.Params(power=110.0)) is None)
+                self.assertTrue(cache.get(self.path, sim.Params(power=100.0)) is not None)
+
+        def test_concurrent_writers(self: TestResultCache):
+            ResultCache(self.filename).close()
+            powers: List[float] = [100.0 + 10.0 * i for i in range(8)]
+            with ProcessPoolExecutor(max_workers=4) as ex:
+                times: List[float] = list(ex.map(_put, [self.filename] * len(powers), powers))
+            with ResultCache(self.filename) as cache:
+                self.assertEqual(len(cache), len(powers))
+                self.assertEqual([cache.get(self.path, sim.Params(power=w)).result.t for w in powers], times)
+
+    unittest.main()
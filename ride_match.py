@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# Align a recorded ride to the route it followed
+from __future__ import annotations
+from typing import Optional, List
+from dataclasses import dataclass
+
+import math
+import numpy as np
+import track_point as tp
+import path as p
+import route_index as ri
+import simulator as sim
+
+@dataclass
+class KmSplit:
+    km: int          # Index of the km in the route's km index
+    dis: float       # Length of this split in meters, the last one is usually short
+    actual: float    # Seconds to ride this split in the recording, nan if not ridden
+    simulated: float # Seconds to ride this split in the simulation
+
+def matchRide(route: p.Path, ride: List[tp.TrackPoint], index: Optional[ri.RouteIndex]=None,
+              max_xte: float=100.0, tolerance: float=50.0) -> np.ndarray:
+    """
+    Return an array with the distance along route of each point of ride.
+
+    Progress is monotonic, each point is matched using the previous distance as
+    the hint and is never allowed to move backwards. Points further than max_xte
+    meters from the route are nan. Each lookup is O(1) on average in the
+    RouteIndex so the alignment of the whole ride is O(n).
+    """
+    if index is None:
+        index = ri.RouteIndex(route)
+    along: np.ndarray = np.full(len(ride), np.nan)
+    prev: float = 0.0
+    i: int
+    pt: tp.TrackPoint
+    for i, pt in enumerate(ride):
+        lat, lon, _, _ = pt.decDegrees()
+        m: Optional[ri.RouteMatch] = index.nearest(lat, lon, hint=prev, tolerance=tolerance, max_xte=max_xte)
+        if m is None:
+            continue
+        prev = max(prev, m.tot)
+        along[i] = prev
+    return along
+
+def kmBoundaries(route: p.Path) -> np.ndarray:
+    """Return the distance of the start of every km and the end of the route from the km index"""
+    return np.array(route.kmDistances())
+
+def crossingTimes(along: np.ndarray, tim: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+    """
+    Return the time at which the monotonic along first reaches each boundary,
+    interpolated between samples, nan for boundaries outside of along.
+    """
+    ok: np.ndarray = ~np.isnan(along)
+    along = along[ok]
+    tim = tim[ok]
+    result: np.ndarray = np.full(len(boundaries), np.nan)
+    if len(along) == 0:
+        return result
+    j: np.ndarray = np.searchsorted(along, boundaries, side='left')
+    inside: np.ndarray = (j < len(along)) & (boundaries >= along[0])
+    j = np.clip(j, 1, len(along) - 1)
+    d0: np.ndarray = along[j - 1]
+    d1: np.ndarray = along[j]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac: np.ndarray = np.where(d1 > d0, (boundaries - d0) / (d1 - d0), 1.0)
+    t: np.ndarray = tim[j - 1] + (np.clip(frac, 0.0, 1.0) * (tim[j] - tim[j - 1]))
+    # A boundary at exactly the first sample has no previous sample
+    t = np.where(boundaries == along[0], tim[0], t)
+    result[inside] = t[inside]
+    return result
+
+def kmSplits(route: p.Path, ride: List[tp.TrackPoint], prm: sim.Params=sim.Params(),
+             along: Optional[np.ndarray]=None) -> List[KmSplit]:
+    """Return the actual and simulated time for each km of route"""
+    if along is None:
+        along = matchRide(route, ride)
+    boundaries: np.ndarray = kmBoundaries(route)
+    actual: np.ndarray = np.diff(crossingTimes(along, np.array([pt.tim for pt in ride]), boundaries))
+    simulated: np.ndarray = np.diff(sim.simulate(route, prm).splits)
+    dis: np.ndarray = np.diff(boundaries)
+    return [KmSplit(km=k, dis=float(dis[k]), actual=float(actual[k]), simulated=float(simulated[k])) for k in range(len(dis))]
+
+def printSplits(splits: List[KmSplit]) -> None:
+    print(f'{"km":>4} {"dis":>7} {"actual":>9} {"simulated":>9} {"diff":>8}')
+    s: KmSplit
+    for s in splits:
+        print(f'{s.km:>4} {s.dis:>7.1f} {s.actual:>9.1f} {s.simulated:>9.1f} {s.actual - s.simulated:>+8.1f}')
+    actual: float = sum(s.actual for s in splits if not math.isnan(s.actual))
+    simulated: float = sum(s.simulated for s in splits if not math.isnan(s.actual))
+    print(f'{"":>4} {"":>7} {sim.hms(actual):>9} {sim.hms(simulated):>9}')
+
+if __name__ == '__main__':
+    import argparse
+    import copy
+    import sys
+    import time
+    import gpx_track_list as gpx_tl
+    import tcx_track_list as tcx_tl
+
+    test_route = './data/RAAM_TS21_first_half_35_9mi_virtual_ride.gpx'
+    test_ride = './test/data/RAAM_TS21_ride_snippet.tcx'
+    test_route_snippet = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Compare a ride with the route it followed.")
+        parser.add_argument('route', type=str, help='route .gpx file')
+        parser.add_argument('ride', type=str, help='ride .tcx file')
+        parser.add_argument('--power', type=float, help='simulated power, default is the average ride power')
+        args = parser.parse_args()
+
+        route: p.Path = p.Path(gpx_tl.GpxTrackList(args.route))
+        ride: List[tp.TrackPoint] = tcx_tl.TcxTrackList(args.ride)
+        power: float = args.power if args.power is not None else \
+                       (sum(pt.wts for pt in ride) / len(ride) if ride else sim.power)
+        start: float = time.perf_counter()
+        along: np.ndarray = matchRide(route, ride)
+        print(f'matched {len(ride)} points in {(time.perf_counter() - start) * 1e3:.1f}ms, power={power:.1f}W')
+        printSplits(kmSplits(route, ride, sim.Params(power=power), along=along))
+        sys.exit(0)
+
+    import unittest
+
+    class TestRideMatch(unittest.TestCase):
+
+        def test_matchRide_monotonic(self: TestRideMatch):
+            route: p.Path = p.Path(gpx_tl.GpxTrackList(test_route))
+            ride: List[tp.TrackPoint] = tcx_tl.TcxTrackList(test_ride)
+            along: np.ndarray = matchRide(route, ride)
+            self.assertFalse(np.isnan(along).any())
+            self.assertTrue(np.all(np.diff(along) >= 0.0))
+            # The ride is the start of the route so it is matched to the route's points
+            self.assertTrue(along[0] < 1.0)
+            self.assertTrue(abs(along[-1] - route.trackList()[len(ride) - 1].tot) < 1.0)
+
+        def test_matchRide_off_route_is_nan(self: TestRideMatch):
+            route: p.Path = p.Path(gpx_tl.GpxTrackList(test_route))
+            ride: List[tp.TrackPoint] = [tp.TrackPoint(lat=0.0, lon=0.0)]
+            self.assertTrue(np.isnan(matchRide(route, ride)[0]))
+
+        def test_crossingTimes(self: TestRideMatch):
+            along: np.ndarray = np.array([0.0, 500.0, 500.0, 1500.0, np.nan, 2500.0])
+            tim: np.ndarray = np.array([0.0, 100.0, 200.0, 400.0, 500.0, 600.0])
+            t: np.ndarray = crossingTimes(along, tim, np.array([0.0, 500.0, 1000.0, 2000.0, 3000.0]))
+            self.assertEqual(list(t[:4]), [0.0, 100.0, 300.0, 500.0])
+            self.assertTrue(np.isnan(t[4]))
+
+        def test_kmSplits(self: TestRideMatch):
+            # A ride along the route at a constant 5 m/s takes 200s per km
+            route: p.Path = p.Path(gpx_tl.GpxTrackList(test_route_snippet))
+            ride: List[tp.TrackPoint] = [copy.copy(pt) for pt in route.trackList()]
+            pt: tp.TrackPoint
+            for pt in ride:
+                pt.tim = 1000.0 + (pt.tot / 5.0)
+            splits: List[KmSplit] = kmSplits(route, ride)
+            self.assertEqual(len(splits), len(kmBoundaries(route)) - 1)
+            self.assertAlmostEqual(sum(s.dis for s in splits), route.tot())
+            s: KmSplit
+            for s in splits:
+                self.assertAlmostEqual(s.actual, s.dis / 5.0, places=3)
+                self.assertTrue(s.simulated > 0.0)
+
+    unittest.main()
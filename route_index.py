@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# Spatial index over the segments of a Path
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple
+from dataclasses import dataclass
+
+import math
+import track_point as tp
+import path as p
+
+@dataclass
+class RouteMatch:
+    idx: int   # Index of the TrackPoint at the beginning of the nearest segment
+    tot: float # Distance in meters along the route of the projected position
+    xte: float # Cross track error, distance in meters from the position to the route
+
+class RouteIndex:
+    """
+    A uniform grid over the segments of a Path in a local equirectangular
+    projection centered on the route. Each segment is added to every cell
+    its bounding box touches, a query searches rings of cells around the
+    position until no unvisited cell can contain a closer segment.
+    """
+
+    def __init__(self: RouteIndex, path: p.Path, cell: float=250.0) -> None:
+        """
+        path: The route to index
+        cell: Size of a grid cell in meters
+        """
+        tl: List[tp.TrackPoint] = path.trackList()
+        self.__cell: float = cell
+        self.__lat: List[float] = [pt.lat for pt in tl]
+        self.__lon: List[float] = [pt.lon for pt in tl]
+        self.__tot: List[float] = [pt.tot for pt in tl]
+        self.__dis: List[float] = [pt.dis for pt in tl]
+        self.__grid: Dict[Tuple[int, int], List[int]] = {}
+
+        if len(tl) == 0:
+            self.__lat0: float = 0.0
+            self.__lon0: float = 0.0
+            self.__cos0: float = 1.0
+            self.__scale_lo: float = 1.0
+            return
+
+        lat_min: float = min(self.__lat)
+        lat_max: float = max(self.__lat)
+        self.__lat0 = (lat_min + lat_max) / 2.0
+        self.__lon0 = self.__lon[0]
+        self.__cos0 = math.cos(self.__lat0)
+
+        # The projection stretches east-west distances by cos(lat0) / cos(lat),
+        # scale_lo is the smallest ratio of true to projected distance and is
+        # used to keep the search termination bound conservative.
+        cos_min: float = min(math.cos(lat_min), math.cos(lat_max))
+        self.__scale_lo = min(1.0, cos_min / self.__cos0)
+
+        i: int
+        xs: List[float] = []
+        ys: List[float] = []
+        for i in range(len(tl)):
+            x, y = self.__project(self.__lat[i], self.__lon[i])
+            xs.append(x)
+            ys.append(y)
+        for i in range(len(tl) - 1):
+            cx0: int = math.floor(min(xs[i], xs[i + 1]) / cell)
+            cx1: int = math.floor(max(xs[i], xs[i + 1]) / cell)
+            cy0: int = math.floor(min(ys[i], ys[i + 1]) / cell)
+            cy1: int = math.floor(max(ys[i], ys[i + 1]) / cell)
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.__grid.setdefault((cx, cy), []).append(i)
+
+    def __project(self: RouteIndex, lat: float, lon: float) -> Tuple[float, float]:
+        """Return x, y in meters of lat, lon in radians"""
+        return (tp.earthR1 * (lon - self.__lon0) * self.__cos0, tp.earthR1 * (lat - self.__lat0))
+
+    def __match(self: RouteIndex, i: int, lat: float, lon: float, cos_lat: float) -> RouteMatch:
+        """Return the projection of lat, lon in radians onto segment i"""
+        # Local frame centered on the position so distortion is negligible
+        ax: float = tp.earthR1 * (self.__lon[i] - lon) * cos_lat
+        ay: float = tp.earthR1 * (self.__lat[i] - lat)
+        bx: float = tp.earthR1 * (self.__lon[i + 1] - lon) * cos_lat
+        by: float = tp.earthR1 * (self.__lat[i + 1] - lat)
+        dx: float = bx - ax
+        dy: float = by - ay
+        len2: float = (dx * dx) + (dy * dy)
+        t: float = 0.0
+        if len2 > 0.0:
+            t = min(1.0, max(0.0, -((ax * dx) + (ay * dy)) / len2))
+        cx: float = ax + (t * dx)
+        cy: float = ay + (t * dy)
+        return RouteMatch(i, self.__tot[i] + (t * self.__dis[i]), math.sqrt((cx * cx) + (cy * cy)))
+
+    def match(self: RouteIndex, i: int, lat: float, lon: float) -> RouteMatch:
+        """Return the projection of lat, lon in SignedDecDeg onto segment i"""
+        lat = math.radians(lat)
+        return self.__match(i, lat, math.radians(lon), math.cos(lat))
+
+    def segments(self: RouteIndex) -> int:
+        """Return the number of indexed segments"""
+        return max(0, len(self.__lat) - 1)
+
+    def nearest(self: RouteIndex, lat: float, lon: float, hint: Optional[float]=None,
+                tolerance: float=50.0, max_xte: float=1000.0) -> Optional[RouteMatch]:
+        """
+        Return the RouteMatch of the segment nearest lat, lon or None if there is
+        no segment within max_xte meters.
+
+        lat: Latitude in SignedDecDeg
+        lon: Longitude in SignedDecDeg
+        hint: Expected distance along the route, on self-overlapping routes the
+              candidate closest to hint is preferred over the nearest one
+        tolerance: Only candidates whose xte is within tolerance meters of the
+              nearest candidate are considered when a hint is supplied
+        max_xte: Maximum cross track error in meters
+        """
+        if self.segments() == 0:
+            return None
+        lat = math.radians(lat)
+        lon = math.radians(lon)
+        cos_lat: float = math.cos(lat)
+        x, y = self.__project(lat, lon)
+        qx: int = math.floor(x / self.__cell)
+        qy: int = math.floor(y / self.__cell)
+        slack: float = tolerance if hint is not None else 0.0
+
+        best: Optional[RouteMatch] = None
+        candidates: List[RouteMatch] = []
+        seen: set = set()
+        r: int = 0
+        max_r: int = math.ceil((max_xte + slack) / (self.__cell * self.__scale_lo)) + 1
+        while r <= max_r:
+            # Segments in cells outside ring r-1 are at least (r - 1) cells away
+            if (best is not None) and ((r - 1) * self.__cell * self.__scale_lo > best.xte + slack):
+                break
+            cells: List[Tuple[int, int]]
+            if r == 0:
+                cells = [(qx, qy)]
+            else:
+                cells = [(qx + dx, qy + r) for dx in range(-r, r + 1)] + \
+                        [(qx + dx, qy - r) for dx in range(-r, r + 1)] + \
+                        [(qx + r, qy + dy) for dy in range(-r + 1, r)] + \
+                        [(qx - r, qy + dy) for dy in range(-r + 1, r)]
+            for cell in cells:
+                for i in self.__grid.get(cell, ()):
+                    if i in seen:
+                        continue
+                    seen.add(i)
+                    m: RouteMatch = self.__match(i, lat, lon, cos_lat)
+                    if m.xte > max_xte:
+                        continue
+                    candidates.append(m)
+                    if (best is None) or (m.xte < best.xte):
+                        best = m
+            r += 1
+
+        if (best is None) or (hint is None):
+            return best
+
+        # Adjacent segments of one pass share endpoints, so reduce the candidates
+        # to the nearest segment of each run of consecutive segments. Then prefer
+        # the pass closest to hint among those nearly as close as best.
+        candidates.sort(key=lambda m: m.idx)
+        passes: List[RouteMatch] = []
+        prev_idx: int = -2
+        for m in candidates:
+            if passes and (m.idx - prev_idx) == 1:
+                if m.xte < passes[-1].xte:
+                    passes[-1] = m
+            else:
+                passes.append(m)
+            prev_idx = m.idx
+        limit: float = best.xte + tolerance
+        result: RouteMatch = best
+        for m in passes:
+            if (m.xte <= limit) and (abs(m.tot - hint) < abs(result.tot - hint)):
+                result = m
+        return result
+
+def nearestLinear(ri: RouteIndex, lat: float, lon: float) -> Optional[RouteMatch]:
+    """Return the RouteMatch of the nearest segment by scanning every segment, for testing"""
+    best: Optional[RouteMatch] = None
+    i: int
+    for i in range(ri.segments()):
+        m: RouteMatch = ri.match(i, lat, lon)
+        if (best is None) or (m.xte < best.xte):
+            best = m
+    return best
+
+if __name__ == '__main__':
+    import random
+    import time
+    import gpx_track_list as gpx_tl
+
+    route_file = './data/RAAM_TS17.gpx'
+    path: p.Path = p.Path(gpx_tl.GpxTrackList(route_file))
+    start: float = time.perf_counter()
+    ri: RouteIndex = RouteIndex(path)
+    print(f'{route_file}: {ri.segments()} segments indexed in {(time.perf_counter() - start) * 1e3:.1f}ms')
+
+    rnd: random.Random = random.Random(1)
+    queries: List[Tuple[float, float]] = []
+    for _ in range(10_000):
+        pt: tp.TrackPoint = path.trackList()[rnd.randrange(len(path.trackList()))]
+        lat, lon, _, _ = pt.decDegrees()
+        queries.append((lat + rnd.uniform(-0.0005, 0.0005), lon + rnd.uniform(-0.0005, 0.0005)))
+    start = time.perf_counter()
+    for lat, lon in queries:
+        ri.nearest(lat, lon)
+    print(f'nearest: {(time.perf_counter() - start) / len(queries) * 1e6:.1f}us/query')
+
+    import unittest
+
+    def mkOutAndBack(km: float, step: float=100.0) -> p.Path:
+        """A route north for km and back on the same road"""
+        tl: List[tp.TrackPoint] = [tp.TrackPoint(lat=37.0, lon=-104.0)]
+        brg: float
+        for brg in (0.0, 180.0):
+            for _ in range(int(km * 1000.0 / step)):
+                lat, lon, _, _ = tl[-1].decDegrees()
+                tl.append(tp.TrackPoint(lat=lat, lon=lon, brg=brg, dis=step))
+        return p.Path(tl)
+
+    class TestRouteIndex(unittest.TestCase):
+
+        def test_on_track_points(self: TestRouteIndex):
+            pt: tp.TrackPoint
+            for pt in path.trackList()[:-1:50]:
+                lat, lon, _, _ = pt.decDegrees()
+                m: Optional[RouteMatch] = ri.nearest(lat, lon)
+                self.assertTrue(m is not None)
+                if m is not None:
+                    self.assertTrue(m.xte < 0.01)
+                    self.assertTrue(abs(m.tot - pt.tot) < 0.01)
+
+        def test_matches_linear_scan(self: TestRouteIndex):
+            for lat, lon in queries[:200]:
+                m: Optional[RouteMatch] = ri.nearest(lat, lon)
+                l: Optional[RouteMatch] = nearestLinear(ri, lat, lon)
+                self.assertTrue((m is not None) and (l is not None))
+                if (m is not None) and (l is not None):
+                    self.assertAlmostEqual(m.xte, l.xte, places=6)
+
+        def test_cross_track_error(self: TestRouteIndex):
+            oab: p.Path = mkOutAndBack(1.0)
+            lat, lon, _, _ = tp.TrackPoint(lat=37.0, lon=-104.0, brg=0.0, dis=250.0).decDegrees()
+            pt: tp.TrackPoint = tp.TrackPoint(lat=lat, lon=lon, brg=90.0, dis=20.0)
+            lat, lon, _, _ = pt.decDegrees()
+            m: Optional[RouteMatch] = RouteIndex(oab).nearest(lat, lon)
+            self.assertTrue(m is not None)
+            if m is not None:
+                self.assertAlmostEqual(m.xte, 20.0, places=1)
+
+        def test_out_and_back_hint(self: TestRouteIndex):
+            oab: p.Path = mkOutAndBack(2.0)
+            oab_ri: RouteIndex = RouteIndex(oab)
+            lat, lon, _, _ = tp.TrackPoint(lat=37.0, lon=-104.0, brg=0.0, dis=550.0).decDegrees()
+            out: Optional[RouteMatch] = oab_ri.nearest(lat, lon, hint=500.0)
+            back: Optional[RouteMatch] = oab_ri.nearest(lat, lon, hint=3400.0)
+            self.assertTrue((out is not None) and (back is not None))
+            if (out is not None) and (back is not None):
+                self.assertAlmostEqual(out.tot, 550.0, delta=1.0)
+                self.assertAlmostEqual(back.tot, 4000.0 - 550.0, delta=1.0)
+
+        def test_too_far(self: TestRouteIndex):
+            self.assertTrue(ri.nearest(0.0, 0.0) is None)
+
+    unittest.main()
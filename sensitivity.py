@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Sensitivity of the finish time to each rider and environment parameter
+#
+# Each parameter is raised and lowered by a fraction h of its value and the
+# derivative is the central difference of the finish times. All the riders,
+# the base and two for each parameter, are simulated together in one
+# batch.simulateBatch. The step at which a rider crosses a segment boundary moves
+# with the parameters so the finish time is slightly rough, with h much
+# below 1% the differences are dominated by that rather than the slope.
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple
+from dataclasses import dataclass, replace
+from concurrent.futures import ProcessPoolExecutor
+
+import time
+import path as p
+import simulator as sim
+import batch as bsim
+
+# Parameter name to the simulator.Params field perturbed, CdA scales with frontalArea
+parameters: Dict[str, str] = {
+    'power': 'power',
+    'mass': 'mass',
+    'CdA': 'frontalArea',
+    'Crr': 'rollingCoeff',
+    'rho': 'rho',
+    'eta': 'eta',
+}
+
+@dataclass
+class Sensitivity:
+    name: str
+    value: float       # The base value of the parameter
+    derivative: float  # d(finish time) / d(parameter) in seconds per unit
+    percent: float     # Change of the finish time in seconds when the parameter rises 1%
+
+@dataclass
+class RouteSensitivity:
+    filename: str
+    t: float                   # Finish time with the base Params
+    sensitivities: List[Sensitivity]
+    steps: int                 # Steps of the batch
+    secs: float                # Time taken
+
+    def ranked(self: RouteSensitivity) -> List[Sensitivity]:
+        """Return the sensitivities largest effect first"""
+        return sorted(self.sensitivities, key=lambda s: abs(s.percent), reverse=True)
+
+def value(prm: sim.Params, name: str) -> float:
+    """Return parameter name of prm"""
+    if name == 'CdA':
+        return prm.dragCoeff * prm.frontalArea
+    return getattr(prm, parameters[name])
+
+def perturbed(base: sim.Params, h: float, names: List[str]) -> List[sim.Params]:
+    """Return base then base with each of names raised and lowered by the fraction h"""
+    prms: List[sim.Params] = [base]
+    name: str
+    for name in names:
+        field: str = parameters[name]
+        x: float = getattr(base, field)
+        prms.append(replace(base, **{field: x * (1.0 + h)}))
+        prms.append(replace(base, **{field: x * (1.0 - h)}))
+    return prms
+
+def sensitivities(path: p.Path, base: sim.Params=sim.Params(), h: float=0.01,
+                  names: Optional[List[str]]=None) -> Tuple[float, List[Sensitivity], int]:
+    """
+    Return the finish time of base, the sensitivity of the finish time to
+    each of names, default all the parameters, and the steps simulated.
+    """
+    if names is None:
+        names = list(parameters.keys())
+    result: bsim.BatchResult = bsim.simulateBatch(path, perturbed(base, h, names))
+    t: List[float] = result.t.tolist()
+    out: List[Sensitivity] = []
+    i: int
+    name: str
+    for i, name in enumerate(names):
+        x: float = value(base, name)
+        # Finish time change per relative change of the parameter
+        relative: float = (t[1 + 2 * i] - t[2 + 2 * i]) / (2.0 * h)
+        out.append(Sensitivity(name=name, value=x, derivative=relative / x, percent=relative / 100.0))
+    return t[0], out, result.steps
+
+def routeSensitivity(filename: str, base: sim.Params=sim.Params(), h: float=0.01,
+                     names: Optional[List[str]]=None) -> RouteSensitivity:
+    """Read the route in filename and return its sensitivities, run in a worker process"""
+    import track_file as tf
+    start: float = time.perf_counter()
+    path: p.Path = p.Path(tf.readTrackList(filename))
+    t, sens, steps = sensitivities(path, base, h, names)
+    return RouteSensitivity(filename=filename, t=t, sensitivities=sens, steps=steps, secs=time.perf_counter() - start)
+
+def routeSensitivities(filenames: List[str], base: sim.Params=sim.Params(), h: float=0.01,
+                       names: Optional[List[str]]=None, workers: int=1) -> List[RouteSensitivity]:
+    """Return the sensitivities of each route in filenames, the routes are spread across workers processes"""
+    n: int = len(filenames)
+    if workers <= 1:
+        return list(map(routeSensitivity, filenames, [base] * n, [h] * n, [names] * n))
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(routeSensitivity, filenames, [base] * n, [h] * n, [names] * n))
+
+def printRouteSensitivity(rs: RouteSensitivity) -> None:
+    print(f'{rs.filename}: t={sim.hms(rs.t)} steps={rs.steps} took {rs.secs:.2f}s')
+    print(f"  {'rank':>4} {'parameter':<9} {'value':>10} {'dt/dp':>14} {'+1%':>10}")
+    rank: int
+    s: Sensitivity
+    for rank, s in enumerate(rs.ranked(), 1):
+        print(f'  {rank:>4} {s.name:<9} {s.value:>10.4g} {s.derivative:>12.5g}s {s.percent:>+9.2f}s')
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1:
+        import argparse
+        import os
+
+        parser = argparse.ArgumentParser(description='Rank the parameters by their effect on the finish time of each route.')
+        parser.add_argument('filenames', type=str, nargs='+', help='.gpx, .tcx or .csv routes')
+        parser.add_argument('--h', type=float, default=0.01, help='fraction each parameter is raised and lowered by')
+        parser.add_argument('--power', type=float, default=sim.power, help='power in watts')
+        parser.add_argument('--dt', type=float, default=sim.dt, help='time step in seconds')
+        parser.add_argument('--parameters', type=str, default=None,
+                            help=f"comma separated parameters, default {','.join(parameters)}")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+        args = parser.parse_args()
+
+        names: Optional[List[str]] = args.parameters.split(',') if args.parameters else None
+        if names is not None:
+            unknown: List[str] = [name for name in names if name not in parameters]
+            if unknown:
+                parser.error(f"unknown parameters {','.join(unknown)}")
+        start: float = time.perf_counter()
+        rs: RouteSensitivity
+        for rs in routeSensitivities(args.filenames, sim.Params(power=args.power, dt=args.dt), args.h, names,
+                                     min(args.workers or 1, len(args.filenames))):
+            printRouteSensitivity(rs)
+        print(f'took {time.perf_counter() - start:.2f}s')
+        sys.exit(0)
+
+    import unittest
+    import track_file as tf
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestSensitivity(unittest.TestCase):
+
+        def setUp(self: TestSensitivity):
+            self.path: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+
+        def test_matches_separate_runs(self: TestSensitivity):
+            base: sim.Params = sim.Params()
+            t, sens, _ = sensitivities(self.path, base, 0.02)
+            self.assertAlmostEqual(t, sim.simulate(self.path, base).t, delta=1e-9)
+            self.assertEqual([s.name for s in sens], list(parameters.keys()))
+            s: Sensitivity
+            for s in sens:
+                field: str = parameters[s.name]
+                x: float = getattr(base, field)
+                up: float = sim.simulate(self.path, replace(base, **{field: x * 1.02})).t
+                down: float = sim.simulate(self.path, replace(base, **{field: x * 0.98})).t
+                self.assertAlmostEqual(s.percent, (up - down) / 4.0, delta=1e-9)
+                self.assertAlmostEqual(s.derivative * s.value / 100.0, s.percent, delta=1e-9)
+            self.assertAlmostEqual(sens[2].value, base.dragCoeff * base.frontalArea)
+
+        def test_signs_and_rank(self: TestSensitivity):
+            t, sens, _ = sensitivities(self.path)
+            by_name: Dict[str, Sensitivity] = {s.name: s for s in sens}
+            self.assertTrue(by_name['power'].derivative < 0.0)
+            self.assertTrue(by_name['eta'].derivative < 0.0)
+            self.assertTrue(all(by_name[name].derivative > 0.0 for name in ['mass', 'CdA', 'Crr', 'rho']))
+            # Power and eta only appear as their product, as do CdA and rho
+            self.assertAlmostEqual(by_name['power'].percent, by_name['eta'].percent, delta=1e-6)
+            self.assertAlmostEqual(by_name['CdA'].percent, by_name['rho'].percent, delta=1e-6)
+            # A watt less costs about the time of the power's percent / 1% of the power
+            less: float = sim.simulate(self.path, sim.Params(power=sim.power - 1.0)).t
+            self.assertAlmostEqual(less - t, -by_name['power'].derivative, delta=0.05 * (less - t))
+            rs: RouteSensitivity = RouteSensitivity(gpx_test_file, t, sens, 0, 0.0)
+            ranked: List[float] = [abs(s.percent) for s in rs.ranked()]
+            self.assertEqual(ranked, sorted(ranked, reverse=True))
+
+        def test_routes(self: TestSensitivity):
+            serial: List[RouteSensitivity] = routeSensitivities([gpx_test_file] * 2, names=['power', 'Crr'])
+            parallel: List[RouteSensitivity] = routeSensitivities([gpx_test_file] * 2, names=['power', 'Crr'], workers=2)
+            self.assertEqual([[s.name for s in rs.sensitivities] for rs in serial], [['power', 'Crr']] * 2)
+            self.assertEqual([rs.sensitivities for rs in serial], [rs.sensitivities for rs in parallel])
+            self.assertEqual([rs.t for rs in serial], [rs.t for rs in parallel])
+
+    unittest.main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+
+# Long running simulation service with an in-memory Path cache
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple, Any
+from dataclasses import dataclass, field, fields
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import path as p
+import simulator as sim
+
+# Measured size of a TrackPoint in a Path, used to estimate the memory of a cached Path
+bytes_per_point: int = 400
+
+CacheKey = Tuple[str, str] # filename, sha256 of its contents
+
+class PathCache:
+    """A least recently used cache of Paths bounded by their estimated memory"""
+
+    def __init__(self: PathCache, max_bytes: int) -> None:
+        self.max_bytes: int = max_bytes
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.__entries: OrderedDict[CacheKey, Tuple[p.Path, int]] = OrderedDict()
+
+    def __len__(self: PathCache) -> int:
+        return len(self.__entries)
+
+    def get(self: PathCache, key: CacheKey) -> Optional[p.Path]:
+        entry: Optional[Tuple[p.Path, int]] = self.__entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def put(self: PathCache, key: CacheKey, path: p.Path) -> None:
+        size: int = len(path.trackList()) * bytes_per_point
+        if key in self.__entries:
+            self.bytes -= self.__entries.pop(key)[1]
+        self.__entries[key] = (path, size)
+        self.bytes += size
+        # Always keep the newest entry even if it alone is over the limit
+        while (self.bytes > self.max_bytes) and (len(self.__entries) > 1):
+            _, (_, evicted) = self.__entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+# The cache of a worker process, each worker has its own
+_cache: Optional[PathCache] = None
+
+def _initWorker(max_bytes: int) -> None:
+    global _cache
+    _cache = PathCache(max_bytes)
+
+def _simulate(key: CacheKey, prm: sim.Params) -> Tuple[Dict[str, Any], bool]:
+    """Run in a worker process, return the result and True if the Path was cached"""
+    import track_file as tf
+    assert _cache is not None
+    path: Optional[p.Path] = _cache.get(key)
+    hit: bool = path is not None
+    if path is None:
+        path = p.Path(tf.readTrackList(key[0]))
+        _cache.put(key, path)
+    r: sim.SimResult = sim.simulate(path, prm)
+    return {'t': r.t, 'd': r.d, 'v': r.v, 'steps': r.steps, 'hms': sim.hms(r.t)}, hit
+
+@dataclass
+class Metrics:
+    requests: int = 0
+    errors: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=1024))
+
+    def toJson(self: Metrics) -> Dict[str, Any]:
+        lat: List[float] = sorted(self.latencies)
+        def pct(q: float) -> float:
+            return lat[min(len(lat) - 1, int(q * len(lat)))] * 1e3 if lat else 0.0
+        lookups: int = self.cache_hits + self.cache_misses
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            'latency_ms': {'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99), 'max': pct(1.0), 'samples': len(lat)},
+        }
+
+class HttpError(Exception):
+    def __init__(self: HttpError, status: int, reason: str, message: str) -> None:
+        super().__init__(message)
+        self.status: int = status
+        self.reason: str = reason
+
+# The range of each sim.Params field a request may give. Outside them a
+# simulation divides by 0, fails or takes hours, e.g. power=1e-9 never
+# gets going and dt=1e-9 takes a billion steps for a second.
+param_bounds: Dict[str, Tuple[float, float]] = {
+    'mass': (20.0, 500.0),
+    'power': (10.0, 3000.0),
+    'frontalArea': (0.05, 5.0),
+    'dragCoeff': (0.05, 3.0),
+    'rho': (0.1, 2.0),
+    'eta': (0.5, 1.0),
+    'rollingCoeff': (0.0, 0.1),
+    'dt': (0.01, 1.0),
+}
+
+def paramsError(prm: sim.Params) -> Optional[str]:
+    """Return why prm can't be simulated, None if it can"""
+    f: Any
+    for f in fields(prm):
+        value: float = getattr(prm, f.name)
+        lo, hi = param_bounds[f.name]
+        if not (lo <= value <= hi):
+            return f'{f.name}={value} must be within {lo:g}..{hi:g}'
+    return None
+
+def _stop(ex: ProcessPoolExecutor) -> None:
+    """Shut ex down without waiting and terminate its worker, ProcessPoolExecutor can't before Python 3.14"""
+    processes: List[Any] = list(getattr(ex, '_processes', {}).values())
+    ex.shutdown(wait=False, cancel_futures=True)
+    for proc in processes:
+        proc.terminate()
+
+class SimServer:
+    """
+    Answer simulation requests over http on localhost or a unix socket.
+
+      GET /simulate?route=FILE&power=W[&mass=kg&dt=s...] any sim.Params field may be given
+      GET /metrics
+
+    Simulations run in worker processes so the event loop stays responsive.
+    Each worker has its own PathCache and requests are routed to a worker by
+    the content hash of the route so repeated routes hit the same cache. A
+    simulation taking longer than timeout seconds is answered with a 504 and
+    its worker is replaced so the routes of that worker aren't stuck behind it.
+    """
+
+    def __init__(self: SimServer, root: str='.', workers: int=2, cache_bytes: int=256 * 1024 * 1024,
+                 timeout: float=60.0) -> None:
+        """
+        root: Routes must be files within this directory
+        workers: Number of worker processes
+        cache_bytes: Memory for cached Paths shared equally by the workers
+        timeout: Seconds a simulation may take
+        """
+        self.root: str = os.path.realpath(root)
+        self.timeout: float = timeout
+        self.metrics: Metrics = Metrics()
+        self.__worker_bytes: int = cache_bytes // workers
+        self.__executors: List[ProcessPoolExecutor] = [self.__executor() for _ in range(workers)]
+        # (filename, mtime_ns, size) -> sha256 so unchanged files are hashed once
+        self.__digests: Dict[Tuple[str, int, int], str] = {}
+
+    def __executor(self: SimServer) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=1, initializer=_initWorker, initargs=(self.__worker_bytes,))
+
+    def close(self: SimServer) -> None:
+        ex: ProcessPoolExecutor
+        for ex in self.__executors:
+            ex.shutdown()
+
+    def __digest(self: SimServer, filename: str) -> str:
+        st: os.stat_result = os.stat(filename)
+        key: Tuple[str, int, int] = (filename, st.st_mtime_ns, st.st_size)
+        digest: Optional[str] = self.__digests.get(key)
+        if digest is None:
+            with open(filename, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            self.__digests[key] = digest
+        return digest
+
+    async def simulate(self: SimServer, query: Dict[str, str]) -> Dict[str, Any]:
+        route: Optional[str] = query.pop('route', None)
+        if route is None:
+            raise HttpError(400, 'Bad Request', 'route is required')
+        filename: str = os.path.realpath(os.path.join(self.root, route))
+        if (os.path.commonpath([self.root, filename]) != self.root) or not os.path.isfile(filename):
+            raise HttpError(404, 'Not Found', f'route {route} not found')
+
+        names: List[str] = [f.name for f in fields(sim.Params)]
+        prm: sim.Params = sim.Params()
+        name: str
+        for name, value in query.items():
+            if name not in names:
+                raise HttpError(400, 'Bad Request', f'unknown parameter {name}')
+            try:
+                setattr(prm, name, float(value))
+            except ValueError:
+                raise HttpError(400, 'Bad Request', f'{name}={value} is not a number')
+        error: Optional[str] = paramsError(prm)
+        if error is not None:
+            raise HttpError(400, 'Bad Request', error)
+
+        loop = asyncio.get_running_loop()
+        digest: str = await loop.run_in_executor(None, self.__digest, filename)
+        i: int = int(digest[:8], 16) % len(self.__executors)
+        ex: ProcessPoolExecutor = self.__executors[i]
+        try:
+            result, hit = await asyncio.wait_for(loop.run_in_executor(ex, _simulate, (filename, digest), prm), self.timeout)
+        except asyncio.TimeoutError:
+            if self.__executors[i] is ex:
+                self.__executors[i] = self.__executor()
+                _stop(ex)
+            raise HttpError(504, 'Gateway Timeout', f'simulation took longer than {self.timeout:g}s')
+        if hit:
+            self.metrics.cache_hits += 1
+        else:
+            self.metrics.cache_misses += 1
+        result['route'] = route
+        result['cache_hit'] = hit
+        return result
+
+    async def __respond(self: SimServer, target: str) -> Dict[str, Any]:
+        url = urlsplit(target)
+        query: Dict[str, str] = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/simulate':
+            return await self.simulate(query)
+        elif url.path == '/metrics':
+            return self.metrics.toJson()
+        raise HttpError(404, 'Not Found', f'{url.path} not found')
+
+    async def handle(self: SimServer, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handle http/1.1 requests on one connection"""
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass # Headers are not used
+
+                start: float = time.perf_counter()
+                self.metrics.requests += 1
+                status: int = 200
+                reason: str = 'OK'
+                body: Dict[str, Any]
+                try:
+                    parts: List[str] = request_line.decode('latin-1').split()
+                    if len(parts) != 3:
+                        raise HttpError(400, 'Bad Request', 'malformed request line')
+                    if parts[0] != 'GET':
+                        raise HttpError(405, 'Method Not Allowed', f'{parts[0]} not allowed')
+                    body = await self.__respond(parts[1])
+                except HttpError as err:
+                    self.metrics.errors += 1
+                    status, reason, body = err.status, err.reason, {'error': str(err)}
+                except Exception as err:
+                    self.metrics.errors += 1
+                    status, reason, body = 500, 'Internal Server Error', {'error': str(err)}
+                self.metrics.latencies.append(time.perf_counter() - start)
+
+                data: bytes = json.dumps(body).encode()
+                writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'.encode() + \
+                             f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self: SimServer, host: str='127.0.0.1', port: int=8642, unix: Optional[str]=None) -> asyncio.AbstractServer:
+        if unix is not None:
+            return await asyncio.start_unix_server(self.handle, path=unix)
+        return await asyncio.start_server(self.handle, host=host, port=port)
+
+def serve(root: str='.', host: str='127.0.0.1', port: int=8642, unix: Optional[str]=None,
+          workers: int=2, cache_bytes: int=256 * 1024 * 1024, timeout: float=60.0) -> None:
+    """Run a SimServer until interrupted"""
+    async def run() -> None:
+        server: SimServer = SimServer(root=root, workers=workers, cache_bytes=cache_bytes, timeout=timeout)
+        try:
+            s: asyncio.AbstractServer = await server.start(host=host, port=port, unix=unix)
+            print(f'serving on {unix if unix is not None else f"http://{host}:{port}"}')
+            async with s:
+                await s.serve_forever()
+        finally:
+            server.close()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    import unittest
+    import gpx_track_list as gpx_tl
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    async def get(port: int, target: str) -> Tuple[int, Dict[str, Any]]:
+        """Return the status and json body of GET target"""
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        await writer.drain()
+        status: int = int((await reader.readline()).split()[1])
+        length: int = 0
+        while True:
+            line: bytes = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        body: Dict[str, Any] = json.loads(await reader.readexactly(length))
+        writer.close()
+        return status, body
+
+    class TestSimServer(unittest.TestCase):
+
+        def test_PathCache_lru(self: TestSimServer):
+            path: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_test_file))
+            size: int = len(path.trackList()) * bytes_per_point
+            cache: PathCache = PathCache(max_bytes=2 * size)
+            cache.put(('a', '1'), path)
+            cache.put(('b', '2'), path)
+            self.assertTrue(cache.get(('a', '1')) is path)
+            cache.put(('c', '3'), path)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.evictions, 1)
+            self.assertTrue(cache.get(('b', '2')) is None)
+            self.assertTrue(cache.get(('a', '1')) is path)
+            self.assertEqual(cache.bytes, 2 * size)
+
+        def test_simulate_requests(self: TestSimServer):
+            expected: sim.SimResult = sim.simulate(p.Path(gpx_tl.GpxTrackList(gpx_test_file)), sim.Params(power=200.0))
+
+            async def run() -> None:
+                server: SimServer = SimServer(root='.', workers=1)
+                try:
+                    s: asyncio.AbstractServer = await server.start(port=0)
+                    port: int = s.sockets[0].getsockname()[1]
+                    async with s:
+                        status, body = await get(port, f'/simulate?route={gpx_test_file}&power=200')
+                        self.assertEqual(status, 200)
+                        self.assertEqual(body['t'], expected.t)
+                        self.assertFalse(body['cache_hit'])
+
+                        status, body = await get(port, f'/simulate?route={gpx_test_file}&power=200')
+                        self.assertTrue(body['cache_hit'])
+
+                        status, body = await get(port, f'/simulate?route={gpx_test_file}&watts=200')
+                        self.assertEqual(status, 400)
+                        status, body = await get(port, '/simulate?route=../../etc/passwd')
+                        self.assertEqual(status, 404)
+                        # Values which would hang a worker or return nonsense are refused before dispatching
+                        for bad in ['power=0', 'power=-10', 'power=nan', 'power=1e-9', 'dt=0', 'dt=1e-9', 'mass=inf', 'mass=1e6',
+                                    'eta=1.5', 'rollingCoeff=-0.001']:
+                            status, body = await get(port, f'/simulate?route={gpx_test_file}&{bad}')
+                            self.assertEqual(status, 400)
+                        status, body = await get(port, f'/simulate?route={gpx_test_file}&rollingCoeff=0&eta=1')
+                        self.assertEqual(status, 200)
+
+                        status, body = await get(port, '/metrics')
+                        self.assertEqual(body['requests'], 16)
+                        self.assertEqual(body['cache_hits'], 2)
+                        self.assertEqual(body['cache_misses'], 1)
+                        self.assertEqual(body['errors'], 12)
+                finally:
+                    server.close()
+
+            asyncio.run(run())
+
+        def test_timeout(self: TestSimServer):
+            async def run() -> None:
+                server: SimServer = SimServer(root='.', workers=1, timeout=0.05)
+                try:
+                    s: asyncio.AbstractServer = await server.start(port=0)
+                    port: int = s.sockets[0].getsockname()[1]
+                    async with s:
+                        # Within the bounds but about 10^5 steps
+                        status, body = await get(port, f'/simulate?route={gpx_test_file}&power=10&dt=0.01')
+                        self.assertEqual(status, 504)
+                        # The stuck worker was replaced
+                        server.timeout = 60.0
+                        status, body = await get(port, f'/simulate?route={gpx_test_file}')
+                        self.assertEqual(status, 200)
+                finally:
+                    server.close()
+
+            asyncio.run(run())
+
+    unittest.main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+# bike power calculation
+from __future__ import annotations
+from typing import Optional, List, Dict, Callable
+from dataclasses import dataclass, field
+
+import math
+import time
+import path as p
+import track_point as tp
+import instrument
+
+# Some constants
+bike = 8.62 # kg 19 lbs
+rider = 81.65 # kg 180 lbs
+mass = bike + rider
+
+# I adjusted the frontalArea until max speed calculated here was 17.00mph
+# I estimated the frontalArea from a flat section of a [ride](https://veloviewer.com/athletes/2039/activities/2802129759)
+# I did between time 00:15:47 - 00:17:32. Then in the "Power (meter)" graph for that section I produced
+# an avgerage Power of 142W at an average speed of 17.00mph.  I then twiddled the the frontalArea variable
+# until max speed calculated was 17.00mph.
+#
+# [Here](https://www.triradar.com/training-advice/how-to-calculate-your-drag/) is another method for
+# estimating the forntalArea using photoshop. When I do that I iwll then adjust the dragCoeff variable
+# until the speed is again calculated to be 17.00mph.
+power = 142 # Watts
+frontalArea = 0.449 # Sq meters
+dragCoeff = 0.88
+
+# A few plausible factors from http://www.cyclingpowerlab.com/CyclingAerodynamics.aspx
+rho = 1.2
+eta = 0.97 # 1 - drive train loss = efficiency
+rollingCoeff = 5.0e-3 # from haskell code
+
+#grade = 0.0/100.0 #0.0
+g = 9.81
+
+dt = 0.1 # time step
+
+@dataclass
+class Params:
+    """The parameters of a simulation, defaults are the constants above"""
+    mass: float = mass
+    power: float = power
+    frontalArea: float = frontalArea
+    dragCoeff: float = dragCoeff
+    rho: float = rho
+    eta: float = eta
+    rollingCoeff: float = rollingCoeff
+    dt: float = dt
+
+@dataclass
+class SimResult:
+    """The state at the end of a simulation"""
+    t: float     # Time in seconds
+    d: float     # Distance in meters
+    v: float     # Velocity in meters/sec
+    grade: float # Grade of the last step
+    sd: float    # Distance of the last step
+    steps: int   # Number of steps
+    splits: List[float] = field(default_factory=list) # Time reaching each of path.kmDistances()
+
+# The terms of Energy, work is the rider's and is the sum of the others
+energy_terms: List[str] = ['work', 'drag', 'rolling', 'gravity', 'kinetic', 'loss']
+
+class Energy:
+    """
+    Where the rider's energy goes in joules for each segment of a path,
+    table[term, i] is energy_terms[term] on the segment starting at point i.
+
+    Over a step the rider's work, power * dt, is the force times the
+    velocity times dt for each of drag, rolling and gravity, plus the change
+    in kinetic energy, plus the drivetrain loss (1 - eta) * power * dt.
+    Pass one to simulate or batch.simulateBatch to accumulate into it, the terms
+    of many runs can be added together.
+    """
+
+    def __init__(self: Energy, path: p.Path) -> None:
+        # numpy is imported here so simulate without an Energy doesn't load it
+        import numpy as np
+        self.path: p.Path = path
+        self.table: np.ndarray = np.zeros((len(energy_terms), len(path.trackList())))
+
+    def __iadd__(self: Energy, other: Energy) -> Energy:
+        self.table += other.table
+        return self
+
+    def totals(self: Energy) -> Dict[str, float]:
+        return {name: float(total) for name, total in zip(energy_terms, self.table.sum(axis=1))}
+
+    def balance(self: Energy) -> float:
+        """Return the work not accounted for by the other terms, 0 but for rounding"""
+        return float(self.table[0].sum() - self.table[1:].sum())
+
+    def perKm(self: Energy) -> np.ndarray:
+        """Return table[term, km], a segment counts in the km it starts in"""
+        import numpy as np
+        km: np.ndarray = (np.array([pt.tot for pt in self.path.trackList()]) // 1000.0).astype(np.int64)
+        kms: int = int(km[-1]) + 1 if len(km) else 0
+        return np.array([np.bincount(km, weights=row, minlength=kms) for row in self.table])
+
+def printEnergy(energy: Energy) -> None:
+    """Print the energy in kilojoules of each km and the totals"""
+    print(f"{'km':>4} " + ' '.join(f'{name:>9}' for name in energy_terms))
+    per_km: np.ndarray = energy.perKm() / 1000.0
+    k: int
+    for k in range(per_km.shape[1]):
+        print(f'{k:>4} ' + ' '.join(f'{kj:>9.1f}' for kj in per_km[:, k]))
+    print(f"{'all':>4} " + ' '.join(f'{kj / 1000.0:>9.1f}' for kj in energy.totals().values()))
+
+# Called after each step with the time at the beginning of the step, dt, the
+# distance and velocity at the end of the step, the grade and step distance.
+Step = Callable[[float, float, float, float, float, float], None]
+
+# Called after each step with the time at the beginning of the step, dt, the
+# distance and velocity at the end of the step, the grade and the drag, rolling
+# and gravity forces during the step.
+Trace = Callable[[float, float, float, float, float, float, float, float], None]
+
+# Called before each step with the distance, returns the slope in radians there
+Slope = Callable[[float], float]
+
+# Called before each step with the time and distance, returns the headwind in
+# meters/sec, negative for a tailwind. See wind.py.
+Headwind = Callable[[float, float], float]
+
+# functions to compute the various forces:
+def fDrag(prm: Params, velocity: float, headwind: float=0.0) -> float:
+    air: float = velocity + headwind # air speed
+    return 0.5*prm.dragCoeff*prm.frontalArea*prm.rho*air*abs(air)
+
+def fRolling(prm: Params, grade: float, velocity: float) -> float:
+    if velocity > 0.01:
+        return g * math.cos(math.atan(grade)) * prm.mass * prm.rollingCoeff
+    else:
+        return 0.0
+
+def fGravity(prm: Params, grade: float) -> float:
+    return g*math.sin(math.atan(grade))*prm.mass
+
+def slopeRadians(dist: float) -> float:
+    """
+    Given the distance in meters find the slope in radians.
+
+    We assume the "road" is an undulating sine wave
+    with a constant frequency and amplitude. If amplitude
+    is 0 there is no undulations.
+    """
+    # The cos(sin(x)) is the slope of a line tagent to the sin curve at x
+    freq = 100.0 # 100 meters
+    amplitude = 1.0 / freq # 0.0 for level 1.0 for slight undulation
+    c = math.cos(2.0 * math.pi * (dist / freq)) * amplitude
+    return c
+
+def mph(mps: float) -> float:
+    """
+    Meters per second to miles per hour
+    """
+    mpsToMph = 3600.0 / (0.0254 * 12.0 * 5280.0)
+    return mps * mpsToMph
+
+def hms(t: float) -> str:
+    """Return t seconds as h:m:s.ss"""
+    hours: int = math.trunc(t / 3600.0)
+    minutes: int = math.trunc((t  - (hours * 3600.0)) / 60)
+    seconds: float = t - (hours * 3600) - (minutes * 60)
+    return f'{hours}:{minutes}:{seconds:.2f}'
+
+def simulate(path: p.Path, prm: Params=Params(), step: Optional[Step]=None, headwind: Optional[Headwind]=None,
+             energy: Optional[Energy]=None, trace: Optional[Trace]=None, slope: Optional[Slope]=None) -> SimResult:
+    """
+    Simulate riding path from a standing start at distance 0 until the end of
+    the path. The slope is that of the path's segments unless slope is given,
+    e.g. elevation_model.ElevationModel.slpRadians.
+    """
+    v: float = 0.0      # initial velocity
+    dt: float = prm.dt  # time step
+    pv: float = 0.0     # previous velocity
+    d: float = 0.0      # initial distance
+    sd: float = 0.0     # step distance
+    grade: float = 0.0
+    steps: int = 0
+
+    start: float = time.perf_counter() if instrument.enabled else 0.0
+
+    # Times reaching each km, interpolated within the step which reaches it
+    boundaries: List[float] = path.kmDistances() + [math.inf]
+    splits: List[float] = [0.0]
+    next_split: float = boundaries[1]
+
+    # Energy of the steps on segment seg accumulated in locals, stored in the
+    # lists when the segment changes and added to energy at the end
+    tl: List[tp.TrackPoint] = path.trackList()
+    works: List[float] = [0.0] * len(tl) if energy is not None else []
+    drags: List[float] = works.copy()
+    rollings: List[float] = works.copy()
+    gravities: List[float] = works.copy()
+    kinetics: List[float] = works.copy()
+    losses: List[float] = works.copy()
+    j: int = 0
+    seg: int = 0
+    work_j: float = 0.0
+    drag_j: float = 0.0
+    rolling_j: float = 0.0
+    gravity_j: float = 0.0
+    kinetic_j: float = 0.0
+    loss_j: float = 0.0
+
+    # loop over time until end of distance:
+    t: float = 0.0
+    total_distance: float = path.tot()
+    while d < total_distance:
+        if energy is None:
+            grade = path.slpRadians(d) if slope is None else slope(d)
+        else:
+            pt: Optional[tp.TrackPoint] = path.getTrackPoint(d)
+            j = pt.idx if pt is not None else len(tl) - 1
+            if j != seg:
+                works[seg] += work_j
+                drags[seg] += drag_j
+                rollings[seg] += rolling_j
+                gravities[seg] += gravity_j
+                kinetics[seg] += kinetic_j
+                losses[seg] += loss_j
+                seg = j
+                work_j = drag_j = rolling_j = gravity_j = kinetic_j = loss_j = 0.0
+            grade = (pt.slp if pt is not None else 0) if slope is None else slope(d)
+        drag: float = fDrag(prm, v) if headwind is None else fDrag(prm, v, headwind(t, d))
+        rolling: float = fRolling(prm, grade, v)
+        gravity: float = fGravity(prm, grade)
+        totalForce = drag + rolling + gravity
+        powerNeeded = totalForce * v / prm.eta
+        netPower = prm.power - powerNeeded
+
+        av = (v + pv) / 2.0 # average velocity
+        sd = av * dt # step distance
+        if (d + sd) > total_distance:
+            # Don't go past the last point
+            sd = total_distance - d # Adjust the last stpe
+            dt = sd / av # Adjust the dt
+            d = total_distance # We're done
+        else:
+            d += sd # distance traveled
+
+        # kinetic energy increases by net energy available for dt
+        pv = v
+        v = math.sqrt(v*v + 2 * netPower * dt * prm.eta / prm.mass)
+        if energy is not None:
+            work_j += prm.power * dt
+            drag_j += drag * pv * dt
+            rolling_j += rolling * pv * dt
+            gravity_j += gravity * pv * dt
+            kinetic_j += 0.5 * prm.mass * (v*v - pv*pv)
+            loss_j += (1.0 - prm.eta) * prm.power * dt
+        if step is not None:
+            step(t, dt, d, v, grade, sd)
+        if trace is not None:
+            trace(t, dt, d, v, grade, drag, rolling, gravity)
+        while d >= next_split:
+            splits.append(t + dt * (next_split - (d - sd)) / sd)
+            next_split = boundaries[len(splits)]
+
+        # incrment time
+        t += dt
+        steps += 1
+
+    if energy is not None:
+        import numpy as np
+        if tl:
+            works[seg] += work_j
+            drags[seg] += drag_j
+            rollings[seg] += rolling_j
+            gravities[seg] += gravity_j
+            kinetics[seg] += kinetic_j
+            losses[seg] += loss_j
+        energy.table += np.array([works, drags, rollings, gravities, kinetics, losses])
+
+    if instrument.enabled:
+        instrument.add('simulate', time.perf_counter() - start)
+        instrument.count('steps', steps)
+
+    return SimResult(t=t, d=d, v=v, grade=grade, sd=sd, steps=steps, splits=splits)
+
+if __name__ == '__main__':
+    import numpy as np
+    import gpx_track_list as gpx_tl
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+    path: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_test_file))
+    result: SimResult = simulate(path)
+    print(f'{gpx_test_file}: tot={path.tot():.2f}m t={hms(result.t)} v={mph(result.v):.2f}mph steps={result.steps}')
+
+    import unittest
+
+    class TestSimulator(unittest.TestCase):
+
+        def test_reaches_end(self: TestSimulator):
+            result: SimResult = simulate(path)
+            self.assertEqual(result.d, path.tot())
+            self.assertTrue(result.t > 0.0)
+            self.assertTrue(result.steps > 0)
+
+        def test_more_power_is_faster(self: TestSimulator):
+            slow: SimResult = simulate(path, Params(power=100.0))
+            fast: SimResult = simulate(path, Params(power=300.0))
+            self.assertTrue(fast.t < slow.t)
+
+        def test_step_callback(self: TestSimulator):
+            ds: list = []
+            result: SimResult = simulate(path, step=lambda t, dt, d, v, grade, sd: ds.append(d))
+            self.assertEqual(len(ds), result.steps)
+            self.assertEqual(ds[-1], path.tot())
+            self.assertTrue(all(d1 <= d2 for d1, d2 in zip(ds, ds[1:])))
+
+        def test_splits(self: TestSimulator):
+            ds: List[float] = [0.0]
+            ts: List[float] = [0.0]
+            def step(t: float, dt: float, d: float, v: float, grade: float, sd: float) -> None:
+                ds.append(d)
+                ts.append(t + dt)
+            result: SimResult = simulate(path, step=step)
+            self.assertEqual(len(result.splits), len(path.kmDistances()))
+            self.assertEqual(result.splits[0], 0.0)
+            self.assertAlmostEqual(result.splits[-1], result.t, delta=1e-9)
+            self.assertTrue(np.allclose(result.splits[1:], np.interp(path.kmDistances()[1:], ds, ts), rtol=0.0, atol=1e-9))
+
+        def test_energy_conservation(self: TestSimulator):
+            # The rider's work against drag, rolling and gravity computed from the
+            # path and the velocities of the steps, not from the simulator's forces
+            tl: List[tp.TrackPoint] = path.trackList()
+            errors: List[float] = []
+            dt: float
+            for dt in [0.1, 0.01]:
+                prm: Params = Params(power=200.0, dt=dt)
+                vs: List[float] = [0.0]
+                drag: List[float] = [0.0]
+                def step(t: float, step_dt: float, d: float, v: float, grade: float, sd: float) -> None:
+                    drag[0] += fDrag(prm, (vs[-1] + v) / 2.0) * sd
+                    vs.append(v)
+                energy: Energy = Energy(path)
+                result: SimResult = simulate(path, prm, step=step, energy=energy)
+                self.assertEqual(result.t, simulate(path, prm).t)
+                work: float = prm.power * result.t
+                expected: Dict[str, float] = {
+                    'drag': drag[0],
+                    'rolling': sum(g * math.cos(math.atan(pt.slp)) * prm.mass * prm.rollingCoeff * pt.dis for pt in tl),
+                    'gravity': sum(g * math.sin(math.atan(pt.slp)) * prm.mass * pt.dis for pt in tl),
+                    'kinetic': 0.5 * prm.mass * result.v * result.v,
+                    'loss': (1.0 - prm.eta) * work,
+                }
+                # Integrating with a step of dt the error is about proportional to dt
+                error: float = abs(sum(expected.values()) - work)
+                self.assertTrue(error < 0.02 * dt * work, f'dt={dt} error={error:.1f}J of {work:.1f}J')
+                errors.append(error)
+                totals: Dict[str, float] = energy.totals()
+                self.assertAlmostEqual(totals['work'], work, delta=1e-6 * work)
+                name: str
+                for name in expected:
+                    self.assertAlmostEqual(totals[name], expected[name], delta=0.02 * dt * work)
+                self.assertTrue(np.allclose(energy.perKm().sum(axis=1), energy.table.sum(axis=1)))
+                self.assertEqual(energy.perKm().shape, (len(energy_terms), 2))
+            self.assertTrue(errors[1] < errors[0] / 3.0)
+
+        def test_empty_path_time_is_0(self: TestSimulator):
+            one: p.Path = p.Path(gpx_tl.GpxTrackList(gpx_test_file)[:1])
+            self.assertEqual(simulate(one).t, 0.0)
+
+    unittest.main()
@@ -5,12 +5,13 @@ from tap import Tap
 
 import os
 import tcx_track_list as tcx_tl
+import track_file as tf
 import csv_track_list as csx_tl
 import track_point as tp
 import path as p
 
 class ArgumentsParser(Tap):
-    in_filename: str # Input .tcx file name
+    in_filename: str # Input .tcx file name, may be compressed
     out_filename: str # Output .csv file name
 
     def add_arguments(self):
@@ -26,7 +27,7 @@ def main():
         args = ArgumentsParser(description="Convert tcx to csv file").parse_args();
 
         # Create trklist from tcx file
-        _, extension = os.path.splitext(args.in_filename)
+        extension = tf.trackExtension(args.in_filename)
         if extension == '.tcx':
             path: p.Path = p.Path(tcx_tl.TcxTrackList(args.in_filename))
         else:
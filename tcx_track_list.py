@@ -2,15 +2,17 @@
 
 # bike power calculation
 from __future__ import annotations
-from typing import Optional, List
+from typing import Optional, List, Iterable, FrozenSet, BinaryIO
 from dataclasses import dataclass
 
+import io
 import math
 import calendar
 import time
-import numpy as np
 import xml.etree.ElementTree as et
 import track_point as tp
+import track_file as tf
+import instrument
 
 def parse_time_subElement(elem_time: et.Element, name: str) -> float:
     elem = elem_time.find('.//{*}' + name)
@@ -33,37 +35,60 @@ def parse_float_subElement(elem_float: et.Element, name: str) -> float:
         val = '0.0'
     return float(val)
 
-def parse_trackpoint(elem: et.Element) -> Optional[tp.TrackPoint]:
-    """Return PtData"""
+all_fields: FrozenSet[str] = frozenset(tp.mkCsvHeader())
+
+def parse_trackpoint(elem: et.Element, fields: Optional[FrozenSet[str]]=None) -> Optional[tp.TrackPoint]:
+    """Return PtData, only the fields, default all, are searched for and the others are 0"""
     if not elem:
         return None
 
-    tim: float = parse_time_subElement(elem, 'Time')
-    lat: float = parse_float_subElement(elem, 'LatitudeDegrees')
-    lon: float = parse_float_subElement(elem, 'LongitudeDegrees')
-    ele: float = parse_float_subElement(elem, 'AltitudeMeters')
-    hrt: float = parse_float_subElement(elem, 'HeartRateBpm//{*}Value')
-    spd: float = parse_float_subElement(elem, 'Speed')
-    wts: float = parse_float_subElement(elem, 'Watts')
+    if fields is None:
+        fields = all_fields
+    tim: float = parse_time_subElement(elem, 'Time') if 'tim' in fields else 0.0
+    lat: float = parse_float_subElement(elem, 'LatitudeDegrees') if 'lat' in fields else 0.0
+    lon: float = parse_float_subElement(elem, 'LongitudeDegrees') if 'lon' in fields else 0.0
+    ele: float = parse_float_subElement(elem, 'AltitudeMeters') if 'ele' in fields else 0.0
+    hrt: float = parse_float_subElement(elem, 'HeartRateBpm//{*}Value') if 'hrt' in fields else 0.0
+    spd: float = parse_float_subElement(elem, 'Speed') if 'spd' in fields else 0.0
+    wts: float = parse_float_subElement(elem, 'Watts') if 'wts' in fields else 0.0
 
     return tp.TrackPoint(lat=lat, lon=lon, ele=ele, hrt=hrt, spd=spd, wts=wts, tim=tim)
 
-def TcxTrackList(filename: str) -> List[tp.TrackPoint]:
-    """Create a List[tp.TrackPoint] which maybe empty if no trkpt's found"""
+def TcxReaderTrackList(reader: BinaryIO, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """
+    Create a List[tp.TrackPoint] from a tcx BinaryIO stream, result maybe empty if no Trackpoint's found.
+    Only the fields, default all, are parsed, the others are left at their defaults.
+    """
+    names: Optional[FrozenSet[str]] = tp.checkFields(fields)
 
-    # Create a list of TrackPoints
+    # Create a list of TrackPoints, parsing as the stream is read and
+    # discarding the elements parsed so memory doesn't grow with the file
     track: List[tp.TrackPoint] = []
     elem: et.Element
-    tree = et.parse(filename)
-    root: et.Element = tree.getroot()
-    for elem in root.findall('.//{*}Trackpoint'):
-        p: Optional[tp.TrackPoint]
-        p = parse_trackpoint(elem)
-        if p is not None:
-            track.append(p)
+    with instrument.stage('tcx parse'):
+        for _, elem in et.iterparse(reader):
+            local: str = elem.tag.rpartition('}')[2]
+            if local == 'Trackpoint':
+                p: Optional[tp.TrackPoint]
+                p = parse_trackpoint(elem, names)
+                if p is not None:
+                    track.append(p)
+                elem.clear()
+            elif local == 'Track':
+                elem.clear()
+    instrument.count('tcx points', len(track))
 
     return track
 
+def TcxTrackList(filename: str, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """Create a List[tp.TrackPoint] which maybe empty if no trkpt's found, filename may be compressed"""
+    with tf.openTrack(filename) as f:
+        return TcxReaderTrackList(f, fields)
+
+def TcxBytesTrackList(data: bytes, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    with io.BytesIO(data) as bio:
+        return TcxReaderTrackList(bio, fields)
+
 if __name__ == '__main__':
     test_data = './test/data/RAAM_TS21_ride_snippet.tcx'
 
@@ -83,4 +108,19 @@ if __name__ == '__main__':
             tl = TcxTrackList(test_data)
             self.assertTrue(len(tl) != 0)
 
+        def test_TcxBytesTrackList(self):
+            with open(test_data, 'rb') as f:
+                tl = TcxBytesTrackList(f.read())
+            self.assertTrue(tp.compareList(tl, TcxTrackList(test_data)))
+
+        def test_fields(self):
+            tl = TcxTrackList(test_data)
+            geometry = TcxTrackList(test_data, tp.geometry_fields)
+            self.assertEqual([(pt.lat, pt.lon, pt.ele) for pt in geometry], [(pt.lat, pt.lon, pt.ele) for pt in tl])
+            self.assertTrue(all(pt.tim == pt.hrt == pt.spd == pt.wts == 0.0 for pt in geometry))
+            self.assertTrue(any(pt.tim != 0.0 for pt in tl))
+            timed = TcxTrackList(test_data, ['tim', 'wts'])
+            self.assertEqual([(pt.tim, pt.wts) for pt in timed], [(pt.tim, pt.wts) for pt in tl])
+            self.assertRaises(ValueError, TcxTrackList, test_data, ['time'])
+
     unittest.main()
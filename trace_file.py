@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# Stream every step of a simulation to a binary file and read windows of it back
+#
+# The file is a header, the records as little endian float64s in the order
+# of fields, the index and a trailer. Records are written a chunk at a time
+# and the index has the record number, time and distance of the first record
+# of each chunk. Readers memory map the records and use the index to find a
+# window by time or distance reading only the chunks it is in. If the writer
+# didn't finish the index is rebuilt from the records.
+from __future__ import annotations
+from typing import Optional, List, Tuple
+
+import array
+import os
+import struct
+import sys
+import numpy as np
+
+# The fields of each record, the arguments of simulator.Trace
+fields: List[str] = ['t', 'dt', 'd', 'v', 'grade', 'drag', 'rolling', 'gravity']
+record_dtype: np.dtype = np.dtype([(name, '<f8') for name in fields])
+index_dtype: np.dtype = np.dtype([('record', '<i8'), ('t', '<f8'), ('d', '<f8')])
+
+magic: bytes = b'BIKETRC1'
+header: struct.Struct = struct.Struct('<8sQ')       # magic, number of fields
+trailer: struct.Struct = struct.Struct('<QQ8s')     # offset of the index, number of chunks, magic
+
+class TraceWriter:
+    """
+    A simulator.Trace which writes the records to filename, chunk_records
+    at a time. close() writes the index.
+    """
+
+    def __init__(self: TraceWriter, filename: str, chunk_records: int=65536) -> None:
+        self.filename: str = filename
+        self.chunk_records: int = chunk_records
+        self.records: int = 0
+        self.__chunk_values: int = chunk_records * len(fields)
+        self.__buf: List[float] = []
+        self.__index: List[Tuple[int, float, float]] = []
+        self.__f = open(filename, 'wb')
+        self.__f.write(header.pack(magic, len(fields)))
+
+    def __call__(self: TraceWriter, t: float, dt: float, d: float, v: float, grade: float,
+                 drag: float, rolling: float, gravity: float) -> None:
+        self.__buf.extend((t, dt, d, v, grade, drag, rolling, gravity))
+        if len(self.__buf) >= self.__chunk_values:
+            self.flush()
+
+    def flush(self: TraceWriter) -> None:
+        """Write the buffered records as a chunk"""
+        if not self.__buf:
+            return
+        self.__index.append((self.records, self.__buf[0], self.__buf[2]))
+        # Extending a list per step and converting it here is faster than extending an array
+        buf: array.array = array.array('d', self.__buf)
+        if sys.byteorder != 'little':
+            buf.byteswap()
+        buf.tofile(self.__f)
+        self.records += len(buf) // len(fields)
+        self.__buf = []
+
+    def close(self: TraceWriter) -> None:
+        if self.__f.closed:
+            return
+        self.flush()
+        offset: int = self.__f.tell()
+        self.__f.write(np.array(self.__index, dtype=index_dtype).tobytes())
+        self.__f.write(trailer.pack(offset, len(self.__index), magic))
+        self.__f.close()
+
+    def __enter__(self: TraceWriter) -> TraceWriter:
+        return self
+
+    def __exit__(self: TraceWriter, *args) -> None:
+        self.close()
+
+class TraceFile:
+    """
+    The records of a trace file memory mapped, records['v'] are the
+    velocities of every step. Only the pages of the records used are read.
+    """
+
+    def __init__(self: TraceFile, filename: str, chunk_records: int=65536) -> None:
+        self.filename: str = filename
+        size: int = os.path.getsize(filename)
+        with open(filename, 'rb') as f:
+            head: bytes = f.read(header.size)
+            if (len(head) != header.size) or (header.unpack(head) != (magic, len(fields))):
+                raise ValueError(f'{filename} is not a trace file')
+            end: int = size
+            index: Optional[np.ndarray] = None
+            if size >= header.size + trailer.size:
+                f.seek(size - trailer.size)
+                offset, chunks, trailer_magic = trailer.unpack(f.read(trailer.size))
+                if trailer_magic == magic:
+                    f.seek(offset)
+                    index = np.frombuffer(f.read(chunks * index_dtype.itemsize), dtype=index_dtype)
+                    end = offset
+        count: int = (end - header.size) // record_dtype.itemsize
+        self.records: np.ndarray = np.memmap(filename, dtype=record_dtype, mode='r', offset=header.size, shape=(count,)) \
+            if count > 0 else np.zeros(0, dtype=record_dtype)
+        if index is None:
+            # The writer didn't finish, index the whole records written
+            first: np.ndarray = np.arange(0, count, chunk_records)
+            index = np.zeros(len(first), dtype=index_dtype)
+            index['record'] = first
+            index['t'] = self.records['t'][first]
+            index['d'] = self.records['d'][first]
+        self.index: np.ndarray = index
+
+    def __len__(self: TraceFile) -> int:
+        return len(self.records)
+
+    def __window(self: TraceFile, key: str, lo: float, hi: float) -> np.ndarray:
+        """Return the records with lo <= records[key] < hi, key increases with the record"""
+        keys: np.ndarray = self.index[key]
+        c: int = max(int(np.searchsorted(keys, lo, 'left')) - 1, 0)
+        e: int = int(np.searchsorted(keys, hi, 'left'))
+        first: int = int(self.index['record'][c]) if len(keys) > 0 else 0
+        last: int = int(self.index['record'][e]) if e < len(keys) else len(self.records)
+        chunk: np.ndarray = self.records[first:last]
+        col: np.ndarray = chunk[key]
+        return chunk[int(np.searchsorted(col, lo, 'left')):int(np.searchsorted(col, hi, 'left'))]
+
+    def timeWindow(self: TraceFile, start: float, end: float) -> np.ndarray:
+        """Return the records of the steps beginning from start up to end seconds"""
+        return self.__window('t', start, end)
+
+    def distanceWindow(self: TraceFile, start: float, end: float) -> np.ndarray:
+        """Return the records of the steps ending from start up to end meters"""
+        return self.__window('d', start, end)
+
+    def close(self: TraceFile) -> None:
+        # The file is unmapped when the windows taken from it are gone too
+        self.records = np.zeros(0, dtype=record_dtype)
+
+    def __enter__(self: TraceFile) -> TraceFile:
+        return self
+
+    def __exit__(self: TraceFile, *args) -> None:
+        self.close()
+
+def printWindow(records: np.ndarray) -> None:
+    if len(records) == 0:
+        print('no records')
+        return
+    print(f"records={len(records)} t={records['t'][0]:.1f}..{records['t'][-1] + records['dt'][-1]:.1f}s"
+          f" d={records['d'][0]:.1f}..{records['d'][-1]:.1f}m")
+    name: str
+    for name in ['v', 'grade', 'drag', 'rolling', 'gravity']:
+        col: np.ndarray = records[name]
+        print(f'  {name:<8} min={col.min():>9.3f} mean={col.mean():>9.3f} max={col.max():>9.3f}')
+
+if __name__ == '__main__':
+    import math
+    import path as p
+    import simulator as sim
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+
+        parser = argparse.ArgumentParser(description='Summarize a window of a trace file written by bike.py simulate --trace.')
+        parser.add_argument('filename', type=str, help='trace file')
+        parser.add_argument('--from-km', type=float, help='window start in km')
+        parser.add_argument('--to-km', type=float, help='window end in km')
+        parser.add_argument('--from-s', type=float, help='window start in seconds')
+        parser.add_argument('--to-s', type=float, help='window end in seconds')
+        args = parser.parse_args()
+
+        with TraceFile(args.filename) as trace:
+            print(f'{args.filename}: {len(trace)} records in {len(trace.index)} chunks')
+            if (args.from_s is not None) or (args.to_s is not None):
+                printWindow(trace.timeWindow(args.from_s or 0.0, args.to_s if args.to_s is not None else math.inf))
+            else:
+                printWindow(trace.distanceWindow((args.from_km or 0.0) * 1000.0,
+                                                 args.to_km * 1000.0 if args.to_km is not None else math.inf))
+        sys.exit(0)
+
+    import unittest
+    import tempfile
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestTraceFile(unittest.TestCase):
+
+        def setUp(self: TestTraceFile):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.filename: str = os.path.join(self.tmp.name, 'trace.trc')
+            self.path: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+
+        def tearDown(self: TestTraceFile):
+            self.tmp.cleanup()
+
+        def test_round_trip(self: TestTraceFile):
+            steps: List[Tuple[float, float, float, float, float]] = []
+            with TraceWriter(self.filename, chunk_records=100) as writer:
+                result: sim.SimResult = sim.simulate(self.path, trace=writer,
+                                                     step=lambda t, dt, d, v, grade, sd: steps.append((t, dt, d, v, grade)))
+            self.assertEqual(writer.records, result.steps)
+            with TraceFile(self.filename) as trace:
+                self.assertEqual(len(trace), result.steps)
+                self.assertEqual(len(trace.index), math.ceil(result.steps / 100))
+                self.assertEqual([tuple(r) for r in trace.records[['t', 'dt', 'd', 'v', 'grade']].tolist()], steps)
+                last = trace.records[-1]
+                self.assertEqual((last['d'], last['v']), (result.d, result.v))
+                self.assertEqual(last['drag'], sim.fDrag(sim.Params(), steps[-2][3]))
+
+        def test_windows(self: TestTraceFile):
+            with TraceWriter(self.filename, chunk_records=64) as writer:
+                sim.simulate(self.path, trace=writer)
+            with TraceFile(self.filename) as trace:
+                t: np.ndarray = np.array(trace.records['t'])
+                d: np.ndarray = np.array(trace.records['d'])
+                lo: float
+                hi: float
+                for lo, hi in [(100.0, 250.0), (0.0, 1.0), (-5.0, 0.05), (t[64], t[128]), (t[-1], math.inf), (1e9, 2e9)]:
+                    window: np.ndarray = trace.timeWindow(lo, hi)
+                    self.assertTrue(np.array_equal(window['t'], t[(t >= lo) & (t < hi)]))
+                for lo, hi in [(500.0, 1500.0), (d[63], d[64]), (0.0, math.inf)]:
+                    window = trace.distanceWindow(lo, hi)
+                    self.assertTrue(np.array_equal(window['d'], d[(d >= lo) & (d < hi)]))
+
+        def test_unfinished(self: TestTraceFile):
+            with TraceWriter(self.filename, chunk_records=50) as writer:
+                sim.simulate(self.path, trace=writer)
+            with TraceFile(self.filename) as trace:
+                records: np.ndarray = np.array(trace.records)
+                index: np.ndarray = np.array(trace.index)
+            # Drop the index and trailer as if the writer had been killed
+            size: int = os.path.getsize(self.filename)
+            with open(self.filename, 'r+b') as f:
+                f.truncate(size - trailer.size - index.nbytes - 3)
+            with TraceFile(self.filename, chunk_records=50) as trace:
+                self.assertEqual(len(trace), len(records) - 1)
+                self.assertTrue(np.array_equal(trace.index, index))
+                self.assertTrue(np.array_equal(trace.timeWindow(20.0, 40.0), records[(records['t'] >= 20.0) & (records['t'] < 40.0)]))
+            with open(self.filename, 'wb') as f:
+                f.write(b'not a trace')
+            self.assertRaises(ValueError, TraceFile, self.filename)
+
+    unittest.main()
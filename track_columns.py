@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Columnar form of a list of TrackPoints, one numpy array per field
+from __future__ import annotations
+from typing import Optional, List, Dict
+
+import numpy as np
+import track_point as tp
+
+# Field name to numpy array, the names are those of mkCsvHeader()
+TrackColumns = Dict[str, np.ndarray]
+
+fields: List[str] = tp.mkCsvHeader()
+
+def mkTrackColumns(tl: List[tp.TrackPoint], names: Optional[List[str]]=None) -> TrackColumns:
+    """Return the fields names, default all, of tl as columns"""
+    if names is None:
+        names = fields
+    cols: TrackColumns = {}
+    name: str
+    for name in names:
+        if name not in fields:
+            raise ValueError(f'Unknown field:{name}')
+        cols[name] = np.fromiter((getattr(pt, name) for pt in tl), dtype=np.int64 if name == 'idx' else np.float64, count=len(tl))
+    return cols
+
+def columnsLen(cols: TrackColumns) -> int:
+    return len(next(iter(cols.values()))) if cols else 0
+
+def mkTrackList(cols: TrackColumns) -> List[tp.TrackPoint]:
+    """Return a list of TrackPoints from cols, missing fields are 0"""
+    tl: List[tp.TrackPoint] = []
+    lists: Dict[str, list] = {name: col.tolist() for name, col in cols.items()}
+    i: int
+    for i in range(columnsLen(cols)):
+        pt: tp.TrackPoint = tp.mkTrackPoint()
+        for name, col in lists.items():
+            setattr(pt, name, col[i])
+        tl.append(pt)
+    return tl
+
+if __name__ == '__main__':
+    import unittest
+    import gpx_track_list as gpx_tl
+    import path as p
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestTrackColumns(unittest.TestCase):
+
+        def test_round_trip(self: TestTrackColumns):
+            tl: List[tp.TrackPoint] = p.Path(gpx_tl.GpxTrackList(gpx_test_file)).trackList()
+            cols: TrackColumns = mkTrackColumns(tl)
+            self.assertEqual(list(cols.keys()), fields)
+            self.assertEqual(columnsLen(cols), len(tl))
+            self.assertEqual(cols['tot'][-1], tl[-1].tot)
+            self.assertTrue(tp.compareList(mkTrackList(cols), tl))
+
+        def test_some_fields(self: TestTrackColumns):
+            tl: List[tp.TrackPoint] = gpx_tl.GpxTrackList(gpx_test_file)
+            cols: TrackColumns = mkTrackColumns(tl, ['lat', 'lon'])
+            self.assertEqual(list(cols.keys()), ['lat', 'lon'])
+            self.assertRaises(ValueError, mkTrackColumns, tl, ['latitude'])
+            self.assertEqual(columnsLen({}), 0)
+
+    unittest.main()
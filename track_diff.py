@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# Compare tracks field by field within tolerances
+from __future__ import annotations
+from typing import Optional, List, Dict, Any
+from dataclasses import dataclass, field
+
+import numpy as np
+import track_point as tp
+import track_columns as tc
+
+@dataclass(frozen=True)
+class Tolerance:
+    """Values a and b match if |a - b| <= atol + rtol * |b|, the default is exact"""
+    atol: float = 0.0
+    rtol: float = 0.0
+
+@dataclass
+class FieldDiff:
+    name: str
+    mismatches: int = 0  # Number of points where the field doesn't match
+    first: int = -1      # Index of the first mismatch, -1 if none
+    max_abs: float = 0.0 # Largest |a - b|
+    max_rel: float = 0.0 # Largest |a - b| / |b|
+
+@dataclass
+class TrackDiff:
+    len1: int
+    len2: int
+    fields: Dict[str, FieldDiff] = field(default_factory=dict)
+    missing: List[str] = field(default_factory=list) # Fields in only one of the tracks
+
+    def first(self: TrackDiff) -> int:
+        """Return the index of the first point which differs, -1 if none"""
+        firsts: List[int] = [f.first for f in self.fields.values() if f.first >= 0]
+        if self.len1 != self.len2:
+            firsts.append(min(self.len1, self.len2))
+        return min(firsts) if firsts else -1
+
+    def equal(self: TrackDiff) -> bool:
+        return (self.first() < 0) and not self.missing
+
+# Points compared at a time, bounds the temporary arrays
+chunk_points: int = 1 << 18
+
+def _diffField(a: np.ndarray, b: np.ndarray, tol: Tolerance, result: FieldDiff) -> None:
+    """Add the differences of a and b, a chunk of the field, to result"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        err: np.ndarray = np.abs(a - b)
+        limit: Any = tol.atol + tol.rtol * np.abs(b) if tol.rtol != 0.0 else tol.atol
+        # NaN errors fail the comparison and are rechecked below
+        bad: np.ndarray = ~(err <= limit)
+        if tol.rtol != 0.0:
+            bad |= np.isinf(err)
+        idx: np.ndarray = np.flatnonzero(bad)
+        if len(idx) > 0:
+            # Infinities of the same sign and matching NaNs are equal, any other NaN is infinitely wrong
+            same: np.ndarray = (a[idx] == b[idx]) | (np.isnan(a[idx]) & np.isnan(b[idx]))
+            e: np.ndarray = err[idx]
+            e[same] = 0.0
+            e[np.isnan(e)] = np.inf
+            err[idx] = e
+            idx = idx[~same]
+        max_abs: float = float(err.max()) if len(err) > 0 else 0.0
+        if max_abs == 0.0:
+            return
+        # fmax skips the NaNs of 0 / 0, inf / inf only comes from an infinite error
+        max_rel: float = float(np.fmax.reduce(err / np.abs(b))) if max_abs < np.inf else np.inf
+    if len(idx) > 0:
+        if result.first < 0:
+            result.first = int(idx[0])
+        result.mismatches += len(idx)
+    result.max_abs = max(result.max_abs, max_abs)
+    result.max_rel = max(result.max_rel, max_rel)
+
+def diffColumns(cols1: tc.TrackColumns, cols2: tc.TrackColumns, tolerances: Dict[str, Tolerance]={},
+                default: Tolerance=Tolerance(), names: Optional[List[str]]=None) -> TrackDiff:
+    """
+    Compare the fields names, default those in either, of cols1 with cols2.
+    Each field uses its tolerance in tolerances or default. When the lengths
+    differ the points both have are compared.
+    """
+    if names is None:
+        names = list(cols1.keys()) + [name for name in cols2.keys() if name not in cols1]
+    result: TrackDiff = TrackDiff(len1=tc.columnsLen(cols1), len2=tc.columnsLen(cols2))
+    n: int = min(result.len1, result.len2)
+    name: str
+    for name in names:
+        if (name not in cols1) or (name not in cols2):
+            result.missing.append(name)
+            continue
+        a: np.ndarray = np.asarray(cols1[name], dtype=np.float64)
+        b: np.ndarray = np.asarray(cols2[name], dtype=np.float64)
+        fd: FieldDiff = FieldDiff(name)
+        tol: Tolerance = tolerances.get(name, default)
+        start: int
+        for start in range(0, n, chunk_points):
+            end: int = min(start + chunk_points, n)
+            first: int = fd.first
+            _diffField(a[start:end], b[start:end], tol, fd)
+            if (first < 0) and (fd.first >= 0):
+                fd.first += start
+        result.fields[name] = fd
+    return result
+
+def diffTrackLists(tl1: List[tp.TrackPoint], tl2: List[tp.TrackPoint], tolerances: Dict[str, Tolerance]={},
+                   default: Tolerance=Tolerance(), names: Optional[List[str]]=None) -> TrackDiff:
+    """Compare the fields names, default all, of tl1 with tl2"""
+    return diffColumns(tc.mkTrackColumns(tl1, names), tc.mkTrackColumns(tl2, names), tolerances, default)
+
+def printDiff(diff: TrackDiff) -> None:
+    if diff.len1 != diff.len2:
+        print(f'lengths differ {diff.len1} != {diff.len2}')
+    name: str
+    for name in diff.missing:
+        print(f'{name} missing')
+    print(f"{'field':<5} {'mismatches':>10} {'first':>8} {'max abs':>12} {'max rel':>12}")
+    fd: FieldDiff
+    for fd in diff.fields.values():
+        print(f'{fd.name:<5} {fd.mismatches:>10} {fd.first:>8} {fd.max_abs:>12.6g} {fd.max_rel:>12.6g}')
+    print('equal' if diff.equal() else f'differ, first at point {diff.first()}')
+
+if __name__ == '__main__':
+    import sys
+    import path as p
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+
+        parser = argparse.ArgumentParser(description='Compare two tracks field by field.')
+        parser.add_argument('filename1', type=str, help='.gpx, .tcx or .csv track')
+        parser.add_argument('filename2', type=str, help='.gpx, .tcx or .csv track')
+        parser.add_argument('--atol', type=float, default=0.0, help='default absolute tolerance')
+        parser.add_argument('--rtol', type=float, default=0.0, help='default relative tolerance')
+        parser.add_argument('--tol', type=str, action='append', default=[], metavar='FIELD=ATOL[,RTOL]',
+                            help='tolerance of one field, may be repeated')
+        parser.add_argument('--fields', type=str, default=None, help='comma separated fields to compare, default all')
+        parser.add_argument('--path', action='store_true', help='compute the distance, slope and bearing fields first')
+        args = parser.parse_args()
+
+        tolerances: Dict[str, Tolerance] = {}
+        s: str
+        for s in args.tol:
+            name, _, values = s.partition('=')
+            tols: List[float] = [float(v) for v in values.split(',')]
+            tolerances[name] = Tolerance(*tols)
+        tls: List[List[tp.TrackPoint]] = [tf.readTrackList(f) for f in (args.filename1, args.filename2)]
+        if args.path:
+            tls = [p.Path(tl).trackList() for tl in tls]
+        diff: TrackDiff = diffTrackLists(tls[0], tls[1], tolerances, Tolerance(args.atol, args.rtol),
+                                         args.fields.split(',') if args.fields else None)
+        printDiff(diff)
+        sys.exit(0 if diff.equal() else 1)
+
+    import unittest
+    import bench
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestTrackDiff(unittest.TestCase):
+
+        def test_same(self: TestTrackDiff):
+            tl: List[tp.TrackPoint] = p.Path(tf.readTrackList(gpx_test_file)).trackList()
+            diff: TrackDiff = diffTrackLists(tl, tl)
+            self.assertTrue(diff.equal())
+            self.assertEqual(diff.first(), -1)
+            self.assertEqual(list(diff.fields.keys()), tc.fields)
+            self.assertTrue(all(f.max_abs == 0.0 for f in diff.fields.values()))
+
+        def test_tolerances(self: TestTrackDiff):
+            a: tc.TrackColumns = {'ele': np.array([1.0, 2.0, 3.0, 4.0]), 'tot': np.array([0.0, 10.0, 20.0, 30.0])}
+            b: tc.TrackColumns = {'ele': np.array([1.0, 2.05, 3.0, 4.2]), 'tot': np.array([0.0, 10.0, 20.01, 30.0])}
+            diff: TrackDiff = diffColumns(a, b)
+            self.assertEqual((diff.fields['ele'].mismatches, diff.fields['ele'].first), (2, 1))
+            self.assertAlmostEqual(diff.fields['ele'].max_abs, 0.2)
+            self.assertAlmostEqual(diff.fields['ele'].max_rel, 0.2 / 4.2)
+            self.assertEqual((diff.fields['tot'].mismatches, diff.fields['tot'].first), (1, 2))
+            self.assertEqual(diff.first(), 1)
+            diff = diffColumns(a, b, {'ele': Tolerance(atol=0.1)}, Tolerance(rtol=1e-3))
+            self.assertEqual((diff.fields['ele'].mismatches, diff.fields['ele'].first), (1, 3))
+            self.assertEqual(diff.fields['tot'].mismatches, 0)
+            self.assertEqual(diff.first(), 3)
+            self.assertTrue(diffColumns(a, b, default=Tolerance(atol=0.25)).equal())
+
+        def test_special_values(self: TestTrackDiff):
+            a: tc.TrackColumns = {'ele': np.array([np.nan, np.inf, 1.0, 0.0])}
+            b: tc.TrackColumns = {'ele': np.array([np.nan, np.inf, np.nan, 1e-9])}
+            diff: TrackDiff = diffColumns(a, b, default=Tolerance(atol=1.0))
+            self.assertEqual((diff.fields['ele'].mismatches, diff.fields['ele'].first), (1, 2))
+            self.assertEqual(diff.fields['ele'].max_abs, np.inf)
+
+        def test_lengths_and_missing(self: TestTrackDiff):
+            a: tc.TrackColumns = {'ele': np.arange(5.0), 'lat': np.zeros(5)}
+            b: tc.TrackColumns = {'ele': np.arange(3.0), 'tot': np.zeros(3)}
+            diff: TrackDiff = diffColumns(a, b)
+            self.assertEqual(diff.fields['ele'].mismatches, 0)
+            self.assertEqual(diff.missing, ['lat', 'tot'])
+            self.assertEqual(diff.first(), 3)
+            self.assertFalse(diff.equal())
+            self.assertTrue(diffColumns(a, b, names=['ele']).first() == 3)
+
+        def test_chunks(self: TestTrackDiff):
+            global chunk_points
+            tl: List[tp.TrackPoint] = p.Path(bench.mkSyntheticTrackList(1000)).trackList()
+            cols: tc.TrackColumns = tc.mkTrackColumns(tl)
+            other: tc.TrackColumns = {name: col.copy() for name, col in cols.items()}
+            other['ele'][[700, 900]] += 1.0
+            saved: int = chunk_points
+            try:
+                chunk_points = 64
+                diff: TrackDiff = diffColumns(cols, other)
+            finally:
+                chunk_points = saved
+            self.assertEqual((diff.fields['ele'].mismatches, diff.fields['ele'].first), (2, 700))
+            self.assertEqual(diff.first(), 700)
+            self.assertEqual(diff.fields['tot'].mismatches, 0)
+
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Read a track file choosing the reader by its extension
+#
+# The readers are imported only when a file of their type is read so
+# tools which handle one kind of file don't pay for the others.
+#
+# Files may be compressed, ride.tcx.gz is read by the tcx reader straight
+# from a streaming decompressor without a temporary file.
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple, Iterable, BinaryIO
+
+import importlib
+import io
+import os
+import track_point as tp
+
+extensions: List[str] = ['.gpx', '.tcx', '.csv']
+
+# Compressed file suffix to the module which decompresses it
+compressions: Dict[str, str] = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+
+def splitCompression(filename: str) -> Tuple[str, str]:
+    """Return filename without its compression suffix and the suffix, '' if it isn't compressed"""
+    root, suffix = os.path.splitext(filename)
+    if suffix in compressions:
+        return root, suffix
+    return filename, ''
+
+def trackExtension(filename: str) -> str:
+    """Return the extension of filename which selects its reader, ignoring a compression suffix"""
+    _, extension = os.path.splitext(splitCompression(filename)[0])
+    return extension
+
+def openTrack(filename: str) -> BinaryIO:
+    """Open filename for reading, decompressing it as it is read if it is compressed"""
+    suffix: str = splitCompression(filename)[1]
+    if suffix:
+        return importlib.import_module(compressions[suffix]).open(filename, 'rb')
+    return open(filename, 'rb')
+
+def openBytes(filename: str, data: bytes) -> BinaryIO:
+    """Return a stream of data, the contents of filename, decompressing it as it is read if it is compressed"""
+    suffix: str = splitCompression(filename)[1]
+    if suffix:
+        return importlib.import_module(compressions[suffix]).open(io.BytesIO(data), 'rb')
+    return io.BytesIO(data)
+
+def checkExtension(filename: str) -> str:
+    """Return the extension of filename, raises ValueError if there is no reader for it"""
+    extension: str = trackExtension(filename)
+    if extension not in extensions:
+        raise ValueError(f"Unknown file extension:'{extension}' in {filename}, expecting {', '.join(repr(e) for e in extensions)}")
+    return extension
+
+def readTrackList(filename: str, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """Return the TrackPoints in filename using the reader for its extension, only fields if given"""
+    extension: str = checkExtension(filename)
+    if extension == '.gpx':
+        import gpx_track_list as gpx_tl
+        return gpx_tl.GpxTrackList(filename, fields)
+    elif extension == '.tcx':
+        import tcx_track_list as tcx_tl
+        return tcx_tl.TcxTrackList(filename, fields)
+    else:
+        import csv_track_list as csv_tl
+        return csv_tl.CsvTrackList(filename, fields)
+
+def readBytesTrackList(filename: str, data: bytes, fields: Optional[Iterable[str]]=None) -> List[tp.TrackPoint]:
+    """Return the TrackPoints in data, the contents of filename, using the reader for its extension"""
+    extension: str = checkExtension(filename)
+    with openBytes(filename, data) as stream:
+        if extension == '.gpx':
+            import gpx_track_list as gpx_tl
+            return gpx_tl.GpxReaderTrackList(stream, fields)
+        elif extension == '.tcx':
+            import tcx_track_list as tcx_tl
+            return tcx_tl.TcxReaderTrackList(stream, fields)
+        else:
+            import csv_track_list as csv_tl
+            return csv_tl.CsvReaderTrackList(io.TextIOWrapper(stream, encoding='utf-8', newline=''), fields)
+
+if __name__ == '__main__':
+    import unittest
+    import tempfile
+
+    test_dir = './test/data'
+
+    class TestTrackFile(unittest.TestCase):
+
+        def test_readTrackList(self: TestTrackFile):
+            name: str
+            for name in os.listdir(test_dir):
+                filename: str = os.path.join(test_dir, name)
+                tl: List[tp.TrackPoint] = readTrackList(filename)
+                self.assertTrue(len(tl) != 0)
+                with open(filename, 'rb') as f:
+                    self.assertTrue(tp.compareList(tl, readBytesTrackList(filename, f.read())))
+
+        def test_geometry(self: TestTrackFile):
+            name: str
+            for name in os.listdir(test_dir):
+                filename: str = os.path.join(test_dir, name)
+                tl: List[tp.TrackPoint] = readTrackList(filename)
+                geometry: List[tp.TrackPoint] = readTrackList(filename, tp.geometry_fields)
+                self.assertEqual([(pt.lat, pt.lon, pt.ele) for pt in geometry], [(pt.lat, pt.lon, pt.ele) for pt in tl])
+
+        def test_compressed(self: TestTrackFile):
+            self.assertEqual(splitCompression('ride.tcx.bz2'), ('ride.tcx', '.bz2'))
+            self.assertEqual(splitCompression('ride.tcx'), ('ride.tcx', ''))
+            self.assertEqual(trackExtension('a/ride.gpx.gz'), '.gpx')
+            self.assertRaises(ValueError, readTrackList, 'ride.fit.gz')
+            with tempfile.TemporaryDirectory() as tmp:
+                name: str
+                for name in os.listdir(test_dir):
+                    filename: str = os.path.join(test_dir, name)
+                    with open(filename, 'rb') as f:
+                        data: bytes = f.read()
+                    tl: List[tp.TrackPoint] = readTrackList(filename)
+                    suffix: str
+                    for suffix, module in compressions.items():
+                        compressed: str = os.path.join(tmp, name + suffix)
+                        with importlib.import_module(module).open(compressed, 'wb') as f:
+                            f.write(data)
+                        self.assertTrue(tp.compareList(readTrackList(compressed), tl))
+                        with open(compressed, 'rb') as f:
+                            self.assertTrue(tp.compareList(readBytesTrackList(compressed, f.read()), tl))
+
+        def test_unknown_extension(self: TestTrackFile):
+            self.assertRaises(ValueError, readTrackList, 'ride.fit')
+            self.assertRaises(ValueError, readBytesTrackList, 'ride.fit', b'')
+
+    unittest.main()
@@ -4,13 +4,12 @@
 
 from __future__ import annotations
 from enum import Enum
-from typing import Tuple, Optional, Any, List
+from typing import Tuple, Optional, Any, List, Iterable, FrozenSet
 from itertools import count
 
 import math
 import time
 import calendar
-import numpy as np
 
 earthR1 = 6_371_008.7714
 
@@ -92,6 +91,19 @@ def mkCsvHeader() -> List[str]:
     """Make CSV Header, order must be identical to mkTrackPoint() and TrackPoint()"""
     return ['idx','ele','lat','lon','brg','tot','dis','slp','spd','hrt','wts','rds','tim']
 
+# The fields a Path needs, readers asked for only these skip the rest
+geometry_fields: List[str] = ['ele', 'lat', 'lon']
+
+def checkFields(fields: Optional[Iterable[str]]) -> Optional[FrozenSet[str]]:
+    """Return fields as a set, None for every field, raises ValueError for a name not in mkCsvHeader()"""
+    if fields is None:
+        return None
+    names: FrozenSet[str] = frozenset(fields)
+    unknown: List[str] = sorted(names - set(mkCsvHeader()))
+    if unknown:
+        raise ValueError(f"Unknown field:{','.join(unknown)}")
+    return names
+
 def mkCsvHeaderStr() -> str:
     return f'{",".join(str(s) for s in mkCsvHeader())}'
 
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# Wind, its headwind and crosswind on each segment of a path
+from __future__ import annotations
+from typing import Optional, List, Dict, Tuple, Union, Hashable
+from dataclasses import dataclass
+
+import bisect
+import math
+import numpy as np
+import path as p
+import simulator as sim
+
+@dataclass(frozen=True)
+class Wind:
+    """A constant wind"""
+    speed: float = 0.0     # Meters/sec
+    direction: float = 0.0 # Degrees the wind blows from, North = 0.0, East = 90.0
+
+    def components(self: Wind) -> Tuple[float, float]:
+        """Return the east and north components of the direction the wind comes from times its speed"""
+        r: float = math.radians(self.direction)
+        return self.speed * math.sin(r), self.speed * math.cos(r)
+
+@dataclass(frozen=True)
+class DistanceWind:
+    """A wind which changes along the path, winds[i] blows from distances[i] in meters"""
+    distances: Tuple[float, ...]
+    winds: Tuple[Wind, ...]
+
+@dataclass(frozen=True)
+class TimeWind:
+    """A wind which changes with time, winds[i] blows from times[i] in seconds"""
+    times: Tuple[float, ...]
+    winds: Tuple[Wind, ...]
+
+    def at(self: TimeWind, t: float) -> Wind:
+        return self.winds[max(bisect.bisect_right(self.times, t) - 1, 0)]
+
+WindField = Union[Wind, DistanceWind, TimeWind]
+
+class WindTables:
+    """
+    The headwind and crosswind of each segment of a path.
+
+    The sine and cosine of the bearing of each segment are computed once, a
+    table for a wind is then one vectorized pass over them. Tables are cached
+    per wind, for a constant wind the table for its direction at 1 m/s is
+    cached and scaled by its speed so sweeping speeds costs one pass per
+    direction.
+    """
+
+    def __init__(self: WindTables, path: p.Path) -> None:
+        tl = path.trackList()
+        self.path: p.Path = path
+        brg: np.ndarray = np.fromiter((pt.brg for pt in tl), dtype=np.float64, count=len(tl))
+        self.__sin_brg: np.ndarray = np.sin(brg)
+        self.__cos_brg: np.ndarray = np.cos(brg)
+        self.__tot: np.ndarray = np.fromiter((pt.tot for pt in tl), dtype=np.float64, count=len(tl))
+        # End of each segment, the distance of the next point
+        self.__hi: List[float] = [pt.tot + pt.dis for pt in tl]
+        self.__cache: Dict[Hashable, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __unit(self: WindTables, east: np.ndarray, north: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the headwind and crosswind, positive from the right, for the wind components"""
+        headwind: np.ndarray = (east * self.__sin_brg) + (north * self.__cos_brg)
+        crosswind: np.ndarray = (east * self.__cos_brg) - (north * self.__sin_brg)
+        return headwind, crosswind
+
+    def components(self: WindTables, wind: Union[Wind, DistanceWind]) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the headwind and crosswind in meters/sec of each segment"""
+        if isinstance(wind, Wind):
+            key: Hashable = ('direction', wind.direction)
+            unit = self.__cache.get(key)
+            if unit is None:
+                unit = self.__unit(*Wind(1.0, wind.direction).components())
+                self.__cache[key] = unit
+            return unit[0] * wind.speed, unit[1] * wind.speed
+        result = self.__cache.get(wind)
+        if result is None:
+            # The wind at the start of each segment
+            i: np.ndarray = np.maximum(np.searchsorted(wind.distances, self.__tot, side='right') - 1, 0)
+            east, north = np.array([w.components() for w in wind.winds]).T
+            result = self.__unit(east[i], north[i])
+            self.__cache[wind] = result
+        return result
+
+    def headwind(self: WindTables, wind: Union[Wind, DistanceWind]) -> np.ndarray:
+        return self.components(wind)[0]
+
+    def crosswind(self: WindTables, wind: Union[Wind, DistanceWind]) -> np.ndarray:
+        return self.components(wind)[1]
+
+    def headwindFn(self: WindTables, wind: WindField) -> sim.Headwind:
+        """Return the sim.Headwind of wind for simulator.simulate"""
+        hi: List[float] = self.__hi
+        n: int = len(hi)
+        j: int = 0 # The current segment, distance normally increases so it's a cursor
+
+        def segment(d: float) -> int:
+            nonlocal j
+            if (j > 0) and (hi[j - 1] >= d):
+                j = bisect.bisect_left(hi, d)
+            while (j < n) and (hi[j] < d):
+                j += 1
+            return j
+
+        if isinstance(wind, TimeWind):
+            sin_brg: List[float] = self.__sin_brg.tolist()
+            cos_brg: List[float] = self.__cos_brg.tolist()
+            def timeHeadwind(t: float, d: float) -> float:
+                k: int = segment(d)
+                if k >= n:
+                    return 0.0
+                east, north = wind.at(t).components()
+                return (east * sin_brg[k]) + (north * cos_brg[k])
+            return timeHeadwind
+
+        table: List[float] = self.headwind(wind).tolist()
+        def tableHeadwind(t: float, d: float) -> float:
+            k: int = segment(d)
+            return table[k] if k < n else 0.0
+        return tableHeadwind
+
+def simulate(path: p.Path, prm: sim.Params, wind: WindField, tables: Optional[WindTables]=None) -> sim.SimResult:
+    """Simulate riding path in wind, pass tables to reuse them for many winds"""
+    if tables is None:
+        tables = WindTables(path)
+    return sim.simulate(path, prm, headwind=tables.headwindFn(wind))
+
+def sweep(path: p.Path, prm: sim.Params, speeds: List[float], directions: List[float]=list(range(0, 360, 10))) -> np.ndarray:
+    """Return the finish times, indexed [direction, speed], riding path in each wind"""
+    tables: WindTables = WindTables(path)
+    times: np.ndarray = np.zeros((len(directions), len(speeds)))
+    i: int
+    j: int
+    for i, direction in enumerate(directions):
+        for j, speed in enumerate(speeds):
+            times[i, j] = simulate(path, prm, Wind(speed, direction), tables).t
+    return times
+
+def printSweep(speeds: List[float], directions: List[float], times: np.ndarray, calm: float) -> None:
+    """Print the finish time for each direction and speed and the change from calm"""
+    print(f"{'from':>5} " + ' '.join(f'{s:>6.1f}m/s' for s in speeds) + ' ' + ' '.join(f'{s:>6.1f}m/s' for s in speeds))
+    i: int
+    for i, direction in enumerate(directions):
+        print(f'{direction:>5.0f} ' + ' '.join(f'{sim.hms(t):>10}' for t in times[i]) + ' '
+              + ' '.join(f'{t - calm:>+9.0f}s' for t in times[i]))
+
+if __name__ == '__main__':
+    import sys
+    import track_file as tf
+
+    if len(sys.argv) > 1:
+        import argparse
+
+        parser = argparse.ArgumentParser(description='Finish times riding a route in winds from every direction.')
+        parser.add_argument('filename', type=str, help='.gpx, .tcx or .csv route')
+        parser.add_argument('--power', type=float, default=sim.power, help='power in watts')
+        parser.add_argument('--speeds', type=str, default='2,5,8', help='comma separated wind speeds in meters/sec')
+        parser.add_argument('--step', type=float, default=10.0, help='degrees between directions')
+        args = parser.parse_args()
+
+        route: p.Path = p.Path(tf.readTrackList(args.filename))
+        prm: sim.Params = sim.Params(power=args.power)
+        speeds: List[float] = [float(s) for s in args.speeds.split(',')]
+        directions: List[float] = list(np.arange(0.0, 360.0, args.step))
+        printSweep(speeds, directions, sweep(route, prm, speeds, directions), sim.simulate(route, prm).t)
+        sys.exit(0)
+
+    import unittest
+
+    gpx_test_file = './test/data/RAAM_TS00_route_snippet.gpx'
+
+    class TestWind(unittest.TestCase):
+
+        def setUp(self: TestWind):
+            self.path: p.Path = p.Path(tf.readTrackList(gpx_test_file))
+            self.tables: WindTables = WindTables(self.path)
+
+        def test_components(self: TestWind):
+            tl = self.path.trackList()
+            # The snippet heads north east, a wind from its bearing is all headwind
+            pt = tl[10]
+            wind: Wind = Wind(5.0, math.degrees(pt.brg))
+            self.assertAlmostEqual(self.tables.headwind(wind)[10], 5.0)
+            self.assertAlmostEqual(self.tables.crosswind(wind)[10], 0.0)
+            behind: Wind = Wind(5.0, math.degrees(pt.brg) + 180.0)
+            self.assertAlmostEqual(self.tables.headwind(behind)[10], -5.0)
+            right: Wind = Wind(5.0, math.degrees(pt.brg) + 90.0)
+            self.assertAlmostEqual(self.tables.crosswind(right)[10], 5.0)
+            # Speeds share the table of their direction
+            self.assertTrue(np.allclose(self.tables.headwind(Wind(2.0, 45.0)) * 2.0, self.tables.headwind(Wind(4.0, 45.0))))
+
+        def test_calm_matches_simulate(self: TestWind):
+            prm: sim.Params = sim.Params()
+            self.assertEqual(simulate(self.path, prm, Wind()).t, sim.simulate(self.path, prm).t)
+
+        def test_headwind_is_slower(self: TestWind):
+            prm: sim.Params = sim.Params()
+            brg: float = math.degrees(self.path.trackList()[10].brg)
+            calm: float = sim.simulate(self.path, prm).t
+            self.assertTrue(simulate(self.path, prm, Wind(5.0, brg), self.tables).t > calm)
+            self.assertTrue(simulate(self.path, prm, Wind(5.0, brg + 180.0), self.tables).t < calm)
+
+        def test_varying_winds(self: TestWind):
+            prm: sim.Params = sim.Params()
+            tl = self.path.trackList()
+            wind: Wind = Wind(4.0, tl[0].brgDeg(tl[-1]))
+            t: float = simulate(self.path, prm, wind, self.tables).t
+            # A field which is the same wind everywhere and always gives the same time
+            self.assertAlmostEqual(simulate(self.path, prm, DistanceWind((0.0, 700.0), (wind, wind)), self.tables).t, t)
+            self.assertAlmostEqual(simulate(self.path, prm, TimeWind((0.0, 60.0), (wind, wind)), self.tables).t, t)
+            half: DistanceWind = DistanceWind((0.0, 750.0), (Wind(), wind))
+            self.assertEqual(self.tables.headwind(half)[0], 0.0)
+            self.assertEqual(self.tables.headwind(half)[-2], self.tables.headwind(wind)[-2])
+            self.assertTrue(sim.simulate(self.path, prm).t < simulate(self.path, prm, half, self.tables).t < t)
+
+        def test_sweep(self: TestWind):
+            tl = self.path.trackList()
+            brg: float = tl[0].brgDeg(tl[-1])
+            times: np.ndarray = sweep(self.path, sim.Params(), [0.0, 5.0], [brg, brg + 90.0, brg + 180.0, brg + 270.0])
+            self.assertEqual(times.shape, (4, 2))
+            self.assertTrue(np.all(times[:, 0] == times[0, 0]))
+            # Into the wind is slowest and with it fastest
+            self.assertEqual(np.argmax(times[:, 1]), 0)
+            self.assertEqual(np.argmin(times[:, 1]), 2)
+
+    unittest.main()
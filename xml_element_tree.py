@@ -2,7 +2,6 @@
 
 # bike power calculation
 import math
-import numpy as np
 import xml.etree.ElementTree as et
 import track_point as tp
 